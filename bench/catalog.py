@@ -0,0 +1,152 @@
+"""
+Micro-benchmark of the court catalog.
+
+Writes a data file with many facilities and courts, then compares loading it
+from the JSON with loading it from the catalog cache, and expanding some
+preferences into availabilities by checking every court and grouping the
+availabilities with Preferences.group, as the booker used to, with the
+indexes of the catalog. Checks that both give the same groups.
+
+    python bench/catalog.py --facilities 60 --courts 20 --days 14
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from tennis import (  # noqa: E402
+    Availability,
+    Court,
+    DateTime,
+    Facility,
+    Preferences,
+    load_catalog,
+    parse_dates,
+    parse_times,
+)
+
+
+def make_data(facilities: int, courts: int) -> dict:
+    locations = [location.value for location in Court.Location]
+    surfaces = [surface.value for surface in Court.SurfaceType]
+    return {
+        "website": {"login_url": "http://login", "search_url": "http://search"},
+        "users": [
+            {"username": f"user{i}@example.com", "password": ""} for i in range(3)
+        ],
+        "tennis_facilities": [
+            {
+                "name": f"Facility {f}",
+                "leaflet_index": f,
+                "courts": [
+                    {
+                        "id": str(10000 + f * courts + c),
+                        "name": f"Court {c + 1}",
+                        "location": locations[c % len(locations)],
+                        "surface_type": surfaces[(c // 2) % len(surfaces)],
+                    }
+                    for c in range(courts)
+                ],
+            }
+            for f in range(facilities)
+        ],
+    }
+
+
+def linear(facilities: list, preferences: Preferences, dates: list) -> list:
+    """
+    Availabilities as the booker expanded them before the catalog: every
+    facility and court is checked, and all the availabilities are grouped.
+    """
+    facilities = [f for f in facilities if preferences.check(f)]
+    courts = [
+        court
+        for facility in facilities
+        for court in facility.courts
+        if preferences.check(court)
+    ]
+    availabilities = [
+        Availability(DateTime(date, time_), court)
+        for date in dates
+        for time_ in preferences.time_order
+        for court in courts
+    ]
+    return preferences.group(availabilities)
+
+
+def timed(function, repeat: int) -> tuple:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--facilities", type=int, default=60)
+    parser.add_argument("--courts", type=int, default=20)
+    parser.add_argument("--days", type=int, default=14)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    first = datetime.now() + timedelta(days=1)
+    dates = parse_dates(first.strftime("%d/%m/%Y"), args.days)
+    preferences = Preferences(
+        location=["indoor"],
+        surface_type=["synthetique", "beton_poreux"],
+        facility_order=[f"Facility {f}" for f in range(0, args.facilities, 3)],
+        time_order=parse_times("21h-18h,8h-10h"),
+        surface_order=["synthetique"],
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "data.json")
+        cache = os.path.join(directory, "catalog.pickle")
+        with open(path, "w") as f:
+            json.dump(make_data(args.facilities, args.courts), f)
+
+        def parse():
+            with open(path) as f:
+                data = json.load(f)
+            return [
+                Facility.from_dict(facility) for facility in data["tennis_facilities"]
+            ]
+
+        json_seconds, facilities = timed(parse, args.repeat)
+        # The first load writes the cache
+        load_catalog(path, cache)
+        cache_seconds, (_, _, catalog) = timed(
+            lambda: load_catalog(path, cache), args.repeat
+        )
+
+    linear_seconds, expected = timed(
+        lambda: linear(facilities, preferences, dates), args.repeat
+    )
+    catalog_seconds, groups = timed(
+        lambda: catalog.availabilities(preferences, dates), args.repeat
+    )
+
+    report = {
+        "courts": len(catalog.courts),
+        "availabilities": sum(map(len, groups)),
+        "groups": len(groups),
+        "load_json_ms": round(json_seconds * 1000, 2),
+        "load_cache_ms": round(cache_seconds * 1000, 2),
+        "linear_ms": round(linear_seconds * 1000, 2),
+        "catalog_ms": round(catalog_seconds * 1000, 2),
+        "speedup": round(linear_seconds / catalog_seconds, 2),
+        "same_groups": groups == expected,
+    }
+    print(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
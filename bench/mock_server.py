@@ -0,0 +1,523 @@
+"""
+Local stand-in for the login and tennis websites of Paris.
+
+The server reproduces the pages and forms the booker goes through: the login
+form, the search page with its date picker and map, the time panels and
+reserve buttons, the player form, the carnet payment page and the profile
+views of the current reservation and of the carnets. It serves both
+the login host (http://localhost:PORT) and the tennis host
+(http://127.0.0.1:PORT), so that being sent back to the login page can be
+detected like on the real websites.
+
+Run it on its own with:
+
+    python bench/mock_server.py --data data.json --port 8000
+"""
+
+import argparse
+import html
+import json
+import threading
+import time
+import uuid
+
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from typing import Dict, List, Optional
+
+PORTAL = "/tennis/jsp/site/Portal.jsp"
+CARNET_HTML = "J’utilise 1 heure<br>de mon carnet en ligne"
+RESERVE_CLASS = "btn btn-darkblue medium rollover rollover-grey buttonAllOk"
+ADD_PLAYER_CLASS = "btn btn-darkblue small addPlayer rollover rollover-grey"
+
+PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{title}</title></head>
+<body>{body}</body></html>"""
+
+SEARCH_SCRIPT = """
+<script>
+function pickDate(div) {
+  document.getElementById('whenInput').value = div.getAttribute('dateiso');
+}
+function showFacility(name) {
+  var panels = document.querySelectorAll('.facility');
+  for (var i = 0; i < panels.length; i++) {
+    panels[i].style.display = panels[i].dataset.name === name ? 'block' : 'none';
+  }
+}
+function openMarker(marker) {
+  var popup = document.getElementById('popup');
+  popup.innerHTML = '';
+  var link = document.createElement('a');
+  link.className = 'accessTennisMap';
+  link.href = '#';
+  link.textContent = marker.title;
+  link.onclick = function () { showFacility(marker.title); return false; };
+  popup.appendChild(link);
+}
+function togglePanel(title) {
+  var body = title.nextElementSibling;
+  body.style.display = body.style.display === 'none' ? 'block' : 'none';
+}
+function reserve(button) {
+  var form = document.getElementById('formReservation');
+  form.equipmentId.value = button.getAttribute('equipmentid');
+  form.courtId.value = button.getAttribute('courtid');
+  form.dateDeb.value = button.getAttribute('datedeb');
+  form.dateFin.value = button.getAttribute('datefin');
+  form.submit();
+}
+</script>
+"""
+
+PLAYERS_SCRIPT = """
+<script>
+function addPlayer() {
+  var players = document.getElementById('players');
+  ['player2_lastname', 'player2_firstname'].forEach(function (name) {
+    var input = document.createElement('input');
+    input.className = 'form-control required';
+    input.name = name;
+    players.appendChild(input);
+  });
+  return false;
+}
+</script>
+"""
+
+
+class MockState:
+    def __init__(
+        self,
+        facilities: List[dict],
+        release_at: float,
+        days_ahead: int = 7,
+        empty_carnets: Optional[List[str]] = None,
+        latency: float = 0.0,
+        reserved: Optional[List[str]] = None,
+    ):
+        """
+        State of the mock websites: the facilities and their courts, when the
+        courts of the last day are released, which courts and accounts are
+        taken, and request statistics. Reserved accounts start with a
+        reservation of another day.
+        """
+        self.facilities = facilities
+        self.release_at = release_at
+        self.days_ahead = days_ahead
+        self.empty_carnets = set(empty_carnets or [])
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.codes: Dict[str, str] = {}
+        self.sessions: Dict[str, str] = {}
+        self.pending: Dict[str, dict] = {}
+        self.taken: Dict[tuple, str] = {}
+        self.reservations: Dict[str, dict] = {
+            user: {"court_id": None, "datetime": None} for user in reserved or []
+        }
+        self.bookings: List[dict] = []
+        self.requests: Dict[str, int] = {}
+        self.first_request_at: Optional[float] = None
+        self.started_at = time.time()
+
+    def count(self, name: str) -> None:
+        with self.lock:
+            self.requests[name] = self.requests.get(name, 0) + 1
+            if self.first_request_at is None:
+                self.first_request_at = time.time()
+
+    def dates(self) -> List[date]:
+        """
+        Dates that can be booked. The last one only appears once released.
+        """
+        days = (
+            self.days_ahead if time.time() >= self.release_at else self.days_ahead - 1
+        )
+        today = date.today()
+        return [today + timedelta(days=d) for d in range(days + 1)]
+
+    def stats(self) -> dict:
+        with self.lock:
+            first = self.bookings[0]["booked_at"] if self.bookings else None
+            return {
+                "started_at": self.started_at,
+                "release_at": self.release_at,
+                "first_request_at": self.first_request_at,
+                "requests": dict(self.requests),
+                "bookings": list(self.bookings),
+                "time_to_book": None if first is None else first - self.release_at,
+            }
+
+
+def make_handler(state: MockState, port: int):
+    login_base = f"http://localhost:{port}"
+    tennis_base = f"http://127.0.0.1:{port}"
+    search_url = f"{tennis_base}{PORTAL}?page=recherche&view=recherche_creneau"
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        # Responses
+
+        def send_page(self, title: str, body: str, cookies: Dict[str, str] = None):
+            content = PAGE.format(title=title, body=body).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(content)))
+            for name, value in (cookies or {}).items():
+                self.send_header("Set-Cookie", f"{name}={value}; Path=/")
+            self.end_headers()
+            self.wfile.write(content)
+
+        def redirect(self, location: str, cookies: Dict[str, str] = None):
+            self.send_response(302)
+            self.send_header("Location", location)
+            self.send_header("Content-Length", "0")
+            for name, value in (cookies or {}).items():
+                self.send_header("Set-Cookie", f"{name}={value}; Path=/")
+            self.end_headers()
+
+        def send_json(self, data: dict):
+            content = json.dumps(data).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        # Helpers
+
+        def form(self) -> Dict[str, List[str]]:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length).decode("utf-8")
+            return parse_qs(body, keep_blank_values=True)
+
+        def user(self) -> Optional[str]:
+            for part in (self.headers.get("Cookie") or "").split(";"):
+                name, _, value = part.strip().partition("=")
+                if name == "JSESSIONID":
+                    return state.sessions.get(value)
+            return None
+
+        def query(self) -> Dict[str, str]:
+            url = urlparse(self.path)
+            return {k: v[0] for k, v in parse_qs(url.query).items()}
+
+        # Routing
+
+        def do_GET(self):
+            time.sleep(state.latency)
+            url = urlparse(self.path)
+            if url.path == "/auth/login":
+                return self.login_page()
+            if url.path == "/callback":
+                return self.callback()
+            if url.path == "/stats":
+                return self.send_json(state.stats())
+            if url.path == PORTAL and self.query().get("view") == "recherche_creneau":
+                return self.search_page()
+            if url.path == PORTAL and self.query().get("page") == "profil":
+                user = self.user()
+                if user is None:
+                    return self.redirect(f"{login_base}/auth/login")
+                return self.profile(user, self.query().get("view"))
+            self.send_error(404)
+
+        def do_POST(self):
+            time.sleep(state.latency)
+            form = self.form()
+            url = urlparse(self.path)
+            if url.path == "/auth/authenticate":
+                return self.authenticate(form)
+            if url.path != PORTAL:
+                return self.send_error(404)
+
+            action = self.query().get("action")
+            if action == "rechercher_creneau":
+                return self.search_results(form)
+
+            user = self.user()
+            if user is None:
+                return self.redirect(f"{login_base}/auth/login")
+            if action == "reservation_creneau":
+                return self.reserve(user, form)
+            if action == "validation_court":
+                return self.players(user, form)
+            if action == "paiement":
+                return self.pay(user, form)
+            self.send_error(404)
+
+        # Login
+
+        def login_page(self):
+            state.count("login_page")
+            self.send_page(
+                "Login",
+                '<form id="kc-form-login" action="/auth/authenticate" method="post">'
+                '<input id="username" name="username" type="text">'
+                '<input id="password" name="password" type="password">'
+                '<input type="hidden" name="credentialId" value="">'
+                '<input name="Submit" type="submit" value="Connexion">'
+                "</form>",
+            )
+
+        def authenticate(self, form: Dict[str, List[str]]):
+            state.count("login")
+            username = form.get("username", [""])[0]
+            if not username:
+                return self.login_page()
+            code = uuid.uuid4().hex
+            with state.lock:
+                state.codes[code] = username
+            # Like the OpenID redirect chain, the session cookie is set by the
+            # tennis host
+            self.redirect(f"{tennis_base}/callback?{urlencode({'code': code})}")
+
+        def callback(self):
+            with state.lock:
+                username = state.codes.pop(self.query().get("code"), None)
+            if username is None:
+                return self.redirect(f"{login_base}/auth/login")
+            token = uuid.uuid4().hex
+            with state.lock:
+                state.sessions[token] = username
+            self.redirect(search_url, cookies={"JSESSIONID": token})
+
+        # Search
+
+        def search_page(self):
+            state.count("search_page")
+            dates = "".join(
+                f'<div class="date" dateiso="{d.strftime("%d/%m/%Y")}" '
+                f'onclick="pickDate(this)">{d.isoformat()}</div>'
+                for d in state.dates()
+            )
+            self.send_page(
+                "Recherche",
+                SEARCH_SCRIPT
+                + f'<form id="search_form" action="{PORTAL}?page=recherche&amp;action=rechercher_creneau" method="post">'
+                + '<input id="whenInput" type="hidden" name="when" value="">'
+                + '<input type="hidden" name="hourRange" value="8-22">'
+                + '<input type="hidden" name="selWhereTennisName" value="">'
+                + '<input type="checkbox" name="selInOut" value="V" checked>'
+                + '<input type="checkbox" name="selInOut" value="F" checked>'
+                + '<div id="when" onclick="this.nextElementSibling.style.display=\'block\'">Quand</div>'
+                + f'<div class="dates" style="display:none">{dates}</div>'
+                + '<button id="rechercher" type="submit">Rechercher</button>'
+                + "</form>",
+            )
+
+        def search_results(self, form: Dict[str, List[str]]):
+            state.count("search")
+            when = form.get("when", [""])[0]
+            where = form.get("selWhereTennisName", [""])[0]
+            hours = form.get("hourRange", ["8-22"])[0].split("-")
+            hours = range(int(hours[0]), int(hours[1]))
+
+            released = {d.strftime("%d/%m/%Y") for d in state.dates()}
+            markers, facilities = [], []
+            size = max([f["leaflet_index"] for f in state.facilities] + [0]) + 1
+            by_index = {f["leaflet_index"]: f for f in state.facilities}
+            for i in range(size):
+                name = by_index[i]["name"] if i in by_index else f"Tennis {i}"
+                markers.append(
+                    f'<img class="leaflet-marker-icon" title="{html.escape(name)}" '
+                    f'onclick="openMarker(this)">'
+                )
+
+            for facility in state.facilities:
+                if where and facility["name"] != where:
+                    continue
+                panels = []
+                if when in released:
+                    for hour in hours:
+                        panels.append(self.time_panel(facility, when, hour))
+                facilities.append(
+                    f'<div class="facility" data-name="{html.escape(facility["name"])}" '
+                    f'style="display:none">{"".join(panels)}</div>'
+                )
+
+            self.send_page(
+                "Résultats",
+                SEARCH_SCRIPT
+                + f'<div class="leaflet-marker-pane">{"".join(markers)}</div>'
+                + '<div id="popup"></div>'
+                + "".join(facilities)
+                + f'<form id="formReservation" action="{PORTAL}?page=reservation&amp;action=reservation_creneau" method="post">'
+                + '<input type="hidden" name="equipmentId">'
+                + '<input type="hidden" name="courtId">'
+                + '<input type="hidden" name="dateDeb">'
+                + '<input type="hidden" name="dateFin">'
+                + '<input type="hidden" name="annulation" value="false">'
+                + "</form>",
+            )
+
+        def time_panel(self, facility: dict, when: str, hour: int) -> str:
+            day = datetime.strptime(when, "%d/%m/%Y")
+            start = day.replace(hour=hour).strftime("%Y/%m/%d %H:%M:%S")
+            end = day.replace(hour=hour + 1).strftime("%Y/%m/%d %H:%M:%S")
+            buttons = []
+            for court in facility["courts"]:
+                if (court["id"], start) in state.taken:
+                    continue
+                buttons.append(
+                    f'<button class="{RESERVE_CLASS}" equipmentid="{facility["leaflet_index"]}" '
+                    f'courtid="{court["id"]}" datedeb="{start}" datefin="{end}" '
+                    f'onclick="reserve(this)">{html.escape(court["name"])}</button>'
+                )
+            return (
+                f'<div class="panel-title" onclick="togglePanel(this)">{hour}h</div>'
+                f'<div class="panel-body" style="display:none">{"".join(buttons)}</div>'
+            )
+
+        # Reservation
+
+        def reserve(self, user: str, form: Dict[str, List[str]]):
+            state.count("reserve")
+            form = {k: v[0] for k, v in form.items()}
+            key = (form.get("courtId"), form.get("dateDeb"))
+            with state.lock:
+                if user in state.reservations or user in state.pending:
+                    holds = False
+                elif key in state.taken:
+                    return self.send_page("Indisponible", "<p>Créneau indisponible</p>")
+                else:
+                    state.taken[key] = user
+                    state.pending[user] = {"court_id": key[0], "datetime": key[1]}
+                    holds = True
+
+            if not holds:
+                return self.send_page(
+                    "Réservation", "<p>Vous avez déjà une réservation</p>"
+                )
+
+            self.send_page(
+                "Réservation",
+                PLAYERS_SCRIPT
+                + f'<form action="{PORTAL}?page=reservation&amp;action=validation_court" method="post">'
+                + '<div id="players">'
+                + '<input class="form-control required" name="player1_lastname">'
+                + '<input class="form-control required" name="player1_firstname">'
+                + "</div>"
+                + f'<button class="{ADD_PLAYER_CLASS}" type="button" onclick="return addPlayer()">Ajouter</button>'
+                + '<button id="submitControle" type="submit">Valider</button>'
+                + "</form>",
+            )
+
+        def players(self, user: str, form: Dict[str, List[str]]):
+            state.count("players")
+            if user in state.empty_carnets:
+                return self.send_page("Paiement", "<p>Paiement par carte</p>")
+            self.send_page(
+                "Paiement",
+                f'<form action="{PORTAL}?page=reservation&amp;action=paiement" method="post">'
+                + f'<table><tr><td><input type="radio" name="paymentMode" value="existingTicket">{CARNET_HTML}</td></tr></table>'
+                + '<button id="submit" type="submit">Payer</button>'
+                + "</form>",
+            )
+
+        def pay(self, user: str, form: Dict[str, List[str]]):
+            state.count("pay")
+            with state.lock:
+                reservation = state.pending.pop(user, None)
+                if reservation is None:
+                    return self.send_page("Erreur", "<p>Aucune réservation</p>")
+                reservation = dict(reservation, username=user, booked_at=time.time())
+                state.reservations[user] = reservation
+                state.bookings.append(reservation)
+            self.send_page("Confirmation", "<p>Réservation confirmée</p>")
+
+        # Profile
+
+        def profile(self, user: str, view: Optional[str]):
+            state.count(f"profile_{view}")
+            if view == "ma_reservation":
+                if user not in state.reservations:
+                    return self.send_page(
+                        "Ma réservation",
+                        "<p>Vous n’avez pas de réservation en cours</p>",
+                    )
+                return self.send_page(
+                    "Ma réservation",
+                    "<p>Réservation en cours</p>"
+                    + '<button type="submit">Annuler ma réservation</button>',
+                )
+            if view == "mes_tickets_reservation":
+                hours = 0 if user in state.empty_carnets else 10
+                return self.send_page(
+                    "Mes carnets",
+                    f"<p>Carnet de 10 heures : {hours} heures restantes</p>",
+                )
+            self.send_error(404)
+
+    return Handler
+
+
+class MockServer:
+    def __init__(self, state: MockState, port: int = 0):
+        """
+        Mock websites served from a background thread.
+        """
+        self.state = state
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), None)
+        self.port = self.httpd.server_address[1]
+        self.httpd.RequestHandlerClass = make_handler(state, self.port)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def website(self) -> dict:
+        """
+        Website section of a data file pointing to this server.
+        """
+        return {
+            "login_url": f"http://localhost:{self.port}/auth/login",
+            "search_url": f"http://127.0.0.1:{self.port}{PORTAL}?page=recherche&view=recherche_creneau#!",
+        }
+
+    def start(self) -> "MockServer":
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", type=str, default="data.json")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--release-in",
+        type=float,
+        default=0,
+        help="Number of seconds after which the courts of the last day are released.",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0, help="Latency of every request in seconds."
+    )
+    args = parser.parse_args()
+
+    with open(args.data, "r") as f:
+        data = json.load(f)
+
+    state = MockState(
+        data["tennis_facilities"], time.time() + args.release_in, latency=args.latency
+    )
+    server = MockServer(state, args.port)
+    print(json.dumps(server.website, indent=4))
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(state.stats(), indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""
+Benchmark of the booker against the local stand-in of the websites.
+
+The benchmark starts the mock server, writes a data file pointing to it, runs
+src/main.py with the given options until a court is booked, and reports the
+number of attempts per second, the time it took to book after the release,
+the CPU and memory used by each worker, and how long it took from the start
+of the booker to the first request and to the start of each worker.
+
+    python bench/run.py --engine http --workers 4 --latency 0.05 --release-in 5
+    python bench/run.py --workers 2 --prewarm -- --max-driver-uses 20
+    python bench/run.py --engine http --workers 8 -- --start-method forkserver
+    python bench/run.py --engine http --workers 4 --latency 0.05 --prewarm
+
+Options after -- are passed to src/main.py.
+"""
+
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from datetime import date, timedelta
+from typing import Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from mock_server import MockServer, MockState  # noqa: E402
+from tennis.metrics import process_usage  # noqa: E402
+
+
+def children(pid: int) -> list:
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        if int(stat[stat.rindex(")") + 2 :].split()[1]) == pid:
+            pids.append(int(entry))
+    return pids
+
+
+def workers(pid: int) -> list:
+    """
+    Worker processes of the booker, which are forked by the forkserver
+    rather than by the booker with --start-method forkserver.
+    """
+    pids = []
+    for child in children(pid):
+        try:
+            with open(f"/proc/{child}/cmdline", "rb") as f:
+                cmdline = f.read().decode(errors="replace")
+        except OSError:
+            continue
+        if "multiprocessing.forkserver" in cmdline:
+            pids += children(child)
+        elif "multiprocessing.resource_tracker" not in cmdline:
+            pids.append(child)
+    return pids
+
+
+def percentiles(values: list) -> Optional[dict]:
+    if not values:
+        return None
+    values = sorted(values)
+    return {
+        "p50": round(values[len(values) // 2], 3),
+        "max": round(values[-1], 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", type=str, default=os.path.join(ROOT, "data.json"))
+    parser.add_argument("--engine", type=str, default="selenium")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--users", type=int, default=3)
+    parser.add_argument("--time", type=str, default="21h", help="format: 08h")
+    parser.add_argument(
+        "--latency", type=float, default=0, help="Latency of every request in seconds."
+    )
+    parser.add_argument(
+        "--release-in",
+        type=float,
+        default=5,
+        help="Number of seconds after the start at which courts are released.",
+    )
+    parser.add_argument(
+        "--prewarm",
+        action="store_true",
+        default=False,
+        help="Pass the release time to the booker with --release-at.",
+    )
+    parser.add_argument(
+        "--empty-carnet",
+        type=int,
+        default=0,
+        help="Number of users whose carnet is empty.",
+    )
+    parser.add_argument(
+        "--reserved",
+        type=int,
+        default=0,
+        help="Number of users that already have a reservation, after the ones whose carnet is empty.",
+    )
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--interval", type=float, default=0.5)
+    parser.add_argument("extra", nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    with open(args.data, "r") as f:
+        data = json.load(f)
+
+    users = [
+        {"username": f"bench{i}@example.com", "password": "secret"}
+        for i in range(args.users)
+    ]
+
+    # --release-at has a one second resolution
+    release_at = math.ceil(time.time() + args.release_in)
+    state = MockState(
+        data["tennis_facilities"],
+        release_at,
+        empty_carnets=[u["username"] for u in users[: args.empty_carnet]],
+        latency=args.latency,
+        reserved=[
+            u["username"]
+            for u in users[args.empty_carnet : args.empty_carnet + args.reserved]
+        ],
+    )
+    server = MockServer(state).start()
+
+    data = dict(data, website=server.website, users=users)
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump(data, f)
+        data_path = f.name
+
+    target = date.today() + timedelta(days=state.days_ahead)
+    command = [
+        sys.executable,
+        os.path.join(ROOT, "src", "main.py"),
+        "--data",
+        data_path,
+        "--date",
+        target.strftime("%d/%m/%Y"),
+        "--time",
+        args.time,
+        "--workers",
+        str(args.workers),
+        "--engine",
+        args.engine,
+        "--headless",
+        # Every run checks the users of its own mock server
+        "--eligibility-cache",
+        "",
+    ]
+    if args.prewarm:
+        command += [
+            "--release-at",
+            time.strftime("%H:%M:%S", time.localtime(release_at)),
+        ]
+    command += [a for a in args.extra if a != "--"]
+
+    # Logs of the booker, read for the startup of its workers
+    output = tempfile.TemporaryFile("w+")
+    started_at = time.time()
+    process = subprocess.Popen(
+        command, cwd=ROOT, stdout=output, stderr=subprocess.DEVNULL
+    )
+
+    usage = {}
+    while process.poll() is None and time.time() - started_at < args.timeout:
+        for pid in workers(process.pid):
+            sample = process_usage(pid)
+            peak = usage.get(pid, {}).get("peak_rss_mb", 0)
+            usage[pid] = dict(sample, peak_rss_mb=max(peak, sample["rss_mb"]))
+        time.sleep(args.interval)
+
+    if process.poll() is None:
+        process.terminate()
+        process.wait()
+    finished_at = time.time()
+
+    stats = state.stats()
+    server.stop()
+    os.remove(data_path)
+
+    startups = []
+    output.seek(0)
+    for line in output:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if record.get("msg", "").startswith("Worker") and "startup" in record:
+            startups.append(record["startup"])
+    output.close()
+
+    first = stats["first_request_at"]
+
+    searches = stats["requests"].get("search", 0)
+    report = {
+        "engine": args.engine,
+        "workers": args.workers,
+        "users": args.users,
+        "latency": args.latency,
+        "prewarm": args.prewarm,
+        "duration": round(finished_at - started_at, 3),
+        "attempts": searches,
+        "attempts_per_second": round(searches / (finished_at - started_at), 2),
+        "time_to_book": (
+            None if stats["time_to_book"] is None else round(stats["time_to_book"], 3)
+        ),
+        "first_request": None if first is None else round(first - started_at, 3),
+        "worker_startup": percentiles(startups),
+        # More than one means that workers raced each other into the payment
+        "courts_booked": len(stats["bookings"]),
+        "bookings": stats["bookings"],
+        "requests": stats["requests"],
+        "workers_usage": [dict(pid=pid, **u) for pid, u in usage.items()],
+    }
+    print(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
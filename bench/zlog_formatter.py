@@ -0,0 +1,91 @@
+"""
+Micro-benchmark of the zlog formatters.
+
+Formats the same records with LogFormatter and FastLogFormatter, checks that
+both produce the same output and reports the number of records formatted per
+second by each of them, in plain and pretty mode.
+
+    python bench/zlog_formatter.py --records 20000
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+from zlog.formatter import FastLogFormatter, LogFormatter  # noqa: E402
+
+
+def make_records(count: int) -> list:
+    """
+    Records like the ones logged by the workers: attempt timings with their
+    fields, and plain messages.
+    """
+    records = []
+    now = time.time()
+    for i in range(count):
+        if i % 2 == 0:
+            msg = "Attempt timings"
+            args = {
+                "action": "book",
+                "outcome": "failure",
+                "total_ms": 182.4,
+                "search_ms": 95.1,
+                "leaflet_ms": 40.2,
+                "time_ms": 47.1,
+                "username": "user@example.com",
+                "availability": "Elisabeth Court 6 (1111) 2022/09/24 21:00:00",
+                "failed_step": "time",
+            }
+        else:
+            msg, args = "Searched for available courts.", None
+        record = logging.LogRecord(
+            "root", logging.INFO, __file__, 42, msg, None, None, "main"
+        )
+        record.args = args
+        # Spread the records over a few seconds like a busy worker would
+        record.created = now + i * 0.0005
+        records.append(record)
+    return records
+
+
+def run(formatter, records: list) -> tuple:
+    start = time.perf_counter()
+    output = [formatter.format(record) for record in records]
+    return len(records) / (time.perf_counter() - start), output
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=20000)
+    parser.add_argument(
+        "--pretty-records",
+        type=int,
+        default=500,
+        help="Number of records formatted in pretty mode, which is much slower.",
+    )
+    args = parser.parse_args()
+
+    report = {}
+    for pretty, count in ((False, args.records), (True, args.pretty_records)):
+        records = make_records(count)
+        mode = "pretty" if pretty else "plain"
+        current, expected = run(LogFormatter(pretty=pretty), records)
+        fast, output = run(FastLogFormatter(pretty=pretty), records)
+        report[mode] = {
+            "records": count,
+            "current_records_per_second": round(current),
+            "fast_records_per_second": round(fast),
+            "speedup": round(fast / current, 2),
+            "same_output": output == expected,
+        }
+    print(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
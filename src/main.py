@@ -1,159 +1,781 @@
 import argparse
 import zlog
 import multiprocessing
+import multiprocessing.forkserver
 import logging
-import json
+import os
+import signal
+import socket
+import sys
+import time
 
-from multiprocessing.synchronize import Event
+from multiprocessing.synchronize import Barrier
+from threading import BrokenBarrierError
 
+from tennis.cluster import Client, parse_address
 from tennis import (
-    Facility,
     Court,
     User,
     Booker,
-    Website,
+    CdpBooker,
+    HttpBooker,
+    Poller,
+    Monitor,
+    Agent,
+    Coordinator,
+    RemoteAccountLocks,
+    RemoteBookingClaim,
+    RemoteScheduler,
+    RateController,
+    Supervisor,
+    Scheduler,
+    AccountLocks,
+    BookingClaim,
+    StopFlag,
+    Timeouts,
+    LaunchProfile,
+    ArtifactWriter,
     Availability,
-    DateTime,
     Preferences,
+    CookieCache,
+    EligibilityCache,
+    check_eligibility,
+    load_catalog,
+    parse_dates,
+    parse_release_at,
+    parse_times,
+    process_started_at,
+    process_usage,
+    wait_until,
 )
 
-from typing import List, Tuple
+from typing import List, Optional, Union
 
 
-def load_data(data: str) -> Tuple[Website, List[User], List[Court]]:
-    with open(data, "r") as f:
-        data = json.load(f)
+def split(values: Optional[str]) -> Optional[List[str]]:
+    return values.split(",") if values else None
 
-    tennis_facilities = [
-        Facility.from_dict(tennis_facility)
-        for tennis_facility in data["tennis_facilities"]
-    ]
 
-    courts = [
-        court
-        for tennis_facility in tennis_facilities
-        for court in tennis_facility.courts
-    ]
+def prewarm(
+    booker: Union[Booker, HttpBooker],
+    users: List[User],
+    release_at: float,
+    lead: float,
+    ready: Barrier,
+) -> None:
+    """
+    Log in every user and park their browsers on the search page shortly
+    before the release, then wait for the other workers and for the release
+    time so that the whole fleet starts at once.
+    """
+    wait_until(release_at - lead)
+
+    for user in users:
+        if not booker.prepare(user):
+            logging.warning(f"Failed to prepare the browser of {user.username}.")
+
+    logging.info("Browsers ready, waiting for the release.")
+
+    try:
+        ready.wait(timeout=max(0, release_at - time.time()))
+    except BrokenBarrierError:
+        logging.warning("Not all workers were ready before the release.")
 
-    users = [User(**user) for user in data["users"]]
-    website = Website(**data["website"])
+    wait_until(release_at)
 
-    return website, users, courts
+    logging.info("Release time reached.")
 
 
 def worker(
-    website,
-    headless: bool,
+    booker: Union[Booker, HttpBooker],
+    slot: int,
+    scheduler: Scheduler,
     users: List[User],
-    availabilities: List[Availability],
-    booked: Event,
+    groups: List[List[Availability]],
+    booked: StopFlag,
+    release_at: Optional[float],
+    prewarm_lead: float,
+    ready: Barrier,
+    concurrency: int,
+    rate: RateController,
+    started_at: float,
+    log_options: Optional[dict],
 ) -> None:
 
-    booker = Booker(website, headless)
+    # Lead a process group so that the browsers can be killed with the worker
+    os.setsid()
 
-    while True:
-        if booked.is_set():
+    # Turn terminate() into a normal exit so that the browsers get closed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    # Workers that were not forked from the main process log through its queue
+    if log_options is not None:
+        zlog.configure(**log_options)
+
+    # Launch the spare browsers while the worker gets ready
+    if isinstance(booker, Booker):
+        booker.pool.fill()
+
+    now = time.time()
+    logging.info(
+        f"Worker {slot} started.",
+        {
+            "startup": round(now - started_at, 3),
+            "spawn": round(now - (process_started_at(os.getpid()) or now), 3),
+            "start_method": multiprocessing.get_start_method(),
+        },
+    )
+
+    try:
+        # Workers restarted after the release start searching right away
+        if release_at is not None and time.time() < release_at:
+            prewarm(booker, users, release_at, prewarm_lead, ready)
+
+        if isinstance(booker, HttpBooker) and concurrency > 1:
+            poller = Poller(booker, concurrency, rate)
+            if poller.run(users, groups, booked.is_set, offset=slot):
+                booked.set()
             return
 
-        for user in users:
-            for availability in availabilities:
-                success = booker.book(user, availability)
-                if success:
-                    booked.set()
-                    return
+        while not booked.is_set():
+            job = scheduler.take(slot, timeout=0.1)
+            if job is None:
+                continue
+
+            index, user, group = job
+            facility_name = group[0].court.facility_name
+            delay = rate.acquire(user.username, facility_name)
+            if delay > 0:
+                # Let another job go first instead of waiting for this one
+                scheduler.put_back(slot, index, attempted=False)
+                booked.wait(min(delay, 0.05))
+                continue
+
+            success = booker.book(user, group)
+            rate.report(user.username, facility_name, booker.timings.last())
+            scheduler.put_back(slot, index)
+            if success:
+                booked.set()
+                return
+    finally:
+        booker.close()
+        booker.timings.log_summary()
+        if booked.is_set():
+            logging.info(
+                "Worker stopped.", {"stop_latency": round(booked.latency(), 3)}
+            )
+
+
+def monitor(
+    booker: HttpBooker,
+    users: List[User],
+    groups: List[List[Availability]],
+    booked: StopFlag,
+    interval: float,
+) -> None:
+    try:
+        if Monitor(booker, interval).run(users, groups, booked.is_set):
+            booked.set()
+    except KeyboardInterrupt:
+        logging.info("Monitor interrupted.")
+    finally:
+        booker.close()
+        booker.timings.log_summary()
+
+
+def log_usage(processes: List[Optional[multiprocessing.Process]]) -> None:
+    """
+    Log the CPU time and memory used by each worker, including its browsers.
+    """
+    usages = []
+    for slot, process in enumerate(processes):
+        if process is not None and process.is_alive():
+            usage = process_usage(process.pid)
+            logging.info(f"Usage of worker {slot}.", dict(usage, pid=process.pid))
+            usages.append(usage)
+
+    if usages:
+        logging.info(
+            "Usage of the workers.",
+            {
+                "workers": len(usages),
+                "cpu_seconds": round(sum(u["cpu_seconds"] for u in usages), 2),
+                "rss_mb": round(sum(u["rss_mb"] for u in usages), 1),
+                "rss_mb_per_worker": round(
+                    sum(u["rss_mb"] for u in usages) / len(usages), 1
+                ),
+            },
+        )
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--data", type=str, default="data.json")
+    parser.add_argument(
+        "--catalog-cache",
+        type=str,
+        default="data/catalog.pickle",
+        help="Path of a file where the parsed data file is cached, so that later runs do not parse it again as long as it does not change. Empty to disable.",
+    )
     parser.add_argument(
         "--tennis-facility",
         type=str,
         default=None,
         required=False,
-        help="Name of the tennis facility. If not specified, all tennis facilities will be considered.",
+        help="Names of the tennis facilities, separated by commas. If not specified, all tennis facilities will be considered.",
+    )
+    parser.add_argument(
+        "--facility-order",
+        type=str,
+        default=None,
+        help="Names of tennis facilities from the most to the least preferred, separated by commas. Preferred facilities are searched first, and facilities that are not listed come last.",
     )
     parser.add_argument(
         "--location",
         type=str,
         default=None,
-        choices=["indoor", "outdoor"],
         required=False,
-        help="Location (indoor or outdoor). If not specified, both will be considered.",
+        help="Locations (indoor or outdoor), separated by commas. If not specified, both will be considered.",
     )
     parser.add_argument(
         "--surface-type",
         type=str,
         default=None,
-        choices=["synthetique", "beton_poreux"],
         required=False,
-        help="Surface type (synthetique or beton_poreux). If not specified, both will be considered.",
+        help="Surface types (synthetique or beton_poreux), separated by commas. If not specified, both will be considered.",
     )
     parser.add_argument(
         "--court-id",
         type=str,
         default=None,
         required=False,
-        help="Court ID. If not specified, all courts will be considered.",
+        help="Court IDs, separated by commas. If not specified, all courts will be considered.",
     )
     parser.add_argument(
         "--username",
         type=str,
         default=None,
         required=False,
-        help="Username. If not specified, all users will be used.",
+        help="Usernames, separated by commas. If not specified, all users will be used.",
+    )
+    parser.add_argument(
+        "--date",
+        type=str,
+        help="format: 01/01/2022. Several dates or ranges of dates can be given, e.g. 24/09/2022-30/09/2022,08/10/2022.",
+        required=True,
+    )
+    parser.add_argument(
+        "--days",
+        type=int,
+        default=1,
+        help="Number of consecutive days to consider, starting at each date of --date that is not a range.",
+    )
+    parser.add_argument(
+        "--time",
+        type=str,
+        help="format: 08h. Several times or ranges of times can be given from the most to the least preferred, e.g. 21h,20h or 21h-18h.",
+        required=True,
+    )
+    parser.add_argument(
+        "--surface-order",
+        type=str,
+        default=None,
+        help="Surface types from the most to the least preferred, e.g. beton_poreux,synthetique. Courts available at the same time are booked in that order.",
+    )
+    parser.add_argument(
+        "--court-order",
+        type=str,
+        default=None,
+        help="Court IDs from the most to the least preferred. Courts available at the same time and with the same surface type are booked in that order.",
+    )
+    parser.add_argument(
+        "--release-at",
+        type=str,
+        default=None,
+        help="Local time at which courts are released, format: 08:00:00. If specified, workers log in and open the search page ahead of time and all start at that time.",
+    )
+    parser.add_argument(
+        "--prewarm-seconds",
+        type=float,
+        default=60,
+        help="Number of seconds before the release time at which workers get their browsers ready.",
+    )
+    parser.add_argument(
+        "--engine",
+        type=str,
+        default="selenium",
+        choices=["selenium", "cdp", "http"],
+        help="Booking engine. The cdp engine drives the browser through the DevTools protocol, with one script per step, and reads the search results from the network. The http engine replays the forms of the website without a browser, and only uses a browser to login if the login form cannot be submitted.",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1,
+        help="Number of concurrent searches per worker. Only used with the http engine.",
     )
-    parser.add_argument("--date", type=str, help="format: 01/01/2022", required=True)
-    parser.add_argument("--time", type=str, help="format: 08h", required=True)
     parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument(
+        "--coordinator",
+        type=str,
+        default=None,
+        help="Address to listen on, format: 0.0.0.0:7000. Instead of starting workers, hand out the searches to the agents connected to this address, and tell all of them to stop once one of them booked a court.",
+    )
+    parser.add_argument(
+        "--agent",
+        type=str,
+        default=None,
+        help="Address of a coordinator, format: 10.0.0.1:7000. Workers take their searches from the coordinator, and stop when any agent booked a court.",
+    )
+    parser.add_argument(
+        "--agent-name",
+        type=str,
+        default=None,
+        help="Name of the agent in the logs of the coordinator. Defaults to the host name and the process ID.",
+    )
+    parser.add_argument(
+        "--monitor",
+        action="store_true",
+        default=False,
+        help="Instead of starting workers, keep searching the wanted dates and times over HTTP in a single process, log the slots that are released and taken, and book a wanted court as soon as one is free, e.g. after a cancellation.",
+    )
+    parser.add_argument(
+        "--monitor-interval",
+        type=float,
+        default=2,
+        help="Number of seconds between two searches of the monitor.",
+    )
+    parser.add_argument(
+        "--restart-backoff",
+        type=float,
+        default=1,
+        help="Number of seconds before restarting a worker that died. The delay doubles with every death in a row, up to a minute.",
+    )
+    parser.add_argument(
+        "--max-restarts",
+        type=int,
+        default=100,
+        help="Number of times a worker is restarted before giving up on it.",
+    )
+    parser.add_argument(
+        "--stop-timeout",
+        type=float,
+        default=5,
+        help="Number of seconds given to workers to stop once a court is booked, after which they are terminated.",
+    )
+    parser.add_argument(
+        "--user-rate",
+        type=float,
+        default=2,
+        help="Maximum number of attempts per second with a given user, shared by all the workers. 0 disables the limit.",
+    )
+    parser.add_argument(
+        "--facility-rate",
+        type=float,
+        default=10,
+        help="Maximum number of attempts per second at a given facility, shared by all the workers. 0 disables the limit.",
+    )
+    parser.add_argument(
+        "--burst-factor",
+        type=float,
+        default=5,
+        help="Factor applied to the rates during the burst window around --release-at.",
+    )
+    parser.add_argument(
+        "--burst-seconds",
+        type=float,
+        default=60,
+        help="Number of seconds after --release-at during which rates are multiplied by --burst-factor and the failures expected before the release are not backed off from.",
+    )
     parser.add_argument("--headless", action="store_true", default=False)
+    parser.add_argument(
+        "--spare-browsers",
+        type=int,
+        default=0,
+        help="Number of idle browsers each worker launches ahead, so that logging in a user or replacing a browser does not wait for Chrome to start.",
+    )
+    parser.add_argument(
+        "--start-method",
+        type=str,
+        default="fork",
+        choices=["fork", "forkserver", "spawn"],
+        help="How worker processes are started. With forkserver, a server process imports the modules of the workers once and forks them, instead of forking the main process.",
+    )
+    parser.add_argument(
+        "--max-driver-uses",
+        type=int,
+        default=50,
+        help="Number of booking attempts after which a browser is restarted.",
+    )
+    parser.add_argument(
+        "--step-timeouts",
+        type=str,
+        default="",
+        help="Maximum number of seconds to wait for the elements of each step, e.g. search=3,time=1.5. Steps: login, search, date, leaflet, facility, time, players, payment.",
+    )
+    parser.add_argument(
+        "--chrome-profile",
+        type=str,
+        default="",
+        help="Options of the browsers, e.g. block_images=0,window_size=800x600. Options: block_images, block_fonts, block_tiles, block_analytics (1 or 0, all 1 by default), window_size (1024x768 by default), user_data_root (directory of the browser profiles, /dev/shm by default, empty for Chrome's default).",
+    )
+    parser.add_argument(
+        "--artifacts-dir",
+        type=str,
+        default="data/artifacts",
+        help="Directory where the page source and a screenshot of a sample of the failed attempts are saved. Empty to save none.",
+    )
+    parser.add_argument(
+        "--artifacts-first",
+        type=int,
+        default=5,
+        help="Number of failures of each kind whose artifacts are all saved.",
+    )
+    parser.add_argument(
+        "--artifacts-every",
+        type=int,
+        default=50,
+        help="After the first ones, save the artifacts of one out of every this many failures of each kind. 0 saves none.",
+    )
+    parser.add_argument(
+        "--artifacts-max-mb",
+        type=float,
+        default=100,
+        help="Size of the artifacts directory above which the oldest artifacts are removed.",
+    )
+    parser.add_argument(
+        "--usage-interval",
+        type=float,
+        default=30,
+        help="Number of seconds between two reports of the CPU time and memory used by each worker and its browsers. 0 disables the reports.",
+    )
+    parser.add_argument(
+        "--cookie-cache",
+        type=str,
+        default=None,
+        help="Path of a file where login cookies are shared between workers. If not specified, every browser logs in through the login form.",
+    )
+    parser.add_argument(
+        "--cookie-ttl",
+        type=float,
+        default=1800,
+        help="Number of seconds during which cached login cookies are reused.",
+    )
+    parser.add_argument(
+        "--preflight",
+        type=str,
+        default="pause",
+        choices=["off", "pause", "drop"],
+        help="Before starting, read the profile of every user to find the ones that already have a reservation or whose carnet is empty. drop leaves them out of the run, pause leaves them out until their profile is --eligibility-ttl seconds old and then gives them attempts again.",
+    )
+    parser.add_argument(
+        "--eligibility-cache",
+        type=str,
+        default="data/eligibility.json",
+        help="Path of a file where the results of --preflight are cached. Empty to check every user on every run.",
+    )
+    parser.add_argument(
+        "--eligibility-ttl",
+        type=float,
+        default=600,
+        help="Number of seconds during which the results of --preflight are reused, and users paused by it are left out.",
+    )
     parser.add_argument("--logger-pretty", action="store_true", default=False)
+    parser.add_argument(
+        "--logger-queue-size",
+        type=int,
+        default=10000,
+        help="Number of log records that can wait to be written. Records of all the processes are written by the main process, and records logged while the queue is full are dropped. 0 writes records directly from each process.",
+    )
     args = parser.parse_args()
 
-    zlog.configure(pretty=args.logger_pretty)
+    started_at = process_started_at(os.getpid()) or time.time()
+
+    multiprocessing.set_start_method(args.start_method)
+    if args.start_method == "forkserver":
+        # The server imports what the workers need once, while the main
+        # process gets ready, and every worker is forked from it. It is not
+        # given the path of this script, so the packages are preloaded by
+        # name from the directory the server inherits through PYTHONPATH.
+        src = os.path.dirname(os.path.abspath(__file__))
+        os.environ["PYTHONPATH"] = os.pathsep.join(
+            filter(None, [src, os.environ.get("PYTHONPATH")])
+        )
+        preload = ["tennis", "zlog"]
+        if args.engine != "http":
+            preload.append("selenium.webdriver")
+        multiprocessing.set_forkserver_preload(preload)
+        multiprocessing.forkserver.ensure_running()
+
+    zlog.configure(
+        pretty=args.logger_pretty, fast=True, queue_size=args.logger_queue_size
+    )
+
+    for name, choices in (
+        ("location", [location.value for location in Court.Location]),
+        ("surface_type", [surface.value for surface in Court.SurfaceType]),
+    ):
+        for value in split(getattr(args, name)) or []:
+            if value not in choices:
+                parser.error(
+                    f"argument --{name.replace('_', '-')}: invalid choice: {value!r} (choose from {', '.join(choices)})"
+                )
 
     preferences = Preferences(
-        tennis_facility=args.tennis_facility,
-        location=args.location,
-        surface_type=args.surface_type,
-        court_id=args.court_id,
-        username=args.username,
+        tennis_facility=split(args.tennis_facility),
+        location=split(args.location),
+        surface_type=split(args.surface_type),
+        court_id=split(args.court_id),
+        username=split(args.username),
+        facility_order=split(args.facility_order),
+        time_order=parse_times(args.time),
+        surface_order=split(args.surface_order),
+        court_order=split(args.court_order),
     )
 
-    website, users, courts = load_data(args.data)
+    website, users, catalog = load_catalog(args.data, args.catalog_cache or None)
 
     users = [user for user in users if preferences.check(user)]
     for user in users:
         logging.info(f"Will use user: {user}")
 
-    courts = [court for court in courts if preferences.check(court)]
+    tennis_facilities = catalog.select_facilities(preferences)
+    if args.tennis_facility is not None and not tennis_facilities:
+        logging.error(f"Unknown tennis facility: {args.tennis_facility}")
 
-    date_time = DateTime(args.date, args.time)
-    availabilities = []
+    courts = catalog.select(preferences)
     for court in courts:
-        availabilities.append(Availability(date_time, court))
-        logging.info(f"Availability {availabilities[-1]} will be considered.")
+        logging.info(f"Court {court} will be considered.")
 
-    manager = multiprocessing.Manager()
-    booked = manager.Event()
+    dates = parse_dates(args.date, args.days)
+    logging.info(
+        "Dates and times will be considered.",
+        {"dates": dates, "times": preferences.time_order},
+    )
 
-    logging.info(f"Starting {args.workers} workers.")
+    # Availabilities of the same page are checked by a single attempt
+    groups = catalog.availabilities(preferences, dates)
+    logging.info(
+        f"{len(groups)} searches cover {sum(map(len, groups))} availabilities."
+    )
+
+    if args.coordinator is not None:
+        coordinator = Coordinator(parse_address(args.coordinator), users, groups)
+        coordinator.start().run()
+        # Give the agents time to hear about the booking
+        time.sleep(1)
+        coordinator.stop()
+        logging.info("Done.")
+        return
+
+    cookie_cache = None
+    if args.cookie_cache is not None:
+        cookie_cache = CookieCache(args.cookie_cache, ttl=args.cookie_ttl)
+
+    booked = StopFlag()
+
+    if args.agent is not None:
+        name = args.agent_name or f"{socket.gethostname()}-{os.getpid()}"
+        client = Client(parse_address(args.agent), name)
+        account_locks = RemoteAccountLocks(client)
+        # Workers of every agent that find a court at the same time only pay
+        # for one
+        claim = RemoteBookingClaim(client)
+    else:
+        account_locks = AccountLocks(users)
+        # Workers that find a court at the same time only pay for one
+        claim = BookingClaim()
+
+    profile = LaunchProfile.parse(args.chrome_profile)
+    booker = (CdpBooker if args.engine == "cdp" else Booker)(
+        website,
+        args.headless,
+        args.max_driver_uses,
+        cookie_cache,
+        account_locks,
+        booked,
+        Timeouts.parse(args.step_timeouts),
+        profile,
+        ArtifactWriter(
+            args.artifacts_dir,
+            args.artifacts_first,
+            args.artifacts_every,
+            int(args.artifacts_max_mb * 1024 * 1024),
+        ),
+        spare_browsers=args.spare_browsers,
+        claim=claim,
+    )
+    if args.engine == "http":
+        booker = HttpBooker(
+            website,
+            cookie_cache,
+            fallback=booker,
+            pool_size=max(4, args.concurrency + 1),
+            account_locks=account_locks,
+            stop=booked,
+            claim=claim,
+        )
 
-    processes = []
-    for _ in range(args.workers):
-        process = multiprocessing.Process(
-            target=worker, args=(website, args.headless, users, availabilities, booked),
+    # Users that cannot book would fail every attempt at its last step
+    failures = {}
+    preflight = args.preflight
+    if preflight == "drop" and args.agent is not None:
+        # The coordinator hands out the jobs of every user, including the
+        # dropped ones that this agent would only put back
+        logging.warning("Agents pause the users that cannot book instead.")
+        preflight = "pause"
+    if preflight != "off":
+        checker = HttpBooker(
+            website,
+            cookie_cache,
+            fallback=Booker(website, args.headless, cookie_cache=cookie_cache),
         )
-        process.start()
-        processes.append(process)
+        eligibility_cache = None
+        if args.eligibility_cache:
+            eligibility_cache = EligibilityCache(
+                args.eligibility_cache, ttl=args.eligibility_ttl
+            )
+        try:
+            eligibilities = check_eligibility(checker, users, eligibility_cache)
+        finally:
+            # Workers must not inherit its connections and browsers
+            checker.close()
+        failures = {
+            username: eligibility
+            for username, eligibility in eligibilities.items()
+            if eligibility is not None and eligibility.failure is not None
+        }
+        if preflight == "drop" and failures:
+            users = [user for user in users if user.username not in failures]
+            logging.warning(
+                "Dropped the users that cannot book.", {"usernames": sorted(failures)}
+            )
+            if not users:
+                logging.error("None of the users can book.")
+                return
+
+    agent = None
+    if args.agent is not None:
+        scheduler = RemoteScheduler(client, users, courts)
+        agent = Agent(parse_address(args.agent), name).start(booked)
+    else:
+        scheduler = Scheduler(users, groups, args.workers)
+
+    if args.monitor:
+        if not isinstance(booker, HttpBooker):
+            booker = HttpBooker(
+                website,
+                cookie_cache,
+                fallback=booker,
+                account_locks=account_locks,
+                stop=booked,
+                claim=claim,
+            )
+        monitor(booker, users, groups, booked, args.monitor_interval)
+        logging.info("Done.")
+        return
+
+    rate = RateController(
+        [user.username for user in users],
+        [tennis_facility.name for tennis_facility in tennis_facilities],
+        user_rate=args.user_rate,
+        facility_rate=args.facility_rate,
+        burst_factor=args.burst_factor,
+    )
+
+    if preflight == "pause":
+        for username, eligibility in failures.items():
+            # Until the profile is worth reading again
+            rate.pause(
+                username,
+                eligibility.checked_at + args.eligibility_ttl,
+                eligibility.failure,
+            )
+
+    release_at = None
+    if args.release_at is not None:
+        release_at = parse_release_at(args.release_at)
+        logging.info(f"Courts are released at {time.ctime(release_at)}.")
+        # Start a few seconds early in case the clock of the website is ahead
+        rate.set_burst_window(release_at - 5, release_at + args.burst_seconds)
+
+    ready = multiprocessing.Barrier(args.workers)
+
+    logging.info(f"Starting {args.workers} workers.")
+
+    log_options = None
+    if args.start_method != "fork":
+        log_options = {
+            "pretty": args.logger_pretty,
+            "fast": True,
+            "queue": zlog.listener.queue if zlog.listener is not None else None,
+        }
+
+    def cleanup(pid: int) -> None:
+        profile.remove_user_data_dirs(pid)
+        claim.abandon(pid)
+
+    supervisor = Supervisor(
+        worker,
+        lambda slot: (
+            booker,
+            slot,
+            scheduler,
+            users,
+            groups,
+            booked,
+            release_at,
+            args.prewarm_seconds,
+            ready,
+            args.concurrency,
+            rate,
+            started_at,
+            log_options,
+        ),
+        args.workers,
+        on_death=scheduler.release,
+        cleanup=cleanup,
+        backoff=args.restart_backoff,
+        max_restarts=args.max_restarts,
+    )
+    supervisor.start()
+
+    start = time.time()
+    reported_at = start
+    try:
+        while not booked.wait(timeout=1):
+            supervisor.poll()
+
+            if (
+                args.usage_interval > 0
+                and time.time() - reported_at >= args.usage_interval
+            ):
+                supervisor.log_stats()
+                log_usage(supervisor.processes)
+                reported_at = time.time()
+
+            if agent is not None:
+                agent.heartbeat(supervisor.stats())
+
+            if supervisor.done:
+                logging.error("All workers stopped.")
+                break
+    except KeyboardInterrupt:
+        # Workers lead their own process groups and do not get the signal
+        logging.info("Interrupted.")
+
+    if agent is not None and booked.is_set() and not agent.stopped:
+        # One of our workers booked a court, tell the other agents
+        agent.announce_booked()
 
-    booked.wait()
+    scheduler.log_coverage(time.time() - start)
+    supervisor.log_stats()
+    log_usage(supervisor.processes)
 
-    for process in processes:
-        process.terminate()
+    # Let the workers cancel their attempts and close their browsers
+    booked.set()
+    supervisor.stop(args.stop_timeout)
 
-    for process in processes:
-        process.join()
+    logging.info("Workers stopped.", {"stop_latency": round(booked.latency(), 3)})
 
     logging.info("Done.")
 
@@ -1,3 +1,24 @@
-from .booking import Booker, Preferences
+from .booking import Booker, LaunchProfile, Preferences, Timeouts
+from .client import HttpBooker
+from .cdp import CdpBooker
+from .poller import Poller
+from .monitor import Monitor
 from .tennis import Court, Facility, DateTime, Availability
+from .catalog import Catalog, load_catalog, parse_dates, parse_times
 from .auth import User, Website
+from .cookies import CookieCache
+from .eligibility import Eligibility, EligibilityCache, check_eligibility
+from .clock import parse_release_at, wait_until
+from .schedule import AccountLocks, BookingClaim, Scheduler
+from .cluster import (
+    Agent,
+    Coordinator,
+    RemoteAccountLocks,
+    RemoteBookingClaim,
+    RemoteScheduler,
+)
+from .stop import Cancelled, StopFlag
+from .metrics import StepTimer, process_started_at, process_usage
+from .supervisor import Supervisor
+from .rate import Failure, RateController
+from .artifacts import ArtifactWriter
@@ -0,0 +1,181 @@
+import base64
+import gzip
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+
+from datetime import datetime
+
+from .rate import Failure
+
+from typing import Dict, Optional
+
+
+class ArtifactWriter:
+    def __init__(
+        self,
+        directory: str = "data/artifacts",
+        first: int = 5,
+        every: int = 50,
+        max_bytes: int = 100 * 1024 * 1024,
+        queue_size: int = 8,
+    ):
+        """
+        Writer of the artifacts of failed attempts (page source, screenshot).
+        Attempts are sampled before anything is captured: the first ones of
+        every failure reason are kept, then one out of every few, with counts
+        shared by all the worker processes. Captured artifacts are compressed
+        and written by a thread of the process, so that the next attempt does
+        not wait for the disk, and the oldest artifacts are removed once the
+        directory gets too big.
+
+        Parameters
+        ----------
+        directory : str, optional
+            Directory of the artifacts, by default "data/artifacts"
+
+        first : int, optional
+            Number of failures of each reason whose artifacts are all kept, by
+            default 5
+
+        every : int, optional
+            Once the first ones are kept, keep the artifacts of one out of
+            every this many failures of each reason, by default 50. 0 keeps
+            none.
+
+        max_bytes : int, optional
+            Size of the directory above which the oldest artifacts are
+            removed, by default 100 MB
+
+        queue_size : int, optional
+            Number of artifacts waiting to be written above which new ones
+            are dropped, by default 8
+        """
+        self.directory = directory
+        self.first = first
+        self.every = every
+        self.max_bytes = max_bytes
+        self.queue_size = queue_size
+        self.reasons = {failure.value: i for i, failure in enumerate(Failure)}
+        self.lock = multiprocessing.Lock()
+        self.counts = multiprocessing.Array("i", [0] * len(self.reasons), lock=False)
+        # Thread of the process that started writing, workers start their own
+        self.pid = None
+        self.queue = None
+        self.thread = None
+
+    def sample(self, reason: str) -> Optional[str]:
+        """
+        Count a failure and decide whether its artifacts are kept. It will
+        return a unique ID of the attempt if they are, and None otherwise.
+        """
+        index = self.reasons.get(reason)
+        if index is None or not self.directory:
+            return None
+
+        with self.lock:
+            count = self.counts[index]
+            self.counts[index] += 1
+
+        if count >= self.first and (
+            self.every <= 0 or (count - self.first) % self.every != 0
+        ):
+            return None
+
+        return f"{datetime.utcnow():%Y%m%d-%H%M%S-%f}-{os.getpid()}"
+
+    def save(self, attempt_id: str, reason: str, artifacts: Dict[str, str]) -> None:
+        """
+        Queue the artifacts of an attempt to be written. Artifacts are named
+        by their extension: "html" for a page source and "png" for a base64
+        encoded screenshot.
+        """
+        if self.pid != os.getpid():
+            self._start()
+
+        try:
+            self.queue.put_nowait((attempt_id, reason, artifacts))
+        except queue.Full:
+            logging.warning(
+                "Dropped failure artifacts, too many are waiting to be written.",
+                {"attempt_id": attempt_id, "reason": reason},
+            )
+
+    def close(self) -> None:
+        """
+        Wait for the queued artifacts to be written.
+        """
+        if self.thread is None or self.pid != os.getpid():
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+        self.pid = None
+
+    def _start(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self.pid = os.getpid()
+        self.queue = queue.Queue(self.queue_size)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            attempt_id, reason, artifacts = item
+            try:
+                paths = [self._write(attempt_id, *a) for a in artifacts.items()]
+                self._prune()
+            except Exception as e:
+                logging.error(
+                    "Failed to write failure artifacts.",
+                    {"attempt_id": attempt_id, "exception": str(e)},
+                )
+                continue
+            logging.info(
+                "Saved failure artifacts.",
+                {"attempt_id": attempt_id, "reason": reason, "paths": paths},
+            )
+
+    def _write(self, attempt_id: str, extension: str, content: str) -> str:
+        if extension == "png":
+            # Screenshots are compressed already
+            path = os.path.join(self.directory, f"{attempt_id}.png")
+            data = base64.b64decode(content)
+        else:
+            path = os.path.join(self.directory, f"{attempt_id}.{extension}.gz")
+            data = gzip.compress(content.encode("utf-8"), compresslevel=6)
+
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        return path
+
+    def _prune(self) -> None:
+        """
+        Remove the oldest artifacts until the directory fits in max_bytes.
+        Every worker prunes the same directory, IDs start with the time so
+        that names sort from the oldest.
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                try:
+                    entries.append((entry.name, entry.stat().st_size))
+                except FileNotFoundError:
+                    pass
+
+        total = sum(size for _, size in entries)
+        for name, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
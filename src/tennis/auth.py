@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from urllib.parse import urlparse
 
 
 @dataclass
@@ -11,3 +12,12 @@ class User:
 class Website:
     login_url: str
     search_url: str
+
+    @property
+    def portal_url(self) -> str:
+        """
+        URL of the portal page that serves every view and action of the
+        tennis website, e.g. https://tennis.paris.fr/tennis/jsp/site/Portal.jsp
+        """
+        url = urlparse(self.search_url)
+        return f"{url.scheme}://{url.netloc}{url.path}"
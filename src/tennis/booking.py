@@ -1,28 +1,84 @@
+import glob
 import logging
 import os
+import shutil
+import tempfile
+import time
 
-from selenium import webdriver
-from selenium.common.exceptions import NoSuchElementException
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
+from contextlib import contextmanager, nullcontext
+from urllib.parse import urlparse
+
+from selenium.common.exceptions import (
+    JavascriptException,
+    TimeoutException,
+    WebDriverException,
+)
 
 from .tennis import Availability, Facility, Court
 from .auth import User, Website
-
-from typing import Union
-from dataclasses import dataclass
+from .driver import BROWSER_ERRORS, DriverPool, Session, is_dead
+from .cookies import CookieCache
+from .schedule import AccountLocks, BookingClaim
+from .stop import Cancelled, StopFlag
+from .metrics import StepTimer
+from .rate import Failure
+from .artifacts import ArtifactWriter
+
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+from dataclasses import dataclass, fields
+
+if TYPE_CHECKING:
+    # The webdriver package imports the drivers of every browser, it is only
+    # imported once a browser is launched so that the http engine does not
+    # pay for it
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+    from selenium.webdriver.remote.webelement import WebElement
 
 
 @dataclass
 class Preferences:
-    tennis_facility: str = None
-    location: str = None
-    surface_type: str = None
-    court_id: str = None
-    username: str = None
+    # One or several accepted values each, None accepts any
+    tennis_facility: Union[str, List[str]] = None
+    location: Union[str, List[str]] = None
+    surface_type: Union[str, List[str]] = None
+    court_id: Union[str, List[str]] = None
+    username: Union[str, List[str]] = None
+    # Most preferred first. Values that are not listed come last.
+    facility_order: List[str] = None
+    time_order: List[str] = None
+    surface_order: List[str] = None
+    court_order: List[str] = None
+
+    def __post_init__(self):
+        names = ("tennis_facility", "location", "surface_type", "court_id", "username")
+        for name in names:
+            if isinstance(getattr(self, name), str):
+                setattr(self, name, [getattr(self, name)])
+
+        # Positions of the ranked values, looked up for every availability,
+        # with the position of the values that are not listed
+        self.positions = []
+        for order in (
+            self.facility_order,
+            self.time_order,
+            self.surface_order,
+            self.court_order,
+        ):
+            order = order or []
+            positions = {}
+            for i, value in enumerate(order):
+                positions.setdefault(value, i)
+            self.positions.append((positions, len(order)))
 
     def check(self, obj: Union[Facility, Court]) -> bool:
         if isinstance(obj, Facility):
@@ -36,28 +92,273 @@ class Preferences:
     def _check_facility(self, tennis_facility: Facility) -> bool:
         if self.tennis_facility is None:
             return True
-        return tennis_facility == self.tennis_facility
+        return tennis_facility.name in self.tennis_facility
 
     def _check_court(self, court: Court) -> bool:
-        if self.location is not None and court.location.value != self.location:
+        if self.location is not None and court.location.value not in self.location:
             return False
         if (
             self.surface_type is not None
-            and court.surface_type.value != self.surface_type
+            and court.surface_type.value not in self.surface_type
         ):
             return False
-        if self.court_id is not None and court.id != self.court_id:
+        if self.court_id is not None and court.id not in self.court_id:
             return False
         return True
 
     def _check_user(self, user: User) -> bool:
-        if self.username is not None and user.username != self.username:
+        if self.username is not None and user.username not in self.username:
             return False
         return True
 
+    def rank(self, availability: Availability) -> Tuple[int, int, int, int]:
+        """
+        Rank of an availability, lower is better. Facilities are compared
+        first, then times, then surface types, then courts.
+        """
+        values = (
+            availability.court.facility_name,
+            availability.date_time.time,
+            availability.court.surface_type.value,
+            availability.court.id,
+        )
+        return tuple(
+            positions.get(value, unlisted)
+            for (positions, unlisted), value in zip(self.positions, values)
+        )
+
+    def group(self, availabilities: List[Availability]) -> List[List[Availability]]:
+        """
+        Group availabilities that can be booked from the same page, that is at
+        the same facility and on the same date. Each group is sorted from the
+        most to the least preferred availability, and groups are sorted by
+        their most preferred availability.
+        """
+        groups = {}
+        for availability in availabilities:
+            key = (availability.court.facility_name, availability.date_time.date)
+            groups.setdefault(key, []).append(availability)
+
+        groups = [sorted(group, key=self.rank) for group in groups.values()]
+        return sorted(groups, key=lambda group: self.rank(group[0]))
+
+
+# Cookie fields accepted by the Network.setCookies DevTools command
+COOKIE_PARAMS = (
+    "name",
+    "value",
+    "domain",
+    "path",
+    "secure",
+    "httpOnly",
+    "sameSite",
+    "expires",
+)
+
+
+# Resolves with the elements matching a CSS selector as soon as there are at
+# least `count` of them, or with null after the timeout. A MutationObserver
+# wakes the script up on every change of the page instead of polling it.
+WAIT_FOR_SCRIPT = """
+var selector = arguments[0], count = arguments[1], timeout = arguments[2] * 1000;
+var done = arguments[arguments.length - 1];
+function match() {
+  var elements = document.querySelectorAll(selector);
+  return elements.length >= count ? Array.prototype.slice.call(elements) : null;
+}
+var found = match();
+if (found) { done(found); return; }
+var timer = null;
+var observer = new MutationObserver(function () {
+  var found = match();
+  if (found) { observer.disconnect(); clearTimeout(timer); done(found); }
+});
+observer.observe(document, {childList: true, subtree: true, attributes: true});
+timer = setTimeout(function () { observer.disconnect(); done(null); }, timeout);
+"""
+
+
+RESERVE_BUTTON_CLASSES = [
+    "btn btn-darkblue medium rollover rollover-grey buttonHasReservation",
+    "btn btn-darkblue medium rollover rollover-grey buttonAllOk",
+]
+
+# Collects the reserve buttons of the page with their attributes in a single
+# round trip, instead of one round trip per button and attribute.
+SLOTS_SCRIPT = """
+var classes = arguments[0];
+var slots = [];
+document.querySelectorAll('button[courtid]').forEach(function (button) {
+  var cls = button.getAttribute('class') || '';
+  if (classes.indexOf(cls) < 0) { return; }
+  slots.push({
+    courtid: button.getAttribute('courtid'),
+    datedeb: button.getAttribute('datedeb'),
+    cls: cls,
+    button: button
+  });
+});
+return slots;
+"""
+
+
+# Markers of the facilities on the map of the search results
+LEAFLET_SELECTOR = ".leaflet-marker-pane *"
+
+# Finds the marker of a facility by its name, which the markers carry in
+# their title, checking the cached position first. Falls back to the given
+# position if no marker has a matching name. Returns [position, marker].
+LEAFLET_SCRIPT = """
+var selector = arguments[0], name = arguments[1].toLowerCase(), index = arguments[2];
+var markers = document.querySelectorAll(selector);
+function matches(marker) {
+  var label = marker.getAttribute('title') || marker.getAttribute('alt') || '';
+  return label.trim().toLowerCase() === name;
+}
+if (index !== null && index < markers.length && matches(markers[index])) {
+  return [index, markers[index]];
+}
+for (var i = 0; i < markers.length; i++) {
+  if (matches(markers[i])) { return [i, markers[i]]; }
+}
+if (index !== null && index < markers.length) { return [index, markers[index]]; }
+return null;
+"""
+
+
+@dataclass
+class Timeouts:
+    """
+    Maximum number of seconds to wait for the elements of each step of the
+    booking flow to show up.
+    """
+
+    login: float = 10
+    search: float = 5
+    date: float = 1
+    leaflet: float = 5
+    facility: float = 2
+    time: float = 2
+    players: float = 2
+    payment: float = 5
+
+    @staticmethod
+    def parse(value: str) -> "Timeouts":
+        """
+        Parse timeouts from a string like "search=3,time=1.5".
+        """
+        timeouts = Timeouts()
+        for item in filter(None, value.split(",")):
+            step, _, seconds = item.partition("=")
+            if not hasattr(timeouts, step.strip()):
+                raise ValueError(f"Unknown step: {step}")
+            setattr(timeouts, step.strip(), float(seconds))
+        return timeouts
+
+
+# URL patterns blocked by the lean launch profile, by kind of resource
+BLOCKED_URLS = {
+    "fonts": ["*.woff", "*.woff2", "*.ttf", "*.otf", "*fonts.gstatic.com*"],
+    "tiles": ["*tile.openstreetmap.org*", "*tiles.*", "*/tiles/*", "*mapbox.com*"],
+    "analytics": [
+        "*google-analytics.com*",
+        "*googletagmanager.com*",
+        "*doubleclick.net*",
+        "*xiti.com*",
+        "*hotjar.com*",
+        "*facebook.net*",
+    ],
+}
+
+
+@dataclass
+class LaunchProfile:
+    """
+    Options of the Chrome browsers. By default, browsers do not load what the
+    booking flow does not need (images, fonts, map tiles and analytics
+    scripts), run without GPU nor extensions in a small window, and keep
+    their profile in memory, so that more of them fit in a container.
+    """
+
+    block_images: bool = True
+    block_fonts: bool = True
+    block_tiles: bool = True
+    block_analytics: bool = True
+    window_size: str = "1024x768"
+    # Directory under which every browser gets its own profile, a tmpfs
+    # keeps profiles off the disk. Empty to let Chrome pick one.
+    user_data_root: str = "/dev/shm"
+
+    def user_data_prefix(self, pid: int) -> str:
+        """
+        Prefix of the names of the profile directories of the browsers of a
+        process.
+        """
+        return f"chrome-{pid}-"
+
+    def remove_user_data_dirs(self, pid: int) -> None:
+        """
+        Remove the profile directories of the browsers of a process, which
+        are left behind when the process is killed with its browsers.
+        """
+        if not self.user_data_root:
+            return
+        pattern = os.path.join(
+            glob.escape(self.user_data_root), f"{self.user_data_prefix(pid)}*"
+        )
+        for path in glob.glob(pattern):
+            shutil.rmtree(path, ignore_errors=True)
+
+    @staticmethod
+    def parse(value: str) -> "LaunchProfile":
+        """
+        Parse a profile from a string like "block_images=0,window_size=800x600".
+        """
+        profile = LaunchProfile()
+        types = {f.name: f.type for f in fields(LaunchProfile)}
+        for item in filter(None, value.split(",")):
+            name, _, setting = item.partition("=")
+            name = name.strip()
+            if name not in types:
+                raise ValueError(f"Unknown option: {name}")
+            if types[name] is bool:
+                setattr(profile, name, setting.strip().lower() in ("1", "true", "yes"))
+            else:
+                setattr(profile, name, setting.strip())
+        return profile
+
+    @property
+    def blocked_urls(self) -> List[str]:
+        blocked = []
+        for kind in ("fonts", "tiles", "analytics"):
+            if getattr(self, f"block_{kind}"):
+                blocked += BLOCKED_URLS[kind]
+        return blocked
+
+
+# Players registered with every reservation, as (last name, first name)
+PLAYERS = [("Azarova", "Anna"), ("Memari", "Issa")]
+
+
+class LoggedOut(Exception):
+    pass
+
 
 class Booker:
-    def __init__(self, website: Website, headless: bool = True):
+    def __init__(
+        self,
+        website: Website,
+        headless: bool = True,
+        max_driver_uses: int = 50,
+        cookie_cache: Optional[CookieCache] = None,
+        account_locks: Optional[AccountLocks] = None,
+        stop: Optional[StopFlag] = None,
+        timeouts: Optional[Timeouts] = None,
+        profile: Optional[LaunchProfile] = None,
+        artifacts: Optional[ArtifactWriter] = None,
+        spare_browsers: int = 0,
+        claim: Optional[BookingClaim] = None,
+    ):
         """
         Booker object. This object is used to book a tennis court on the
         website of Paris tennis.
@@ -67,25 +368,122 @@ class Booker:
         website : Website
             Website object containing the login and search URLs.
 
-        user : User
-            User object containing the username and password.
-
         headless : bool, optional
             Whether to run the browser in headless mode or not, by default True
+
+        max_driver_uses : int, optional
+            Number of booking attempts after which a browser is recycled, by
+            default 50
+
+        cookie_cache : CookieCache, optional
+            Cache of authenticated cookies shared with the other workers. If
+            not specified, every new browser goes through the login form.
+
+        account_locks : AccountLocks, optional
+            Locks shared with the other workers so that only one of them makes
+            a reservation with a given user at a time.
+
+        stop : StopFlag, optional
+            Flag shared with the other workers. Attempts are cancelled as soon
+            as it is set.
+
+        timeouts : Timeouts, optional
+            Maximum time to wait for the elements of each step, by default
+            Timeouts()
+
+        profile : LaunchProfile, optional
+            Options of the browsers, by default LaunchProfile()
+
+        artifacts : ArtifactWriter, optional
+            Writer of the page source and screenshot of a sample of the
+            failed attempts, by default ArtifactWriter()
+
+        spare_browsers : int, optional
+            Number of idle browsers launched ahead once pool.fill is called,
+            by default 0
+
+        claim : BookingClaim, optional
+            Claim shared with the other workers so that only one of them
+            books a court. If not specified, every worker books its own.
         """
         self.headless = headless
         self.website = website
+        self.cookie_cache = cookie_cache
+        self.account_locks = account_locks
+        self.claim = claim
+        self.stop = stop
+        self.timeouts = timeouts or Timeouts()
+        self.profile = profile or LaunchProfile()
+        self.artifacts = artifacts or ArtifactWriter()
+        self.timings = StepTimer()
+        # Position of the marker of each facility on the map, by name
+        self.leaflets: Dict[str, int] = {}
+        # Profile directory of each browser, by session ID
+        self.user_data_dirs: Dict[str, str] = {}
+        self.pool = DriverPool(
+            self._create_driver,
+            max_uses=max_driver_uses,
+            on_quit=self._remove_user_data_dir,
+            spares=spare_browsers,
+        )
 
-    def _create_driver(self) -> webdriver.Chrome:
+    def close(self) -> None:
+        """
+        Quit all the browsers owned by this booker and wait for the artifacts
+        of the failed attempts to be written.
+        """
+        self.pool.close()
+        self.artifacts.close()
+
+    def _create_driver(self) -> "webdriver.Chrome":
         """
         Create a Chrome driver. This method will create a Chrome driver with
-        the appropriate options (headless, etc.).
+        the appropriate options (headless, etc.) and the launch profile.
 
         Returns
         -------
         webdriver.Chrome
             Chrome driver
         """
+        from selenium import webdriver
+        from selenium.webdriver.chrome.service import Service
+
+        options = self._options()
+        profile = self.profile
+
+        user_data_dir = None
+        if profile.user_data_root and os.path.isdir(profile.user_data_root):
+            # Named after the worker, whose supervisor removes them if it dies
+            user_data_dir = tempfile.mkdtemp(
+                prefix=profile.user_data_prefix(os.getpid()),
+                dir=profile.user_data_root,
+            )
+            options.add_argument(f"--user-data-dir={user_data_dir}")
+
+        try:
+            driver = webdriver.Chrome(
+                service=Service("/usr/local/bin/chromedriver"), options=options
+            )
+        except Exception:
+            if user_data_dir is not None:
+                shutil.rmtree(user_data_dir, ignore_errors=True)
+            raise
+
+        if user_data_dir is not None:
+            self.user_data_dirs[driver.session_id] = user_data_dir
+
+        # Waits are bounded by the timeouts of the steps, not by the driver
+        driver.set_script_timeout(max(vars(self.timeouts).values()) + 5)
+        self._block_urls(driver)
+        return driver
+
+    def _options(self) -> "Options":
+        """
+        Options of the Chrome browsers, from the headless setting and the
+        launch profile.
+        """
+        from selenium.webdriver.chrome.options import Options
+
         options = Options()
         if self.headless:
             options.add_argument("--no-sandbox")
@@ -93,43 +491,257 @@ class Booker:
             options.add_argument("--disable-dev-shm-usage")
             options.add_argument("--incognito")
 
-        return webdriver.Chrome(
-            service=Service("/usr/local/bin/chromedriver"), options=options
-        )
+        profile = self.profile
+        options.add_argument("--disable-gpu")
+        options.add_argument("--disable-extensions")
+        options.add_argument("--disable-background-networking")
+        options.add_argument("--disable-default-apps")
+        options.add_argument("--disable-sync")
+        options.add_argument("--no-first-run")
+        options.add_argument("--mute-audio")
+        options.add_argument(f"--window-size={profile.window_size.replace('x', ',')}")
+        if profile.block_images:
+            # Markers of the map are still in the page, only their pictures
+            # are not loaded
+            options.add_experimental_option(
+                "prefs", {"profile.managed_default_content_settings.images": 2}
+            )
 
-    def _login(self, driver: webdriver.Chrome, user: User) -> None:
+        return options
+
+    def _block_urls(self, driver: "webdriver.Chrome") -> None:
+        """
+        Block the requests of the resources left out by the launch profile.
+        Blocking applies to the current tab only.
+        """
+        blocked = self.profile.blocked_urls
+        if blocked:
+            driver.execute_cdp_cmd("Network.enable", {})
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": blocked})
+
+    def _remove_user_data_dir(self, driver: "webdriver.Chrome") -> None:
+        path = self.user_data_dirs.pop(driver.session_id, None)
+        if path is not None:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def _wait_for(
+        self, driver: "webdriver.Chrome", selector: str, timeout: float, count: int = 1
+    ) -> Optional[List["WebElement"]]:
+        """
+        Wait for at least count elements matching a CSS selector. It will
+        return the matching elements as soon as they show up, or None if they
+        did not show up before the timeout.
+        """
+        deadline = time.time() + timeout
+        while True:
+            try:
+                return driver.execute_async_script(
+                    WAIT_FOR_SCRIPT, selector, count, max(0, deadline - time.time())
+                )
+            except JavascriptException:
+                # The page was replaced while waiting, wait on the new one
+                if time.time() >= deadline:
+                    return None
+
+    def _login(self, driver: "webdriver.Chrome", user: User) -> bool:
         """
         Login to the website. This method will use the login URL and the
         username and password of the User object to login to the website.
+        If the cookie cache holds a fresh session for the user, the cookies
+        are loaded into the browser instead and the login form is skipped.
+        It will return True if the login was successful, and False otherwise.
         """
+        if self.cookie_cache is not None:
+            cookies = self.cookie_cache.get(user.username)
+            if cookies is not None:
+                driver.execute_cdp_cmd("Network.setCookies", {"cookies": cookies})
+                logging.info(f"Restored session of {user.username}.")
+                return True
+
+        self._check_stop()
         driver.get(self.website.login_url)
 
-        username_element = driver.find_element(by="id", value="username")
+        elements = self._wait_for(driver, "#username", self.timeouts.login)
+        if elements is None:
+            logging.error("Failed to find the login form.")
+            return False
+
+        username_element = elements[0]
         password_element = driver.find_element(by="id", value="password")
 
         username_element.send_keys(user.username)
         password_element.send_keys(user.password)
 
+        self._check_stop()
         driver.find_element(by="name", value="Submit").click()
 
+        from selenium.webdriver.support.ui import WebDriverWait
+
+        try:
+            WebDriverWait(driver, self.timeouts.login, poll_frequency=0.05).until(
+                lambda d: not self._is_logged_out(d)
+            )
+        except TimeoutException:
+            logging.error(f"Failed to login as {user.username}.")
+            return False
+
         logging.info(f"Logged in as {user.username}.")
 
-    def book(self, user: User, availability: Availability) -> bool:
+        if self.cookie_cache is not None:
+            self.cookie_cache.put(user.username, self._get_cookies(driver))
+
+        return True
+
+    def _get_cookies(self, driver: "webdriver.Chrome") -> List[dict]:
+        cookies = driver.execute_cdp_cmd("Network.getAllCookies", {})["cookies"]
+        return [
+            {k: v for k, v in cookie.items() if k in COOKIE_PARAMS}
+            for cookie in cookies
+        ]
+
+    def export_cookies(self, user: User) -> Optional[List[dict]]:
+        """
+        Get the cookies of the logged in browser of a user, logging in first
+        if needed. It will return None if the login failed.
+
+        Parameters
+        ----------
+        user : User
+            User object containing the username and password.
+        """
+        cookies = []
+
+        def step(session: Session) -> bool:
+            cookies.extend(self._get_cookies(session.driver))
+            return True
+
+        if not self._attempt(user, step, "export_cookies"):
+            return None
+        return cookies
+
+    def _is_logged_out(self, driver: "webdriver.Chrome") -> bool:
+        """
+        Whether the browser was sent back to the login page.
+        """
+        login_host = urlparse(self.website.login_url).netloc
+        return urlparse(driver.current_url).netloc == login_host
+
+    def prepare(self, user: User) -> bool:
+        """
+        Get the browser of a user ready ahead of the first attempt. This method
+        will launch the browser, login and open the search page, so that the
+        next call to book for this user only has to reload the search page.
+        It will return True if the browser is ready, and False otherwise.
+
+        Parameters
+        ----------
+        user : User
+            User object containing the username and password.
+        """
+        return self._attempt(user, self._park, "prepare")
+
+    def book(
+        self, user: User, availabilities: Union[Availability, List[Availability]]
+    ) -> bool:
         """
         Book a tennis court. This method will login to the website, search for
-        the availability, and book the court. It will return True if the
-        booking was successful, and False otherwise.
+        the availabilities, and book the most preferred one that is available.
+        It will return True if the booking was successful, and False otherwise.
+
+        The browser of the user is kept open between calls, so only the first
+        attempt pays for the browser launch and the login.
 
         Parameters
         ----------
-        availability : Availability
-            Availability object containing the court_id and date and time of the
-            booking.
+        user : User
+            User object containing the username and password.
+
+        availabilities : Union[Availability, List[Availability]]
+            Availabilities at the same facility and on the same date, from the
+            most to the least preferred, as grouped by Preferences.group. They
+            are all matched against a single search.
+        """
+        if isinstance(availabilities, Availability):
+            availabilities = [availabilities]
+        return self._attempt(
+            user,
+            lambda session: self._book(session, user, availabilities),
+            "book",
+            availability=str(availabilities[0]),
+            candidates=len(availabilities),
+        )
+
+    def _attempt(
+        self, user: User, step: Callable[[Session], bool], action: str, **fields
+    ) -> bool:
+        """
+        Run a step with the logged in browser of a user, taking care of the
+        login and of recycling the browser if it crashes. The attempt is timed
+        under the name of the action.
         """
-        driver = self._create_driver()
+        if self.stop is not None and self.stop.is_set():
+            return False
+
+        self.timings.begin(action, username=user.username, **fields)
+        self.timings.step("driver")
 
-        self._login(driver, user)
+        session = None
+        healthy = True
+        outcome = "failure"
+        try:
+            session = self.pool.acquire(user.username)
+            if not session.logged_in:
+                self.timings.step("login")
+                if not self._login(session.driver, user):
+                    return False
+                session.logged_in = True
+
+            if step(session):
+                outcome = "success"
+                return True
+            return False
+        except LoggedOut:
+            logging.warning(f"Session of {user.username} expired.")
+            outcome = "logged_out"
+            session.logged_in = False
+            session.parked = False
+            if self.cookie_cache is not None:
+                self.cookie_cache.invalidate(user.username)
+            return False
+        except Cancelled:
+            # Quit the browser right away instead of finishing the attempt
+            logging.info("Attempt cancelled.")
+            outcome = "cancelled"
+            healthy = False
+            return False
+        except BROWSER_ERRORS as e:
+            if session is not None and not is_dead(e):
+                # The page did not have what the attempt expected, but the
+                # browser and its login are still good
+                logging.error("Browser command failed.", {"exception": str(e)})
+                return False
+            logging.error("Browser failure.", {"exception": str(e)})
+            outcome = "error"
+            healthy = False
+            return False
+        finally:
+            self.timings.end(outcome)
+            # No session when the browser failed to launch
+            if session is not None:
+                self.pool.release(session, healthy)
+
+    def _check_stop(self) -> None:
+        if self.stop is not None:
+            self.stop.check()
+
+    def _park(self, session: Session) -> bool:
+        self.timings.step("search")
+        self._open_search(session.driver)
+        session.parked = True
+        return True
 
+    def _open_search(self, driver: "webdriver.Chrome") -> None:
+        self._check_stop()
         driver.execute_script(
             f"window.open('{self.website.search_url}', '_blank').focus()"
         )
@@ -138,170 +750,254 @@ class Booker:
             driver.close()
 
         driver.switch_to.window(driver.window_handles[0])
+        self._block_urls(driver)
+
+        if self._is_logged_out(driver):
+            raise LoggedOut()
 
         logging.info("Opened search page.")
 
+    def _reload_search(self, driver: "webdriver.Chrome") -> None:
+        self._check_stop()
+        # Blocked URLs are kept by the tab, and assets come from its cache
+        driver.refresh()
+
+        if self._is_logged_out(driver):
+            raise LoggedOut()
+
+        logging.info("Reloaded search page.")
+
+    def _book(
+        self, session: Session, user: User, availabilities: List[Availability]
+    ) -> bool:
+        driver = session.driver
+        date = availabilities[0].date_time.date
+
+        self.timings.step("search")
+
+        # A parked browser is already on the search page, but it was loaded
+        # before the release and would miss the released date
+        if session.parked:
+            session.parked = False
+            self._reload_search(driver)
+        else:
+            self._open_search(driver)
+
+        self._check_stop()
         try:
-            when = driver.find_element(by="id", value="when")
-            driver.execute_script("arguments[0].click();", when)
-        except NoSuchElementException as e:
-            logging.error("Failed to find when element.", {"exception": str(e)})
-            return False
+            when = self._wait_for(driver, "#when", self.timeouts.search)
+            if when is None:
+                logging.error("Failed to find when element.")
+                return False
+            driver.execute_script("arguments[0].click();", when[0])
         except Exception as e:
             logging.error("Unexpected exception.", {"exception": str(e)})
             return False
 
+        self._check_stop()
         try:
-            date_element = driver.find_element(
-                by=By.XPATH, value=f"//div[@dateiso='{availability.date_time.date}']"
-            )
-            driver.execute_script("arguments[0].click();", date_element)
-        except NoSuchElementException as e:
-            logging.error(
-                f"Failed to find date element. Date {availability.date_time.date} is not available.",
-                {"exception": str(e)},
+            date_element = self._wait_for(
+                driver,
+                f"div[dateiso='{date}']",
+                self.timeouts.date,
             )
-            return False
+            if date_element is None:
+                logging.error(
+                    f"Failed to find date element. Date {date} is not available.",
+                )
+                self.timings.fail(Failure.DATE_UNAVAILABLE.value)
+                return False
+            driver.execute_script("arguments[0].click();", date_element[0])
         except Exception as e:
             logging.error("Unexpected exception.", {"exception": str(e)})
             return False
 
-        logging.info(f"Chosen date {availability.date_time.date}.")
+        logging.info(f"Chosen date {date}.")
 
+        self._check_stop()
         try:
-            rechercher = driver.find_element(by="id", value="rechercher")
-            driver.execute_script("arguments[0].click();", rechercher)
-        except NoSuchElementException as e:
-            logging.error("Failed to find rechercher element.", {"exception": str(e)})
-            return False
+            rechercher = self._wait_for(driver, "#rechercher", self.timeouts.search)
+            if rechercher is None:
+                logging.error("Failed to find rechercher element.")
+                return False
+            driver.execute_script("arguments[0].click();", rechercher[0])
         except Exception as e:
             logging.error("Unexpected exception.", {"exception": str(e)})
             return False
 
         logging.info("Searched for available courts.")
 
+        self.timings.step("leaflet")
+        self._check_stop()
+        court = availabilities[0].court
         try:
-            leaflets = driver.find_element(
-                by=By.CLASS_NAME, value="leaflet-marker-pane"
+            leaflet = self._find_leaflet(
+                driver, court.facility_name, court.leaflet_index
             )
-            leaflets = leaflets.find_elements(by=By.XPATH, value=".//*")
-
-            # Elisabeth is leaflet 18
-            driver.execute_script("arguments[0].click();", leaflets[18])
-        except NoSuchElementException as e:
-            logging.error("Failed to find leaflet element.", {"exception": str(e)})
-            return False
+            if leaflet is None:
+                logging.error(f"Failed to find the leaflet of {court.facility_name}.")
+                return False
+            driver.execute_script("arguments[0].click();", leaflet)
         except Exception as e:
             logging.error("Unexpected exception.", {"exception": str(e)})
             return False
 
-        logging.info("Clicked on the Elisabeth leaflet on the map.")
+        logging.info(f"Clicked on the {court.facility_name} leaflet on the map.")
 
-        try:
-            link = WebDriverWait(driver, 1).until(
-                EC.presence_of_element_located((By.CLASS_NAME, "accessTennisMap"))
-            )
-        except Exception as e:
-            logging.error(
-                "Failed to find accessTennisMap element.", {"exception": str(e)}
-            )
+        self.timings.step("time")
+        self._check_stop()
+        link = self._wait_for(driver, ".accessTennisMap", self.timeouts.facility)
+        if link is None:
+            logging.error("Failed to find accessTennisMap element.")
             return False
 
-        link.send_keys("\n")
+        link[0].send_keys("\n")
 
-        times = driver.find_elements(by=By.CLASS_NAME, value="panel-title")
+        self._check_stop()
+        slots = []
+        if self._wait_for(driver, "button[courtid]", self.timeouts.time):
+            slots = driver.execute_script(SLOTS_SCRIPT, RESERVE_BUTTON_CLASSES)
 
-        found = False
-        for t in times:
-            if t.text == availability.date_time.time:
-                t.click()
-                found = True
-                break
-
-        if not found:
+        if len(slots) == 0:
             logging.error(
-                f"Failed to find time element. {availability} is not available.",
+                f"Failed to find any reserve buttons. {availabilities[0]} is not available.",
             )
-            return False
 
-        logging.info(f"Chosen time {availability.date_time.time}.")
+            self.timings.fail(Failure.NO_SLOT.value)
+            self._save_artifacts(driver, Failure.NO_SLOT.value)
+            return False
 
-        reserve_buttons = driver.find_elements(
-            by=By.XPATH,
-            value="//button[@class='btn btn-darkblue medium rollover rollover-grey buttonHasReservation']",
-        )
+        logging.info(f"Found {len(slots)} reserve buttons.")
 
-        reserve_buttons += driver.find_elements(
-            by=By.XPATH,
-            value="//button[@class='btn btn-darkblue medium rollover rollover-grey buttonAllOk']",
-        )
+        # Every slot of the page is known, pick the most preferred one
+        buttons = {(slot["courtid"], slot["datedeb"]): slot["button"] for slot in slots}
+        availability = next((a for a in availabilities if a.key in buttons), None)
 
-        if len(reserve_buttons) == 0:
+        if availability is None:
             logging.error(
-                f"Failed to find any reserve buttons. {availability} is not available.",
+                f"Failed to click on the reserve button. None of the {len(availabilities)} wanted courts is available.",
             )
-
-            pid = os.getpid()
-            self._save_screenshot(driver, f"data/{pid}.png")
-            self._save_page_source(driver, f"data/{pid}.html")
+            self.timings.fail(Failure.NO_SLOT.value)
             return False
 
-        clicked = False
-        court_id = None
-        for button in reserve_buttons:
-            button_court_id = button.get_attribute("courtid")
-            button_date = button.get_attribute("datedeb")
-            if (
-                button_date == str(availability.date_time)
-                and button_court_id == availability.court.id
-            ):
-                driver.execute_script("arguments[0].click();", button)
-                clicked = True
-                court_id = button_court_id
-                break
+        reserve_button = buttons[availability.key]
+        logging.info(f"{availability} is available.")
+
+        self.timings.step("reserve")
+        self._check_stop()
+        with self._hold_account(user) as held:
+            if not held:
+                return False
+            booked = self._reserve(driver, user, availability, reserve_button)
+            if booked and self.claim is not None:
+                self.claim.mark_booked()
+            return booked
+
+    def _find_leaflet(
+        self,
+        driver: "webdriver.Chrome",
+        facility_name: str,
+        leaflet_index: Optional[int],
+    ) -> Optional["WebElement"]:
+        """
+        Find the marker of a facility on the map. Markers are matched by name
+        and their position is cached, so that later searches only wait for
+        the markers up to that position. The leaflet index of the data file is
+        used until the position is known, and if the markers have no name.
+        """
+        index = self.leaflets.get(facility_name, leaflet_index)
+        count = 1 if index is None else index + 1
+        markers = self._wait_for(driver, LEAFLET_SELECTOR, self.timeouts.leaflet, count)
+        if markers is None:
+            return None
+
+        found = driver.execute_script(
+            LEAFLET_SCRIPT, LEAFLET_SELECTOR, facility_name, index
+        )
+        if found is None:
+            return None
 
-        if not clicked:
-            logging.error(
-                f"Failed to click on the reserve button. {availability} is not available.",
-            )
-            return False
+        index, leaflet = found
+        self.leaflets[facility_name] = index
+        return leaflet
+
+    @contextmanager
+    def _hold_account(self, user: User) -> Iterator[bool]:
+        """
+        Hold the account of the user, then the booking claim of the fleet,
+        while making a reservation. Yields False if either is not taken.
+        """
+        account = nullcontext(True)
+        if self.account_locks is not None:
+            account = self.account_locks.hold(user.username)
+        claim = nullcontext(True) if self.claim is None else self.claim.hold()
+
+        with account as held:
+            if not held:
+                yield False
+                return
+            with claim as claimed:
+                yield claimed
+
+    def _reserve(
+        self,
+        driver: "webdriver.Chrome",
+        user: User,
+        availability: Availability,
+        reserve_button: "WebElement",
+    ) -> bool:
+        self._check_stop()
+        driver.execute_script("arguments[0].click();", reserve_button)
+
+        if self._is_logged_out(driver):
+            raise LoggedOut()
+
+        logging.info(
+            f"Clicked on the reserve button for court {availability.court.id}."
+        )
 
-        logging.info(f"Clicked on the reserve button for court {court_id}.")
+        self.timings.step("submit")
 
-        inputs = driver.find_elements(
-            by=By.XPATH, value="//input[@class='form-control required']"
+        self._check_stop()
+        inputs = self._wait_for(
+            driver, "input.form-control.required", self.timeouts.players
         )
 
-        if len(inputs) == 0:
+        if inputs is None:
             logging.error(
                 f"Failed to find any inputs for player information. Account {user.username} already has a reservation.",
             )
+            self.timings.fail(Failure.ACCOUNT_BUSY.value)
             return False
 
-        inputs[0].send_keys("Azarova")
-        inputs[1].send_keys("Anna")
+        inputs[0].send_keys(PLAYERS[0][0])
+        inputs[1].send_keys(PLAYERS[0][1])
 
         ajouter_button = driver.find_element(
-            by=By.XPATH,
+            by="xpath",
             value="//button[@class='btn btn-darkblue small addPlayer rollover rollover-grey']",
         )
         ajouter_button.click()
 
-        inputs = driver.find_elements(
-            by=By.XPATH, value="//input[@class='form-control required']"
+        inputs = self._wait_for(
+            driver, "input.form-control.required", self.timeouts.players, count=4
         )
+        if inputs is None:
+            logging.error("Failed to add the second player.")
+            return False
 
-        inputs[2].send_keys("Memari")
-        inputs[3].send_keys("Issa")
+        inputs[2].send_keys(PLAYERS[1][0])
+        inputs[3].send_keys(PLAYERS[1][1])
         inputs[3].send_keys("\t")
 
         logging.info("Player information filled")
 
-        submit_button = driver.find_element(by=By.ID, value="submitControle")
+        self._check_stop()
+        submit_button = driver.find_element(by="id", value="submitControle")
         submit_button.click()
 
         # find table tags
-        tables = driver.find_elements(by=By.TAG_NAME, value="table")
+        tables = self._wait_for(driver, "table", self.timeouts.payment) or []
         found = False
         for table in tables:
             if table.text.startswith("J’utilise 1 heure\nde mon carnet en ligne"):
@@ -310,12 +1006,14 @@ class Booker:
                 break
 
         if not found:
-            logging.error(f"Carnet seems empty for user {self.username}.",)
+            logging.error(f"Carnet seems empty for user {user.username}.")
+            self.timings.fail(Failure.CARNET_EMPTY.value)
             return False
 
         logging.info("Carnet has available hours")
 
-        submit_button = driver.find_element(by=By.ID, value="submit")
+        self._check_stop()
+        submit_button = driver.find_element(by="id", value="submit")
         submit_button.click()
 
         logging.info(
@@ -329,19 +1027,30 @@ class Booker:
         )
         return True
 
-    def _save_screenshot(self, driver: webdriver.Chrome, path: str) -> None:
-        # Ref: https://stackoverflow.com/a/52572919/
-        original_size = driver.get_window_size()
-        required_width = driver.execute_script(
-            "return document.body.parentNode.scrollWidth"
-        )
-        required_height = driver.execute_script(
-            "return document.body.parentNode.scrollHeight"
-        )
-        driver.set_window_size(required_width, required_height)
-        driver.find_element_by_tag_name("body").screenshot(path)  # avoids scrollbar
-        driver.set_window_size(original_size["width"], original_size["height"])
+    def _save_artifacts(self, driver: "webdriver.Chrome", reason: str) -> None:
+        """
+        Capture the page source and a screenshot of the whole page if the
+        failure is sampled, and hand them to the artifact writer.
+        """
+        attempt_id = self.artifacts.sample(reason)
+        if attempt_id is None:
+            return
+
+        artifacts = {}
+        try:
+            artifacts["html"] = driver.page_source
+            # Captures below the fold without resizing the window
+            screenshot = driver.execute_cdp_cmd(
+                "Page.captureScreenshot",
+                {"format": "png", "captureBeyondViewport": True},
+            )
+            artifacts["png"] = screenshot["data"]
+        except WebDriverException as e:
+            logging.warning(
+                "Failed to capture failure artifacts.",
+                {"attempt_id": attempt_id, "exception": str(e)},
+            )
+            if not artifacts:
+                return
 
-    def _save_page_source(self, driver: webdriver.Chrome, path: str) -> None:
-        with open(path, "w") as f:
-            f.write(driver.page_source)
+        self.artifacts.save(attempt_id, reason, artifacts)
@@ -0,0 +1,230 @@
+import json
+import logging
+import os
+import pickle
+import re
+
+from datetime import datetime, timedelta
+
+from .tennis import Availability, Court, DateTime, Facility
+from .auth import User, Website
+from .booking import Preferences
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Changes whenever the records of the cache change, to ignore older caches
+CACHE_VERSION = 1
+
+TIME_RANGE = re.compile(r"^(\d{1,2})h-(\d{1,2})h$")
+DATE_FORMAT = "%d/%m/%Y"
+
+
+def parse_times(times: str) -> List[str]:
+    """
+    Times of a comma separated list, from the most to the least preferred.
+    A range of hours is expanded in the order it is written, so 18h-21h
+    prefers the earliest hour and 21h-18h the latest.
+    """
+    parsed = []
+    for part in times.split(","):
+        match = TIME_RANGE.match(part)
+        if match is None:
+            parsed.append(part)
+            continue
+        first, last = int(match.group(1)), int(match.group(2))
+        step = 1 if last >= first else -1
+        parsed += [f"{hour:02d}h" for hour in range(first, last + step, step)]
+    return list(dict.fromkeys(parsed))
+
+
+def parse_dates(dates: str, days: int = 1) -> List[str]:
+    """
+    Dates of a comma separated list of dates or ranges of dates, e.g.
+    24/09/2022-30/09/2022, in chronological order. A single date starts
+    `days` consecutive days.
+    """
+    parsed = set()
+    for part in dates.split(","):
+        first, _, last = part.partition("-")
+        first = datetime.strptime(first, DATE_FORMAT)
+        if last:
+            last = datetime.strptime(last, DATE_FORMAT)
+        else:
+            last = first + timedelta(days=days - 1)
+        parsed.update(
+            first + timedelta(days=day) for day in range((last - first).days + 1)
+        )
+    return [date.strftime(DATE_FORMAT) for date in sorted(parsed)]
+
+
+class Catalog:
+    def __init__(self, facilities: List[Facility]):
+        """
+        Catalog of the facilities and courts of the data file, indexed so that
+        the courts matching some preferences are found without checking every
+        court, and expanded into availabilities already grouped and ranked.
+
+        Parameters
+        ----------
+        facilities : List[Facility]
+            Facilities with their courts, whose IDs are unique.
+        """
+        self.facilities = facilities
+        self.courts = [court for facility in facilities for court in facility.courts]
+        # Positions of the courts in self.courts, by value of each attribute
+        self.by_facility = self._index(court.facility_name for court in self.courts)
+        self.by_location = self._index(court.location for court in self.courts)
+        self.by_surface_type = self._index(court.surface_type for court in self.courts)
+        self.by_id = self._index(court.id for court in self.courts)
+
+    @staticmethod
+    def _index(values: Iterable) -> Dict[object, Tuple[int, ...]]:
+        index = {}
+        for position, value in enumerate(values):
+            index.setdefault(value, []).append(position)
+        return {value: tuple(positions) for value, positions in index.items()}
+
+    @staticmethod
+    def from_dict(data: dict) -> "Catalog":
+        return Catalog(
+            [Facility.from_dict(facility) for facility in data["tennis_facilities"]]
+        )
+
+    def select_facilities(self, preferences: Preferences) -> List[Facility]:
+        """
+        Facilities accepted by the preferences, from the most to the least
+        preferred.
+        """
+        facilities = [
+            facility
+            for facility in self.facilities
+            if preferences.tennis_facility is None
+            or facility.name in preferences.tennis_facility
+        ]
+        positions, unlisted = preferences.positions[0]
+        return sorted(facilities, key=lambda f: positions.get(f.name, unlisted))
+
+    def select(self, preferences: Preferences) -> List[Court]:
+        """
+        Courts accepted by the preferences, from the most to the least
+        preferred when they are available at the same time. Each accepted
+        value of an attribute is looked up in its index, and the positions
+        of the values of different attributes are intersected.
+        """
+        criteria = [
+            (self.by_facility, preferences.tennis_facility),
+            (self.by_id, preferences.court_id),
+        ]
+        if preferences.location is not None:
+            locations = [Court.Location(value) for value in preferences.location]
+            criteria.append((self.by_location, locations))
+        if preferences.surface_type is not None:
+            surfaces = [Court.SurfaceType(value) for value in preferences.surface_type]
+            criteria.append((self.by_surface_type, surfaces))
+
+        selected = None
+        for index, values in criteria:
+            if values is None:
+                continue
+            positions = set()
+            for value in values:
+                positions.update(index.get(value, ()))
+            selected = positions if selected is None else selected & positions
+            if not selected:
+                return []
+
+        courts = (
+            self.courts
+            if selected is None
+            else [self.courts[position] for position in sorted(selected)]
+        )
+        (facility, facilities), _, (surface, surfaces), (court, ids) = (
+            preferences.positions
+        )
+        return sorted(
+            courts,
+            key=lambda c: (
+                facility.get(c.facility_name, facilities),
+                surface.get(c.surface_type.value, surfaces),
+                court.get(c.id, ids),
+            ),
+        )
+
+    def availabilities(
+        self, preferences: Preferences, dates: List[str]
+    ) -> List[List[Availability]]:
+        """
+        Availabilities of the selected courts on the dates and at the times
+        of the preferences, grouped as Preferences.group does: one group per
+        facility and date, from the most to the least preferred availability,
+        and groups sorted by their most preferred availability.
+        """
+        courts = self.select(preferences)
+        times = preferences.time_order or []
+        positions, unlisted = preferences.positions[1]
+        times = sorted(dict.fromkeys(times), key=lambda t: positions.get(t, unlisted))
+
+        facilities = {}
+        for court in courts:
+            facilities.setdefault(court.facility_name, []).append(court)
+
+        groups = []
+        for date in dates:
+            date_times = [DateTime(date, time_) for time_ in times]
+            for facility_courts in facilities.values():
+                groups.append(
+                    [
+                        Availability(date_time, court)
+                        for date_time in date_times
+                        for court in facility_courts
+                    ]
+                )
+        groups = [group for group in groups if group]
+        return sorted(groups, key=lambda group: preferences.rank(group[0]))
+
+
+def load_catalog(
+    path: str, cache: Optional[str] = None
+) -> Tuple[Website, List[User], Catalog]:
+    """
+    Load the website, the users and the catalog of a data file. With a cache
+    path, the parsed data and the indexes of the catalog are pickled there,
+    and loaded instead of the data file as long as it has not changed.
+    """
+    stat = os.stat(path)
+    key = (CACHE_VERSION, os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+    if cache:
+        try:
+            with open(cache, "rb") as f:
+                cached_key, loaded = pickle.load(f)
+            if cached_key == key:
+                return loaded
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.warning("Failed to load the catalog cache.", {"exception": str(e)})
+
+    with open(path, "r") as f:
+        data = json.load(f)
+
+    loaded = (
+        Website(**data["website"]),
+        [User(**user) for user in data["users"]],
+        Catalog.from_dict(data),
+    )
+
+    if cache:
+        try:
+            if os.path.dirname(cache):
+                os.makedirs(os.path.dirname(cache), exist_ok=True)
+            # The cache holds the passwords of the users
+            tmp = f"{cache}.tmp"
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump((key, loaded), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, cache)
+        except OSError as e:
+            logging.warning("Failed to write the catalog cache.", {"exception": str(e)})
+
+    return loaded
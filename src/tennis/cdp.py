@@ -0,0 +1,380 @@
+import base64
+import json
+import logging
+import time
+
+from urllib.parse import urldefrag, urlparse
+
+from selenium.common.exceptions import WebDriverException
+
+from .tennis import Availability
+from .auth import User
+from .booking import Booker, LoggedOut, PLAYERS
+from .client import CARNET_TEXT, HttpBooker, parse_reserve_buttons
+from .driver import Session
+from .rate import Failure
+
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+if TYPE_CHECKING:
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+
+# Resolves with the first truthy value returned by find, as soon as the page
+# makes it available, or with null after the timeout. A MutationObserver
+# wakes the search up on every change of the page instead of polling it.
+WAIT_UNTIL = """
+function waitUntil(find, timeout) {
+  return new Promise(function (resolve) {
+    var found = find();
+    if (found) { resolve(found); return; }
+    var timer = null;
+    var observer = new MutationObserver(function () {
+      var found = find();
+      if (found) { observer.disconnect(); clearTimeout(timer); resolve(found); }
+    });
+    observer.observe(document, {childList: true, subtree: true, attributes: true});
+    timer = setTimeout(function () { observer.disconnect(); resolve(null); }, timeout * 1000);
+  });
+}
+function waitFor(selector, count, timeout) {
+  return waitUntil(function () {
+    var elements = document.querySelectorAll(selector);
+    return elements.length >= count ? Array.prototype.slice.call(elements) : null;
+  }, timeout);
+}
+function fill(input, value) {
+  input.focus();
+  input.value = value;
+  input.dispatchEvent(new Event('input', {bubbles: true}));
+  input.dispatchEvent(new Event('change', {bubbles: true}));
+  input.blur();
+}
+// Clicks after the script returned, the click may leave the page
+function clickLater(element) {
+  setTimeout(function () { element.click(); }, 0);
+}
+"""
+
+# Opens the date picker, picks the date and submits the search. Returns the
+# URL the search is submitted to, or the name of the element not found. Pages
+# are not waited for, so a redirect to the login page is only seen from here.
+SEARCH_SCRIPT = """
+var date = args[0], timeouts = args[1], loginHost = args[2];
+var when = await waitUntil(function () {
+  if (location.host === loginHost) { return 'logged_out'; }
+  return document.querySelector('#when');
+}, timeouts.search);
+if (when === 'logged_out') { return {logged_out: true}; }
+if (!when) { return {missing: 'when'}; }
+when.click();
+var day = await waitFor("div[dateiso='" + date + "']", 1, timeouts.date);
+if (!day) { return {missing: 'date'}; }
+day[0].click();
+var rechercher = await waitFor('#rechercher', 1, timeouts.search);
+if (!rechercher) { return {missing: 'rechercher'}; }
+var form = rechercher[0].form;
+clickLater(rechercher[0]);
+return {action: form && form.action ? form.action : location.href};
+"""
+
+# Clicks the reserve button of a court, which may not be displayed yet.
+RESERVE_SCRIPT = """
+var selector = "button[courtid='" + args[0] + "'][datedeb='" + args[1] + "']";
+var button = await waitFor(selector, 1, args[2]);
+if (!button) { return 'missing'; }
+clickLater(button[0]);
+return 'ok';
+"""
+
+# Fills in the two players and submits the form.
+PLAYERS_SCRIPT = """
+var players = args[0], timeouts = args[1], loginHost = args[2];
+if (location.host === loginHost) { return 'logged_out'; }
+var inputs = await waitFor('input.form-control.required', 1, timeouts.players);
+if (!inputs) { return 'account_busy'; }
+fill(inputs[0], players[0][0]);
+fill(inputs[1], players[0][1]);
+document.querySelector(
+  "button[class='btn btn-darkblue small addPlayer rollover rollover-grey']"
+).click();
+inputs = await waitFor('input.form-control.required', 4, timeouts.players);
+if (!inputs) { return 'second_player'; }
+fill(inputs[2], players[1][0]);
+fill(inputs[3], players[1][1]);
+clickLater(document.getElementById('submitControle'));
+return 'ok';
+"""
+
+# Pays with the carnet and submits the payment. Waits for the carnet itself
+# rather than for any table, since the players page may still be displayed.
+PAYMENT_SCRIPT = """
+var carnet = args[0], timeouts = args[1];
+var table = await waitUntil(function () {
+  return Array.prototype.slice.call(document.querySelectorAll('table')).find(
+    function (table) {
+      return table.innerText.split(/\\s+/).join(' ').trim().indexOf(carnet) === 0;
+    }
+  );
+}, timeouts.payment);
+if (!table) { return 'carnet_empty'; }
+table.click();
+clickLater(document.getElementById('submit'));
+return 'ok';
+"""
+
+
+class CdpBooker(Booker):
+    """
+    Booker driving the browser through the Chrome DevTools Protocol instead
+    of one WebDriver command per element. Every step of the booking flow is
+    a single script that waits for its elements in the page and clicks them,
+    the results of the search are parsed from the response the browser
+    received instead of the rendered page, which skips the map and the time
+    panels, and pages are not waited for until they are loaded. It takes the
+    same parameters as Booker.
+    """
+
+    def _options(self) -> "Options":
+        options = super()._options()
+        # Scripts wait for the elements they need, not for the whole page
+        options.page_load_strategy = "none"
+        # Network events are read from the performance log
+        options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+        options.add_experimental_option(
+            "perfLoggingPrefs", {"enableNetwork": True, "enablePage": False}
+        )
+        return options
+
+    def _run(
+        self, driver: "webdriver.Chrome", script: str, args: list, timeout: float
+    ) -> Any:
+        """
+        Run an async script in the page and return its value, or None if
+        the script raised an exception. A script run while the browser leaves
+        a page is run again on the next page until the timeout.
+        """
+        expression = (
+            f"(async function (args) {{ {WAIT_UNTIL} {script} }})"
+            f"({json.dumps(args)})"
+        )
+        deadline = time.time() + timeout + 1
+        while True:
+            try:
+                result = driver.execute_cdp_cmd(
+                    "Runtime.evaluate",
+                    {
+                        "expression": expression,
+                        "awaitPromise": True,
+                        "returnByValue": True,
+                    },
+                )
+            except WebDriverException:
+                # The page was replaced while the script was running
+                if time.time() >= deadline:
+                    raise
+                self._check_stop()
+                time.sleep(0.01)
+                continue
+
+            if "exceptionDetails" in result:
+                details = result["exceptionDetails"]
+                exception = details.get("exception", {}).get("description")
+                logging.error(
+                    "Unexpected exception.",
+                    {"exception": exception or details.get("text")},
+                )
+                return None
+            return result["result"].get("value")
+
+    def _wait_for_response(
+        self, driver: "webdriver.Chrome", url: str, timeout: float
+    ) -> Optional[str]:
+        """
+        Wait for the browser to receive the page of a request to a URL, from
+        the network events of the performance log. It will return the body
+        of the page, or None if it did not come before the timeout.
+        """
+        url = urldefrag(url)[0]
+        login_host = urlparse(self.website.login_url).netloc
+        request_id = None
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            self._check_stop()
+            for entry in driver.get_log("performance"):
+                message = json.loads(entry["message"])["message"]
+                method, params = message["method"], message["params"]
+                if method == "Network.requestWillBeSent" and request_id is None:
+                    if urldefrag(params["request"]["url"])[0] == url:
+                        request_id = params["requestId"]
+                if params.get("requestId") != request_id or request_id is None:
+                    continue
+                if method == "Network.responseReceived":
+                    if urlparse(params["response"]["url"]).netloc == login_host:
+                        raise LoggedOut()
+                elif method == "Network.loadingFailed":
+                    logging.error(
+                        "Search request failed.", {"error": params.get("errorText")}
+                    )
+                    return None
+                elif method == "Network.loadingFinished":
+                    body = driver.execute_cdp_cmd(
+                        "Network.getResponseBody", {"requestId": request_id}
+                    )
+                    if body.get("base64Encoded"):
+                        return base64.b64decode(body["body"]).decode("utf-8")
+                    return body["body"]
+            time.sleep(0.01)
+        return None
+
+    def _book(
+        self, session: Session, user: User, availabilities: List[Availability]
+    ) -> bool:
+        driver = session.driver
+        date = availabilities[0].date_time.date
+        timeouts = vars(self.timeouts)
+
+        self.timings.step("search")
+
+        # A parked browser is already on the search page, but it was loaded
+        # before the release and would miss the released date
+        if session.parked:
+            session.parked = False
+            self._reload_search(driver)
+        else:
+            self._open_search(driver)
+
+        self._check_stop()
+        # Events of the previous pages are not needed anymore
+        driver.get_log("performance")
+        login_host = urlparse(self.website.login_url).netloc
+        search = self._run(
+            driver,
+            SEARCH_SCRIPT,
+            [date, timeouts, login_host],
+            self.timeouts.search * 2 + self.timeouts.date,
+        )
+        if search is None:
+            return False
+        if search.get("logged_out"):
+            raise LoggedOut()
+        if search.get("missing") == "date":
+            logging.error(f"Failed to find date element. Date {date} is not available.")
+            self.timings.fail(Failure.DATE_UNAVAILABLE.value)
+            return False
+        if search.get("missing") is not None:
+            logging.error(f"Failed to find {search['missing']} element.")
+            return False
+
+        logging.info(f"Chosen date {date}.")
+        logging.info("Searched for available courts.")
+
+        self.timings.step("time")
+        page = self._wait_for_response(driver, search["action"], self.timeouts.search)
+        if page is None:
+            logging.error("Failed to get the search results.")
+            return False
+
+        buttons = parse_reserve_buttons(page)
+        if len(buttons) == 0:
+            logging.error(
+                f"Failed to find any reserve buttons. {availabilities[0]} is not available.",
+            )
+            self.timings.fail(Failure.NO_SLOT.value)
+            attempt_id = self.artifacts.sample(Failure.NO_SLOT.value)
+            if attempt_id is not None:
+                self.artifacts.save(attempt_id, Failure.NO_SLOT.value, {"html": page})
+            return False
+
+        logging.info(f"Found {len(buttons)} reserve buttons.")
+
+        match = HttpBooker.match(availabilities, buttons)
+        if match is None:
+            logging.error(
+                f"Failed to click on the reserve button. None of the {len(availabilities)} wanted courts is available.",
+            )
+            self.timings.fail(Failure.NO_SLOT.value)
+            return False
+
+        availability, button = match
+        logging.info(f"{availability} is available.")
+
+        self.timings.step("reserve")
+        self._check_stop()
+        with self._hold_account(user) as held:
+            if not held:
+                return False
+            booked = self._reserve(driver, user, availability, button)
+            if booked and self.claim is not None:
+                self.claim.mark_booked()
+            return booked
+
+    def _reserve(
+        self,
+        driver: "webdriver.Chrome",
+        user: User,
+        availability: Availability,
+        button: Dict[str, str],
+    ) -> bool:
+        timeouts = vars(self.timeouts)
+        clicked = self._run(
+            driver,
+            RESERVE_SCRIPT,
+            [button["courtid"], button["datedeb"], self.timeouts.time],
+            self.timeouts.time,
+        )
+        if clicked != "ok":
+            logging.error(f"Failed to find the reserve button of {availability}.")
+            return False
+
+        logging.info(
+            f"Clicked on the reserve button for court {availability.court.id}."
+        )
+
+        self.timings.step("submit")
+        self._check_stop()
+        login_host = urlparse(self.website.login_url).netloc
+        filled = self._run(
+            driver,
+            PLAYERS_SCRIPT,
+            [PLAYERS, timeouts, login_host],
+            self.timeouts.players * 2,
+        )
+        if filled is None:
+            return False
+        if filled == "logged_out":
+            raise LoggedOut()
+        if filled == "account_busy":
+            logging.error(
+                f"Failed to find any inputs for player information. Account {user.username} already has a reservation.",
+            )
+            self.timings.fail(Failure.ACCOUNT_BUSY.value)
+            return False
+        if filled != "ok":
+            logging.error("Failed to add the second player.")
+            return False
+
+        logging.info("Player information filled")
+
+        self._check_stop()
+        paid = self._run(
+            driver, PAYMENT_SCRIPT, [CARNET_TEXT, timeouts], self.timeouts.payment
+        )
+        if paid is None:
+            return False
+        if paid != "ok":
+            logging.error(f"Carnet seems empty for user {user.username}.")
+            self.timings.fail(Failure.CARNET_EMPTY.value)
+            return False
+
+        logging.info("Carnet has available hours")
+        logging.info(
+            "Court booked",
+            {
+                "court_date": availability.date_time.date,
+                "court_time": availability.date_time.time,
+                "court_id": availability.court.id,
+                "username": user.username,
+            },
+        )
+        return True
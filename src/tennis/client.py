@@ -0,0 +1,648 @@
+import logging
+import re
+import threading
+import time
+
+from contextlib import nullcontext
+
+import requests
+
+from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib.parse import urljoin, urlparse
+
+from .tennis import Availability
+from .auth import User, Website
+from .eligibility import Eligibility
+from .cookies import CookieCache
+from .booking import Booker, LoggedOut, PLAYERS
+from .schedule import AccountLocks, BookingClaim
+from .stop import Cancelled, StopFlag
+from .metrics import StepTimer
+from .rate import Failure
+
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+RESERVE_BUTTON_CLASSES = ("buttonHasReservation", "buttonAllOk")
+CARNET_TEXT = "J’utilise 1 heure de mon carnet en ligne"
+
+# Views of the profile of a user, read before the race to tell whether the
+# user can book at all
+RESERVATION_VIEW = "ma_reservation"
+CARNET_VIEW = "mes_tickets_reservation"
+NO_RESERVATION_TEXT = "Vous n’avez pas de réservation en cours"
+CANCEL_TEXT = "Annuler"
+CARNET_HOURS = re.compile(r"(\d+)\s+heures?\s+restantes?", re.IGNORECASE)
+
+
+def parse_reserve_buttons(html: str) -> List[Dict[str, str]]:
+    """
+    Attributes of the reserve buttons of a page of search results.
+    """
+    soup = BeautifulSoup(html, "lxml")
+    buttons = []
+    for button in soup.find_all("button", attrs={"courtid": True}):
+        if any(c in button.get("class", []) for c in RESERVE_BUTTON_CLASSES):
+            attrs = {k: v for k, v in button.attrs.items() if k != "class"}
+            attrs["class"] = " ".join(button.get("class", []))
+            buttons.append(attrs)
+    return buttons
+
+
+def parse_reservation(html: str) -> Optional[bool]:
+    """
+    Whether the reservation view of a profile shows a reservation in
+    progress, or None if the page does not tell.
+    """
+    soup = BeautifulSoup(html, "lxml")
+    text = " ".join(soup.get_text(" ").split())
+    if NO_RESERVATION_TEXT in text:
+        return False
+    for element in soup.find_all(["button", "a", "input"]):
+        label = element.get("value") if element.name == "input" else element.text
+        if label and CANCEL_TEXT in label:
+            return True
+    return None
+
+
+def parse_carnet_hours(html: str) -> Optional[int]:
+    """
+    Number of hours left on the carnets of a profile, or None if the page
+    does not tell.
+    """
+    text = " ".join(BeautifulSoup(html, "lxml").get_text(" ").split())
+    hours = CARNET_HOURS.findall(text)
+    if not hours:
+        return None
+    return sum(int(h) for h in hours)
+
+
+class HttpBooker:
+    def __init__(
+        self,
+        website: Website,
+        cookie_cache: Optional[CookieCache] = None,
+        fallback: Optional[Booker] = None,
+        timeout: float = 10,
+        pool_size: int = 4,
+        account_locks: Optional[AccountLocks] = None,
+        stop: Optional[StopFlag] = None,
+        claim: Optional[BookingClaim] = None,
+    ):
+        """
+        HttpBooker object. This object books a tennis court like Booker does,
+        but replays the forms of the website with plain HTTP requests instead
+        of driving a browser, which makes an attempt a few round trips long.
+
+        Parameters
+        ----------
+        website : Website
+            Website object containing the login and search URLs.
+
+        cookie_cache : CookieCache, optional
+            Cache of authenticated cookies shared with the other workers.
+
+        fallback : Booker, optional
+            Booker used to login with a browser when the login form cannot be
+            submitted over HTTP. If not specified, such users cannot be used.
+
+        timeout : float, optional
+            Timeout of every request in seconds, by default 10
+
+        pool_size : int, optional
+            Number of connections kept open per user, by default 4. It should
+            be at least the number of requests made concurrently for a user.
+
+        account_locks : AccountLocks, optional
+            Locks shared with the other workers so that only one of them makes
+            a reservation with a given user at a time.
+
+        stop : StopFlag, optional
+            Flag shared with the other workers. Attempts are cancelled as soon
+            as it is set.
+
+        claim : BookingClaim, optional
+            Claim shared with the other workers so that only one of them
+            books a court. If not specified, every worker books its own.
+        """
+        self.website = website
+        self.cookie_cache = cookie_cache
+        self.fallback = fallback
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.account_locks = account_locks
+        self.claim = claim
+        self.stop = stop
+        self.timings = StepTimer()
+        self.sessions: Dict[str, requests.Session] = {}
+        self.login_locks: Dict[str, threading.Lock] = {}
+        self.search_form: Optional[dict] = None
+
+    def close(self) -> None:
+        """
+        Close the HTTP sessions and the browsers of the fallback booker.
+        """
+        for session in self.sessions.values():
+            session.close()
+        self.sessions.clear()
+        if self.fallback is not None:
+            self.fallback.close()
+
+    def prepare(self, user: User) -> bool:
+        """
+        Login a user, open the connection to the tennis website and fetch the
+        search form ahead of the first attempt. It will return True if the user
+        is ready, and False otherwise.
+        """
+        return self._attempt(
+            user, lambda session: bool(self._search_form(session)), "prepare"
+        )
+
+    def book(
+        self, user: User, availabilities: Union[Availability, List[Availability]]
+    ) -> bool:
+        """
+        Book a tennis court. This method will login to the website, search for
+        the availabilities, and book the most preferred one that is available.
+        It will return True if the booking was successful, and False otherwise.
+
+        Parameters
+        ----------
+        user : User
+            User object containing the username and password.
+
+        availabilities : Union[Availability, List[Availability]]
+            Availabilities at the same facility and on the same date, from the
+            most to the least preferred, as grouped by Preferences.group. They
+            are all matched against a single search.
+        """
+        if isinstance(availabilities, Availability):
+            availabilities = [availabilities]
+
+        def step(session: requests.Session) -> bool:
+            buttons = self._search(session, availabilities)
+
+            match = self.match(availabilities, buttons)
+            if match is not None:
+                return self._reserve(session, user, match[1])
+
+            logging.error(
+                f"Failed to find the reserve button. None of the {len(availabilities)} wanted courts is available.",
+            )
+            self.timings.fail(Failure.NO_SLOT.value)
+            return False
+
+        return self._attempt(
+            user,
+            step,
+            "book",
+            availability=str(availabilities[0]),
+            candidates=len(availabilities),
+        )
+
+    def search(
+        self, user: User, availabilities: List[Availability]
+    ) -> Optional[List[Dict[str, str]]]:
+        """
+        Search for the courts of a facility on a given date, at the times of
+        the availabilities. It will return the attributes of the reserve
+        buttons found in the results, or None if the search failed.
+        """
+        return self._attempt(
+            user,
+            lambda session: self._search(session, availabilities),
+            "search",
+            default=None,
+            facility=availabilities[0].court.facility_name,
+            date=availabilities[0].date_time.date,
+        )
+
+    def check(self, user: User) -> Optional[Eligibility]:
+        """
+        Read the profile of a user to tell whether they can book: whether
+        they already have a reservation and how many hours are left on their
+        carnets. It will return None if the profile could not be read.
+        """
+        return self._attempt(
+            user, lambda session: self._check(session, user), "check", default=None
+        )
+
+    @staticmethod
+    def match(
+        availabilities: List[Availability], buttons: List[Dict[str, str]]
+    ) -> Optional[Tuple[Availability, Dict[str, str]]]:
+        """
+        Most preferred availability that has a reserve button, and its button.
+        The availabilities are expected from the most to the least preferred.
+        """
+        found = {(b.get("courtid"), b.get("datedeb")): b for b in buttons}
+        for availability in availabilities:
+            if availability.key in found:
+                return availability, found[availability.key]
+        return None
+
+    def reserve(self, user: User, button: Dict[str, str]) -> bool:
+        """
+        Book the court of a reserve button returned by search. It will return
+        True if the booking was successful, and False otherwise.
+        """
+        return self._attempt(
+            user,
+            lambda session: self._reserve(session, user, button),
+            "reserve",
+            court_id=button.get("courtid"),
+        )
+
+    def _attempt(
+        self,
+        user: User,
+        step: Callable[[requests.Session], Any],
+        action: str,
+        default: Any = False,
+        **fields,
+    ) -> Any:
+        """
+        Run a step with the logged in HTTP session of a user, taking care of
+        the login and of dropping the session once it has expired. The attempt
+        is timed under the name of the action.
+        """
+        self.timings.begin(action, username=user.username, **fields)
+        outcome = "failure"
+        try:
+            self._check_stop()
+            session = self._session(user)
+            if session is None:
+                return default
+            result = step(session)
+            if result is not default and result is not False:
+                outcome = "success"
+            return result
+        except Cancelled:
+            logging.info("Attempt cancelled.")
+            outcome = "cancelled"
+            return default
+        except LoggedOut:
+            outcome = "logged_out"
+            logging.warning(f"Session of {user.username} expired.")
+            session = self.sessions.pop(user.username, None)
+            if session is not None:
+                session.close()
+            if self.cookie_cache is not None:
+                self.cookie_cache.invalidate(user.username)
+            return default
+        except requests.RequestException as e:
+            logging.error("HTTP failure.", {"exception": str(e)})
+            outcome = "error"
+            return default
+        finally:
+            self.timings.end(outcome)
+
+    def _check_stop(self) -> None:
+        if self.stop is not None:
+            self.stop.check()
+
+    def _session(self, user: User) -> Optional[requests.Session]:
+        session = self.sessions.get(user.username)
+        if session is not None:
+            return session
+
+        self.timings.step("login")
+
+        # Concurrent attempts of the same user must not all login at once
+        with self.login_locks.setdefault(user.username, threading.Lock()):
+            session = self.sessions.get(user.username)
+            if session is not None:
+                return session
+
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=self.pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+
+            if not self._login(session, user):
+                session.close()
+                return None
+
+            self.sessions[user.username] = session
+            return session
+
+    def _login(self, session: requests.Session, user: User) -> bool:
+        """
+        Login to the website, reusing cached cookies when there are some, then
+        submitting the login form, and then using the browser of the fallback
+        booker.
+        """
+        cookies = None
+        if self.cookie_cache is not None:
+            cookies = self.cookie_cache.get(user.username)
+
+        if cookies is None:
+            if self._submit_login_form(session, user):
+                logging.info(f"Logged in as {user.username}.")
+                if self.cookie_cache is not None:
+                    self.cookie_cache.put(user.username, self._get_cookies(session))
+                return True
+
+            if self.fallback is None:
+                logging.error(f"Failed to login as {user.username}.")
+                return False
+
+            logging.warning(f"Logging in as {user.username} with a browser.")
+            cookies = self.fallback.export_cookies(user)
+            if cookies is None:
+                return False
+
+        for cookie in cookies:
+            session.cookies.set(
+                cookie["name"],
+                cookie["value"],
+                domain=cookie.get("domain"),
+                path=cookie.get("path", "/"),
+            )
+
+        logging.info(f"Restored session of {user.username}.")
+        return True
+
+    def _submit_login_form(self, session: requests.Session, user: User) -> bool:
+        response = session.get(self.website.login_url, timeout=self.timeout)
+        soup = BeautifulSoup(response.text, "lxml")
+
+        username_input = soup.find("input", id="username")
+        form = username_input.find_parent("form") if username_input else None
+        if form is None:
+            logging.error("Failed to find the login form.")
+            return False
+
+        data = self._form_data(form)
+        data["username"] = user.username
+        data["password"] = user.password
+
+        submit = form.find(attrs={"name": "Submit"})
+        if submit is not None:
+            data["Submit"] = submit.get("value", "")
+
+        action = urljoin(response.url, form.get("action") or response.url)
+        response = session.post(action, data=data, timeout=self.timeout)
+        return not self._is_logged_out(response)
+
+    def _get_cookies(self, session: requests.Session) -> List[dict]:
+        cookies = []
+        for cookie in session.cookies:
+            c = {
+                "name": cookie.name,
+                "value": cookie.value,
+                "domain": cookie.domain,
+                "path": cookie.path,
+                "secure": bool(cookie.secure),
+                "httpOnly": cookie.has_nonstandard_attr("HttpOnly"),
+            }
+            if cookie.expires is not None:
+                c["expires"] = cookie.expires
+            cookies.append(c)
+        return cookies
+
+    def _is_logged_out(self, response: requests.Response) -> bool:
+        """
+        Whether the request was sent back to the login page.
+        """
+        login_host = urlparse(self.website.login_url).netloc
+        return urlparse(response.url).netloc == login_host
+
+    def _search_form(self, session: requests.Session) -> dict:
+        """
+        Get the action and the default values of the search form. The form is
+        only fetched once since it does not change between searches.
+        """
+        if self.search_form is not None:
+            return self.search_form
+
+        response = session.get(self.website.search_url, timeout=self.timeout)
+        if self._is_logged_out(response):
+            raise LoggedOut()
+
+        soup = BeautifulSoup(response.text, "lxml")
+        rechercher = soup.find(id="rechercher")
+        element = rechercher.find_parent("form") if rechercher else None
+        if element is None:
+            raise requests.RequestException("Failed to find the search form.")
+
+        self.search_form = {
+            "action": urljoin(response.url, element.get("action") or response.url),
+            "data": self._form_data(element),
+        }
+        return self.search_form
+
+    def _check(self, session: requests.Session, user: User) -> Eligibility:
+        pages = {}
+        for view in (RESERVATION_VIEW, CARNET_VIEW):
+            self.timings.step(view)
+            response = session.get(
+                f"{self.website.portal_url}?page=profil&view={view}",
+                timeout=self.timeout,
+            )
+            if self._is_logged_out(response):
+                raise LoggedOut()
+            response.raise_for_status()
+            pages[view] = response.text
+            self._check_stop()
+
+        return Eligibility(
+            username=user.username,
+            has_reservation=parse_reservation(pages[RESERVATION_VIEW]),
+            carnet_hours=parse_carnet_hours(pages[CARNET_VIEW]),
+            checked_at=time.time(),
+        )
+
+    def _search(
+        self, session: requests.Session, availabilities: List[Availability]
+    ) -> List[Dict[str, str]]:
+        self.timings.step("search")
+        form = self._search_form(session)
+
+        self._check_stop()
+
+        # A single search covers all the hours of the availabilities
+        facility_name = availabilities[0].court.facility_name
+        date = availabilities[0].date_time.date
+        hours = [int(a.date_time.time[:-1]) for a in availabilities]
+        data = dict(form["data"])
+        data["when"] = date
+        data["hourRange"] = f"{min(hours)}-{max(hours) + 1}"
+        data["selWhereTennisName"] = facility_name
+
+        response = session.post(form["action"], data=data, timeout=self.timeout)
+        if self._is_logged_out(response):
+            raise LoggedOut()
+
+        buttons = parse_reserve_buttons(response.text)
+
+        logging.info(
+            f"Searched for available courts at {facility_name}.",
+            {"date": date, "hour_range": data["hourRange"], "buttons": len(buttons)},
+        )
+        return buttons
+
+    def _reserve(
+        self, session: requests.Session, user: User, button: Dict[str, str]
+    ) -> bool:
+        account = nullcontext(True)
+        if self.account_locks is not None:
+            account = self.account_locks.hold(user.username)
+        claim = nullcontext(True) if self.claim is None else self.claim.hold()
+
+        with account as held:
+            if not held:
+                return False
+            with claim as claimed:
+                if not claimed:
+                    return False
+                booked = self._make_reservation(session, user, button)
+                if booked and self.claim is not None:
+                    self.claim.mark_booked()
+                return booked
+
+    def _make_reservation(
+        self, session: requests.Session, user: User, button: Dict[str, str]
+    ) -> bool:
+        self.timings.step("reserve")
+        response = session.post(
+            f"{self.website.portal_url}?page=reservation&action=reservation_creneau",
+            data={
+                "equipmentId": button.get("equipmentid", ""),
+                "courtId": button["courtid"],
+                "dateDeb": button["datedeb"],
+                "dateFin": button.get("datefin", ""),
+                "annulation": "false",
+            },
+            timeout=self.timeout,
+        )
+        if self._is_logged_out(response):
+            raise LoggedOut()
+
+        logging.info(f"Reserved court {button['courtid']}.")
+
+        soup = BeautifulSoup(response.text, "lxml")
+        inputs = soup.select("input.form-control.required")
+        if len(inputs) == 0:
+            logging.error(
+                f"Failed to find any inputs for player information. Account {user.username} already has a reservation.",
+            )
+            self.timings.fail(Failure.ACCOUNT_BUSY.value)
+            return False
+
+        self._check_stop()
+        self.timings.step("submit")
+
+        form = inputs[0].find_parent("form")
+        if form is None or any(not element.get("name") for element in inputs):
+            raise requests.RequestException("Failed to find the players form.")
+
+        names = [name for player in PLAYERS for name in player]
+        fields = self._player_fields([element["name"] for element in inputs])
+        if len(fields) < len(names):
+            raise requests.RequestException("Failed to find the players form.")
+
+        data = self._form_data(form)
+        data.update(zip(fields, names))
+
+        response = session.post(
+            urljoin(response.url, form.get("action") or response.url),
+            data=data,
+            timeout=self.timeout,
+        )
+
+        logging.info("Player information filled")
+
+        soup = BeautifulSoup(response.text, "lxml")
+        carnet = None
+        for table in soup.find_all("table"):
+            if " ".join(table.get_text(" ").split()).startswith(CARNET_TEXT):
+                carnet = table
+                break
+
+        if carnet is None:
+            logging.error(f"Carnet seems empty for user {user.username}.")
+            self.timings.fail(Failure.CARNET_EMPTY.value)
+            return False
+
+        logging.info("Carnet has available hours")
+
+        self._check_stop()
+
+        form = carnet.find_parent("form")
+        if form is None:
+            raise requests.RequestException("Failed to find the payment form.")
+
+        data = self._form_data(form)
+        choice = carnet.find("input", attrs={"name": True})
+        if choice is not None:
+            data[choice["name"]] = choice.get("value", "on")
+
+        response = session.post(
+            urljoin(response.url, form.get("action") or response.url),
+            data=data,
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+
+        logging.info(
+            "Court booked",
+            {
+                "court_datetime": button["datedeb"],
+                "court_id": button["courtid"],
+                "username": user.username,
+            },
+        )
+        return True
+
+    @staticmethod
+    def _player_fields(fields: List[str]) -> List[str]:
+        """
+        Names of the fields of every player. The page may only have the
+        inputs of the first player, whose add player button creates the
+        inputs of the next ones with a script, named like those of the first
+        player with their own number instead of 1.
+        """
+        per_player = len(PLAYERS[0])
+        first = fields[:per_player]
+        for number in range(len(fields) // per_player + 1, len(PLAYERS) + 1):
+            added = [re.sub(r"(?<!\d)1(?!\d)", str(number), f, 1) for f in first]
+            if added == first:
+                break
+            fields = fields + added
+        return fields
+
+    @staticmethod
+    def _form_data(form) -> Dict[str, Union[str, List[str]]]:
+        """
+        Get the values a browser would submit for a form without clicking any
+        of its buttons. Fields that appear several times, like groups of
+        checkboxes, get a list of values.
+        """
+        data = {}
+        for element in form.find_all(["input", "select", "textarea"]):
+            name = element.get("name")
+            if not name:
+                continue
+
+            if element.name == "select":
+                option = element.find("option", selected=True)
+                option = option or element.find("option")
+                value = option.get("value", option.text) if option else ""
+            elif element.name == "textarea":
+                value = element.text
+            else:
+                kind = element.get("type", "text").lower()
+                if kind in ("submit", "button", "image", "reset"):
+                    continue
+                if kind in ("checkbox", "radio") and not element.has_attr("checked"):
+                    continue
+                value = element.get("value", "on" if kind == "checkbox" else "")
+
+            if name not in data:
+                data[name] = value
+            elif isinstance(data[name], list):
+                data[name].append(value)
+            else:
+                data[name] = [data[name], value]
+        return data
@@ -0,0 +1,47 @@
+import time
+
+from datetime import datetime, timedelta
+
+
+def parse_release_at(release_at: str) -> float:
+    """
+    Convert a time of day to the timestamp of its next occurrence.
+
+    Parameters
+    ----------
+    release_at : str
+        Local time of day, format: 08:00:00
+
+    Returns
+    -------
+    float
+        Timestamp of the next occurrence of that time of day.
+    """
+    now = datetime.now()
+    t = datetime.strptime(release_at, "%H:%M:%S").time()
+    release = datetime.combine(now.date(), t)
+    if release <= now:
+        release += timedelta(days=1)
+    return release.timestamp()
+
+
+def wait_until(timestamp: float, spin: float = 0.05) -> None:
+    """
+    Block until the given timestamp. The bulk of the wait is spent sleeping,
+    the last few milliseconds are spent spinning so that the wake up is not
+    delayed by the scheduler.
+
+    Parameters
+    ----------
+    timestamp : float
+        Timestamp to wait for.
+
+    spin : float, optional
+        Number of seconds spent spinning before the timestamp, by default 0.05
+    """
+    while True:
+        remaining = timestamp - time.time()
+        if remaining <= 0:
+            return
+        if remaining > spin:
+            time.sleep(remaining - spin)
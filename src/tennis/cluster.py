@@ -0,0 +1,587 @@
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+
+from collections import deque
+from contextlib import contextmanager
+
+from .tennis import Availability, Court, DateTime
+from .auth import User
+from .schedule import diagonal_jobs
+from .stop import StopFlag
+
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+# Messages are JSON objects, one per line. Requests of the workers get a
+# reply, while the control connection of an agent carries its heartbeats one
+# way and the stop broadcast the other way.
+
+
+def parse_address(value: str) -> Tuple[str, int]:
+    """
+    Parse an address like "10.0.0.1:7000".
+    """
+    host, _, port = value.rpartition(":")
+    return host or "0.0.0.0", int(port)
+
+
+class Coordinator:
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        users: List[User],
+        groups: List[List[Availability]],
+        heartbeat_timeout: float = 5,
+    ):
+        """
+        Coordinator object. This object hands out the (user, group) jobs to
+        the workers of every agent, makes sure that only one of them makes a
+        reservation with a given user at a time and that only one of them
+        books a court at all, collects the heartbeats and
+        statistics of the agents, and tells all of them to stop as soon as
+        one of them booked a court.
+
+        Parameters
+        ----------
+        address : Tuple[str, int]
+            Host and port to listen on.
+
+        users : List[User]
+            Users to book with.
+
+        groups : List[List[Availability]]
+            Groups of availabilities to book, as returned by
+            Preferences.group.
+
+        heartbeat_timeout : float, optional
+            Number of seconds without heartbeat after which an agent is
+            considered dead and its jobs are handed out again, by default 5
+        """
+        self.jobs = [
+            {
+                "username": user.username,
+                "availabilities": [
+                    [a.court.id, a.date_time.date, a.date_time.time] for a in group
+                ],
+            }
+            for user, group in diagonal_jobs(users, groups)
+        ]
+        self.heartbeat_timeout = heartbeat_timeout
+
+        self.lock = threading.Lock()
+        self.queue = deque(range(len(self.jobs)))
+        self.attempts = [0] * len(self.jobs)
+        # Jobs and accounts held by each connection
+        self.leases: Dict[int, Set[int]] = {}
+        self.holds: Dict[str, int] = {}
+        # Connection holding the booking claim, from reservation to payment
+        self.claim: Optional[int] = None
+        # Agent of each connection, and state of each agent
+        self.owners: Dict[int, str] = {}
+        self.agents: Dict[str, dict] = {}
+        self.controls: Dict[str, "socketserver.StreamRequestHandler"] = {}
+
+        self.booked = threading.Event()
+        self.booked_by: Optional[str] = None
+        self.server = _Server(address, self)
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self.server.server_address
+
+    def start(self) -> "Coordinator":
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        logging.info(
+            f"Coordinator listening on {self.address[0]}:{self.address[1]}.",
+            {"jobs": len(self.jobs)},
+        )
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def run(self, report_interval: float = 10) -> bool:
+        """
+        Serve the agents until one of them books a court. Agents that stop
+        sending heartbeats are dropped and their jobs handed out again. It
+        will return True if a court was booked.
+        """
+        start = time.time()
+        reported_at = start
+        try:
+            while not self.booked.wait(timeout=1):
+                self.drop_silent_agents()
+                if time.time() - reported_at >= report_interval:
+                    self.log_agents()
+                    reported_at = time.time()
+        except KeyboardInterrupt:
+            logging.info("Coordinator interrupted.")
+            self.broadcast_stop()
+
+        self.log_agents()
+        self.log_coverage(time.time() - start)
+        return self.booked.is_set()
+
+    def handle(self, connection: int, message: dict) -> Optional[dict]:
+        """
+        Handle a message received on a connection. It will return the reply,
+        or None if the message does not get one.
+        """
+        kind = message.get("type")
+        with self.lock:
+            if kind == "hello":
+                agent = message["agent"]
+                self.owners[connection] = agent
+                state = self.agents.setdefault(agent, {"stats": {}})
+                state["last_seen"] = time.time()
+                return {"type": "welcome", "booked": self.booked.is_set()}
+
+            if kind == "take":
+                if self.booked.is_set() or not self.queue:
+                    return {"type": "none", "booked": self.booked.is_set()}
+                index = self.queue.popleft()
+                self.leases.setdefault(connection, set()).add(index)
+                return dict(self.jobs[index], type="job", index=index)
+
+            if kind == "put_back":
+                index = message["index"]
+                if index in self.leases.get(connection, set()):
+                    self.leases[connection].discard(index)
+                    if message.get("attempted", True):
+                        self.attempts[index] += 1
+                    self.queue.append(index)
+                return {"type": "ok"}
+
+            if kind == "hold":
+                username = message["username"]
+                holder = self.holds.get(username)
+                if holder is not None and holder != connection:
+                    return {"type": "held", "ok": False}
+                self.holds[username] = connection
+                return {"type": "held", "ok": True}
+
+            if kind == "unhold":
+                if self.holds.get(message["username"]) == connection:
+                    del self.holds[message["username"]]
+                return {"type": "ok"}
+
+            if kind == "claim":
+                if self.booked.is_set():
+                    return {"type": "claimed", "ok": False, "booked": True}
+                if self.claim is not None and self.claim != connection:
+                    return {"type": "claimed", "ok": False, "booked": False}
+                self.claim = connection
+                return {"type": "claimed", "ok": True, "booked": False}
+
+            if kind == "unclaim":
+                if self.claim == connection:
+                    self.claim = None
+                return {"type": "ok"}
+
+            if kind == "claim_booked":
+                # Refuse the claim to every other worker before replying
+                claimed = self.claim == connection and not self.booked.is_set()
+                if claimed:
+                    self.booked.set()
+                    self.booked_by = self.owners.get(connection)
+
+            if kind == "heartbeat":
+                state = self.agents.setdefault(message["agent"], {"stats": {}})
+                state["last_seen"] = time.time()
+                state["stats"] = message.get("stats", {})
+                state.pop("dead", None)
+                return None
+
+        if kind == "claim_booked":
+            if claimed:
+                logging.info(f"Agent {self.booked_by} booked a court.")
+                self.broadcast_stop()
+            return {"type": "ok"}
+
+        if kind == "booked":
+            logging.info(f"Agent {message.get('agent')} booked a court.")
+            if not self.booked.is_set():
+                self.booked_by = message.get("agent")
+                self.broadcast_stop()
+            return None
+
+        return {"type": "error", "error": f"Unknown message type: {kind}"}
+
+    def broadcast_stop(self) -> None:
+        """
+        Tell every agent to stop.
+        """
+        self.booked.set()
+        with self.lock:
+            controls = list(self.controls.items())
+        for agent, control in controls:
+            try:
+                control.send({"type": "stop", "booked_by": self.booked_by})
+            except OSError:
+                logging.warning(f"Failed to tell agent {agent} to stop.")
+
+    def disconnect(self, connection: int) -> None:
+        """
+        Hand out again the jobs of a closed connection, e.g. of a worker that
+        died, and free the accounts and the booking claim it held.
+        """
+        with self.lock:
+            for index in self.leases.pop(connection, set()):
+                self.queue.append(index)
+            for username, holder in list(self.holds.items()):
+                if holder == connection:
+                    del self.holds[username]
+            if self.claim == connection:
+                self.claim = None
+            self.owners.pop(connection, None)
+
+    def drop_silent_agents(self) -> None:
+        now = time.time()
+        with self.lock:
+            silent = [
+                agent
+                for agent, state in self.agents.items()
+                if not state.get("dead")
+                and now - state.get("last_seen", now) > self.heartbeat_timeout
+            ]
+            for agent in silent:
+                self.agents[agent]["dead"] = True
+            connections = [c for c, a in self.owners.items() if a in silent]
+
+        for agent in silent:
+            logging.error(f"Agent {agent} stopped sending heartbeats.")
+        for connection in connections:
+            self.disconnect(connection)
+
+    def log_agents(self) -> None:
+        with self.lock:
+            agents = {a: dict(s) for a, s in self.agents.items()}
+        for agent, state in agents.items():
+            logging.info(
+                f"Agent {agent}.",
+                dict(
+                    state["stats"],
+                    alive=not state.get("dead", False),
+                    seconds_since_heartbeat=round(
+                        time.time() - state.get("last_seen", time.time()), 3
+                    ),
+                ),
+            )
+
+    def log_coverage(self, elapsed: float) -> None:
+        """
+        Log how often each (user, group) pair was checked by the agents.
+        """
+        with self.lock:
+            attempts = list(self.attempts)
+        if not attempts or elapsed <= 0:
+            return
+
+        logging.info(
+            "Coverage",
+            {
+                "elapsed": round(elapsed, 3),
+                "agents": len(self.agents),
+                "attempts": sum(attempts),
+                "attempts_per_second": round(sum(attempts) / elapsed, 3),
+                "jobs": len(attempts),
+                "jobs_checked": sum(1 for a in attempts if a > 0),
+                "min_checks_per_second": round(min(attempts) / elapsed, 3),
+                "max_checks_per_second": round(max(attempts) / elapsed, 3),
+            },
+        )
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def setup(self) -> None:
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.write_lock = threading.Lock()
+
+    def send(self, message: dict) -> None:
+        with self.write_lock:
+            self.wfile.write(json.dumps(message).encode() + b"\n")
+            self.wfile.flush()
+
+    def handle(self) -> None:
+        coordinator: Coordinator = self.server.coordinator
+        connection = id(self)
+        try:
+            for line in self.rfile:
+                message = json.loads(line)
+                if message.get("type") == "hello" and message.get("control"):
+                    with coordinator.lock:
+                        coordinator.controls[message["agent"]] = self
+                reply = coordinator.handle(connection, message)
+                if reply is not None:
+                    self.send(reply)
+        except (OSError, ValueError) as e:
+            logging.warning("Agent connection failed.", {"exception": str(e)})
+        finally:
+            with coordinator.lock:
+                for agent, control in list(coordinator.controls.items()):
+                    if control is self:
+                        del coordinator.controls[agent]
+            coordinator.disconnect(connection)
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address: Tuple[str, int], coordinator: Coordinator):
+        self.coordinator = coordinator
+        super().__init__(address, _Handler)
+
+
+class Client:
+    def __init__(self, address: Tuple[str, int], agent: str):
+        """
+        Connection of a process to the coordinator. Every process opens its
+        own connection on first use, so that the coordinator can hand out the
+        jobs of a worker again when its connection closes.
+        """
+        self.address = address
+        self.agent = agent
+        self.lock = threading.Lock()
+        self.pid: Optional[int] = None
+        self.socket: Optional[socket.socket] = None
+
+    def __reduce__(self):
+        # Sockets cannot be sent to the worker processes, connect again
+        return (Client, (self.address, self.agent))
+
+    def request(self, message: dict) -> dict:
+        with self.lock:
+            if self.pid != os.getpid():
+                self._connect()
+            self.file.write(json.dumps(message).encode() + b"\n")
+            self.file.flush()
+            line = self.file.readline()
+            if not line:
+                self.pid = None
+                raise ConnectionError("Coordinator closed the connection.")
+            return json.loads(line)
+
+    def _connect(self) -> None:
+        self.socket = socket.create_connection(self.address)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.file = self.socket.makefile("rwb")
+        self.pid = os.getpid()
+        self.file.write(
+            json.dumps({"type": "hello", "agent": self.agent}).encode() + b"\n"
+        )
+        self.file.flush()
+        self.file.readline()
+
+
+class RemoteScheduler:
+    def __init__(self, client: Client, users: List[User], courts: List[Court]):
+        """
+        Scheduler whose jobs are handed out by the coordinator. It has the
+        interface of Scheduler, so that workers do not know whether they run
+        alone or as part of a cluster.
+        """
+        self.client = client
+        self.users = {user.username: user for user in users}
+        self.courts = {court.id: court for court in courts}
+
+    def take(
+        self, slot: int, timeout: float = 1.0
+    ) -> Optional[Tuple[int, User, List[Availability]]]:
+        try:
+            job = self.client.request({"type": "take"})
+        except OSError as e:
+            logging.error("Failed to reach the coordinator.", {"exception": str(e)})
+            time.sleep(timeout)
+            return None
+
+        if job["type"] != "job":
+            time.sleep(min(timeout, 0.05))
+            return None
+
+        user = self.users.get(job["username"])
+        group = [
+            Availability(DateTime(date, time_), self.courts[court_id])
+            for court_id, date, time_ in job["availabilities"]
+            if court_id in self.courts
+        ]
+        if user is None or not group:
+            logging.error(f"Job {job['index']} is unknown to this agent.")
+            self.put_back(slot, job["index"], attempted=False)
+            # Give the job to the other agents instead of taking it right back
+            time.sleep(min(timeout, 0.05))
+            return None
+
+        return job["index"], user, group
+
+    def put_back(self, slot: int, index: int, attempted: bool = True) -> None:
+        try:
+            self.client.request(
+                {"type": "put_back", "index": index, "attempted": attempted}
+            )
+        except OSError as e:
+            logging.error("Failed to reach the coordinator.", {"exception": str(e)})
+
+    def release(self, slot: int) -> None:
+        # The coordinator hands out the jobs of a dead worker again once its
+        # connection closes
+        pass
+
+    def log_coverage(self, elapsed: float) -> None:
+        # Coverage is logged by the coordinator
+        pass
+
+
+class RemoteAccountLocks:
+    def __init__(self, client: Client):
+        """
+        Account locks held by the coordinator, so that only one worker of the
+        whole cluster makes a reservation with a given user at a time.
+        """
+        self.client = client
+
+    @contextmanager
+    def hold(self, username: str) -> Iterator[bool]:
+        """
+        Try to take the lock of a user without waiting. Yields True if the
+        lock was taken, and False if another worker holds it.
+        """
+        try:
+            held = self.client.request({"type": "hold", "username": username})["ok"]
+        except OSError as e:
+            logging.error("Failed to reach the coordinator.", {"exception": str(e)})
+            held = False
+
+        if not held:
+            logging.warning(f"Account {username} is being used by another worker.")
+            yield False
+            return
+
+        try:
+            yield True
+        finally:
+            try:
+                self.client.request({"type": "unhold", "username": username})
+            except OSError:
+                pass
+
+
+class RemoteBookingClaim:
+    def __init__(self, client: Client, timeout: float = 30):
+        """
+        Booking claim held by the coordinator, so that only one worker of the
+        whole cluster books a court. It has the interface of BookingClaim.
+        """
+        self.client = client
+        self.timeout = timeout
+
+    def mark_booked(self) -> None:
+        try:
+            self.client.request({"type": "claim_booked"})
+        except OSError as e:
+            logging.error("Failed to reach the coordinator.", {"exception": str(e)})
+
+    @contextmanager
+    def hold(self) -> Iterator[bool]:
+        """
+        Take the claim, waiting for the reservation of another worker to end.
+        Yields True if the claim was taken, and False if a court was booked
+        or the claim was not released in time.
+        """
+        deadline = time.time() + self.timeout
+        while True:
+            try:
+                reply = self.client.request({"type": "claim"})
+            except OSError as e:
+                logging.error("Failed to reach the coordinator.", {"exception": str(e)})
+                yield False
+                return
+
+            if reply["ok"]:
+                break
+            if reply["booked"]:
+                logging.warning("A court was already booked by another worker.")
+                yield False
+                return
+            if time.time() >= deadline:
+                logging.warning("Another worker held the booking claim for too long.")
+                yield False
+                return
+            time.sleep(0.05)
+
+        try:
+            yield True
+        finally:
+            try:
+                self.client.request({"type": "unclaim"})
+            except OSError:
+                pass
+
+    def abandon(self, pid: int) -> None:
+        # The coordinator frees the claim of a dead worker once its connection
+        # closes
+        pass
+
+
+class Agent:
+    def __init__(self, address: Tuple[str, int], name: str):
+        """
+        Control connection of an agent to the coordinator. It sends the
+        heartbeats of the agent and sets the stop flag of its workers as soon
+        as the coordinator says a court was booked.
+        """
+        self.address = address
+        self.name = name
+        self.socket: Optional[socket.socket] = None
+        # Whether the coordinator told the agent to stop
+        self.stopped = False
+
+    def start(self, booked: StopFlag) -> "Agent":
+        self.socket = socket.create_connection(self.address)
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.file = self.socket.makefile("rwb")
+        self._send({"type": "hello", "agent": self.name, "control": True})
+        welcome = json.loads(self.file.readline())
+        if welcome.get("booked"):
+            self.stopped = True
+            booked.set()
+
+        def listen() -> None:
+            for line in self.file:
+                message = json.loads(line)
+                if message.get("type") == "stop":
+                    logging.info(
+                        "Coordinator says a court was booked.",
+                        {"booked_by": message.get("booked_by")},
+                    )
+                    self.stopped = True
+                    booked.set()
+                    return
+            logging.error("Lost the connection to the coordinator.")
+
+        threading.Thread(target=listen, daemon=True).start()
+        logging.info(f"Agent {self.name} connected to the coordinator.")
+        return self
+
+    def heartbeat(self, stats: dict) -> None:
+        self._send({"type": "heartbeat", "agent": self.name, "stats": stats})
+
+    def announce_booked(self) -> None:
+        self._send({"type": "booked", "agent": self.name})
+
+    def close(self) -> None:
+        if self.socket is not None:
+            self.socket.close()
+
+    def _send(self, message: dict) -> None:
+        try:
+            self.file.write(json.dumps(message).encode() + b"\n")
+            self.file.flush()
+        except OSError as e:
+            logging.error("Failed to reach the coordinator.", {"exception": str(e)})
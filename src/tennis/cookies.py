@@ -0,0 +1,80 @@
+import fcntl
+import json
+import logging
+import os
+import time
+
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+
+class CookieCache:
+    def __init__(self, path: str, ttl: float = 1800):
+        """
+        File-backed cache of authenticated cookies. The cache is shared by all
+        the worker processes so that a user only has to go through the login
+        form once, whichever process logs in first.
+
+        Parameters
+        ----------
+        path : str
+            Path of the JSON file where cookies are stored.
+
+        ttl : float, optional
+            Number of seconds after which cached cookies are considered
+            expired, by default 1800
+        """
+        self.path = path
+        self.ttl = ttl
+
+    def get(self, username: str) -> Optional[List[dict]]:
+        """
+        Get the cookies of a user, or None if there are no fresh cookies.
+        """
+        with self._locked():
+            entry = self._read().get(username)
+
+        if entry is None:
+            return None
+
+        if time.time() - entry["saved_at"] > self.ttl:
+            return None
+
+        return entry["cookies"]
+
+    def put(self, username: str, cookies: List[dict]) -> None:
+        with self._locked():
+            entries = self._read()
+            entries[username] = {"saved_at": time.time(), "cookies": cookies}
+            self._write(entries)
+
+    def invalidate(self, username: str) -> None:
+        with self._locked():
+            entries = self._read()
+            if entries.pop(username, None) is not None:
+                self._write(entries)
+
+    @contextmanager
+    def _locked(self):
+        with open(self.path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read(self) -> Dict[str, dict]:
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            logging.warning("Ignoring corrupted cookie cache.", {"exception": str(e)})
+            return {}
+
+    def _write(self, entries: Dict[str, dict]) -> None:
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(entries, f)
+        os.replace(tmp, self.path)
@@ -0,0 +1,218 @@
+import logging
+import threading
+
+from selenium.common.exceptions import (
+    InvalidSessionIdException,
+    NoSuchWindowException,
+    SessionNotCreatedException,
+    WebDriverException,
+)
+from urllib3.exceptions import HTTPError
+
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
+from dataclasses import dataclass
+
+if TYPE_CHECKING:
+    from selenium import webdriver
+
+# Errors of the commands of a browser. Once chromedriver or Chrome is dead,
+# commands fail to connect instead of raising WebDriverException.
+BROWSER_ERRORS = (WebDriverException, HTTPError, OSError)
+
+# Messages of chromedriver once Chrome crashed or it lost Chrome
+DEAD_BROWSER_MESSAGES = (
+    "chrome not reachable",
+    "disconnected",
+    "session deleted",
+    "tab crashed",
+    "unable to receive message from renderer",
+)
+
+
+def is_dead(e: Exception) -> bool:
+    """
+    Whether an error of a browser command means that the browser is dead,
+    rather than that the command failed on the page, e.g. on an element that
+    is missing or stale.
+    """
+    if isinstance(
+        e,
+        (InvalidSessionIdException, NoSuchWindowException, SessionNotCreatedException),
+    ):
+        return True
+    if isinstance(e, WebDriverException):
+        message = (e.msg or "").lower()
+        return any(dead in message for dead in DEAD_BROWSER_MESSAGES)
+    return isinstance(e, (HTTPError, OSError))
+
+
+@dataclass
+class Session:
+    driver: "webdriver.Chrome"
+    username: str
+    uses: int = 0
+    logged_in: bool = False
+    parked: bool = False
+
+
+class DriverPool:
+    def __init__(
+        self,
+        factory: Callable[[], "webdriver.Chrome"],
+        max_uses: int = 50,
+        on_quit: Optional[Callable[["webdriver.Chrome"], None]] = None,
+        spares: int = 0,
+    ):
+        """
+        Pool of long-lived browser sessions. The pool keeps one Chrome driver
+        per user so that consecutive booking attempts reuse the same logged in
+        browser instead of launching a new one.
+
+        Parameters
+        ----------
+        factory : Callable[[], webdriver.Chrome]
+            Function used to create a new Chrome driver.
+
+        max_uses : int, optional
+            Number of attempts after which a session is recycled, by default 50
+
+        on_quit : Callable[[webdriver.Chrome], None], optional
+            Function called once a driver has quit, e.g. to remove its files.
+
+        spares : int, optional
+            Number of idle drivers launched ahead by fill, so that a new
+            session does not wait for a browser to start, by default 0
+        """
+        self.factory = factory
+        self.max_uses = max_uses
+        self.on_quit = on_quit
+        self.sessions: Dict[str, Session] = {}
+        self.spares = spares
+        self.idle: List["webdriver.Chrome"] = []
+        # Number of spare drivers being launched
+        self.launching = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def __reduce__(self):
+        # Drivers and locks stay in the process that created them
+        return (DriverPool, (self.factory, self.max_uses, self.on_quit, self.spares))
+
+    def fill(self) -> None:
+        """
+        Launch spare drivers in the background until there are spares of
+        them, idle or launching.
+        """
+        with self.condition:
+            missing = self.spares - len(self.idle) - self.launching
+            if missing <= 0 or self.closed:
+                return
+            self.launching += missing
+        for _ in range(missing):
+            threading.Thread(target=self._launch_spare, daemon=True).start()
+
+    def _launch_spare(self) -> None:
+        driver = None
+        try:
+            driver = self.factory()
+        except Exception as e:
+            logging.warning("Failed to launch a spare driver.", {"exception": str(e)})
+
+        with self.condition:
+            self.launching -= 1
+            if driver is not None and not self.closed:
+                self.idle.append(driver)
+                driver = None
+            self.condition.notify_all()
+
+        # The pool was closed while the driver was launching
+        if driver is not None:
+            self._quit(driver)
+            if self.on_quit is not None:
+                self.on_quit(driver)
+
+    def _take_spare(self) -> Optional["webdriver.Chrome"]:
+        """
+        Take an idle spare driver, waiting for one that is launching rather
+        than launching another one.
+        """
+        with self.condition:
+            while not self.idle and self.launching > 0:
+                self.condition.wait()
+            driver = self.idle.pop() if self.idle else None
+
+        if driver is not None:
+            self.fill()
+        return driver
+
+    def acquire(self, username: str) -> Session:
+        """
+        Get the session of a user. A new session is created if the user has
+        none, or if the existing one is worn out or no longer responds.
+        """
+        session = self.sessions.get(username)
+
+        if session is not None and session.uses >= self.max_uses:
+            logging.info(f"Recycling driver of {username} after {session.uses} uses.")
+            self.discard(username)
+            session = None
+
+        if session is not None and not self._is_alive(session.driver):
+            logging.warning(f"Driver of {username} is not responding, recycling it.")
+            self.discard(username)
+            session = None
+
+        if session is None:
+            driver = self._take_spare() if self.spares > 0 else None
+            if driver is None:
+                driver = self.factory()
+            session = Session(driver=driver, username=username)
+            self.sessions[username] = session
+
+        return session
+
+    def release(self, session: Session, healthy: bool = True) -> None:
+        """
+        Give a session back to the pool. Sessions that crashed during the
+        attempt are quit right away.
+        """
+        session.uses += 1
+        if not healthy:
+            self.discard(session.username)
+
+    def discard(self, username: str) -> None:
+        session = self.sessions.pop(username, None)
+        if session is not None:
+            self._quit(session.driver)
+            if self.on_quit is not None:
+                self.on_quit(session.driver)
+
+    def close(self) -> None:
+        """
+        Quit every driver of the pool, including the spare ones.
+        """
+        for username in list(self.sessions):
+            self.discard(username)
+
+        with self.condition:
+            self.closed = True
+            idle, self.idle = self.idle, []
+        for driver in idle:
+            self._quit(driver)
+            if self.on_quit is not None:
+                self.on_quit(driver)
+
+    @staticmethod
+    def _is_alive(driver: "webdriver.Chrome") -> bool:
+        try:
+            driver.execute_script("return 1")
+        except Exception:
+            return False
+        return True
+
+    @staticmethod
+    def _quit(driver: "webdriver.Chrome") -> None:
+        try:
+            driver.quit()
+        except Exception as e:
+            logging.warning("Failed to quit driver.", {"exception": str(e)})
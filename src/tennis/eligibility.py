@@ -0,0 +1,138 @@
+import json
+import logging
+import os
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+
+from .auth import User
+from .rate import Failure
+
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+if TYPE_CHECKING:
+    from .client import HttpBooker
+
+
+@dataclass
+class Eligibility:
+    username: str
+    # None when the profile did not tell
+    has_reservation: Optional[bool]
+    carnet_hours: Optional[int]
+    checked_at: float
+
+    @property
+    def failure(self) -> Optional[Failure]:
+        """
+        Failure every attempt of the user would end with, or None if the
+        user can book as far as the profile tells.
+        """
+        if self.has_reservation:
+            return Failure.ACCOUNT_BUSY
+        if self.carnet_hours == 0:
+            return Failure.CARNET_EMPTY
+        return None
+
+
+class EligibilityCache:
+    def __init__(self, path: str, ttl: float = 600):
+        """
+        File-backed cache of the eligibility of the users, so that runs
+        started shortly after each other do not read every profile again.
+
+        Parameters
+        ----------
+        path : str
+            Path of the JSON file where eligibilities are stored.
+
+        ttl : float, optional
+            Number of seconds after which an eligibility is checked again, by
+            default 600
+        """
+        self.path = path
+        self.ttl = ttl
+
+    def get(self, username: str) -> Optional[Eligibility]:
+        """
+        Get the eligibility of a user, or None if it was not checked recently.
+        """
+        entry = self._read().get(username)
+        if entry is None or time.time() - entry["checked_at"] > self.ttl:
+            return None
+        return Eligibility(**entry)
+
+    def put(self, eligibilities: List[Eligibility]) -> None:
+        entries = self._read()
+        for eligibility in eligibilities:
+            entries[eligibility.username] = asdict(eligibility)
+
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(entries, f)
+        os.replace(tmp, self.path)
+
+    def _read(self) -> Dict[str, dict]:
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            logging.warning(
+                "Ignoring corrupted eligibility cache.", {"exception": str(e)}
+            )
+            return {}
+
+
+def check_eligibility(
+    checker: "HttpBooker",
+    users: List[User],
+    cache: Optional[EligibilityCache] = None,
+    concurrency: int = 4,
+) -> Dict[str, Optional[Eligibility]]:
+    """
+    Eligibility of every user, from the cache when it is fresh and otherwise
+    from their profile, read concurrently. Users whose profile could not be
+    read get None.
+    """
+    eligibilities = {}
+    unchecked = []
+    for user in users:
+        cached = cache.get(user.username) if cache is not None else None
+        eligibilities[user.username] = cached
+        if cached is None:
+            unchecked.append(user)
+
+    if unchecked:
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            for user, eligibility in zip(
+                unchecked, executor.map(checker.check, unchecked)
+            ):
+                eligibilities[user.username] = eligibility
+
+        checked = [eligibilities[user.username] for user in unchecked]
+        checked = [eligibility for eligibility in checked if eligibility is not None]
+        if cache is not None and checked:
+            cache.put(checked)
+
+    checked_now = {user.username for user in unchecked}
+    for user in users:
+        eligibility = eligibilities[user.username]
+        if eligibility is None:
+            logging.warning(f"Failed to check whether {user.username} can book.")
+            continue
+        logging.info(
+            f"Checked whether {user.username} can book.",
+            {
+                "has_reservation": eligibility.has_reservation,
+                "carnet_hours": eligibility.carnet_hours,
+                "reason": eligibility.failure.value if eligibility.failure else None,
+                "cached": user.username not in checked_now,
+            },
+        )
+
+    return eligibilities
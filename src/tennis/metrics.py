@@ -0,0 +1,207 @@
+import logging
+import math
+import os
+import threading
+import time
+
+from collections import Counter, defaultdict
+
+from typing import Dict, List, Optional
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    Nearest-rank percentile of a list of values, q being between 0 and 100.
+    """
+    values = sorted(values)
+    rank = max(0, math.ceil(q / 100 * len(values)) - 1)
+    return values[rank]
+
+
+class StepTimer:
+    def __init__(self):
+        """
+        Timer of the steps of booking attempts. An attempt is made of steps
+        that follow each other: starting a step ends the previous one. When an
+        attempt ends, its step durations, its outcome and the step it failed
+        at are logged, and the durations are added to histograms that can be
+        summarized at the end of the run.
+
+        Each thread times its own attempt, so a timer can be shared by
+        concurrent attempts.
+        """
+        self.durations: Dict[str, List[float]] = defaultdict(list)
+        self.outcomes: Counter = Counter()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def __reduce__(self):
+        # Locks cannot be sent to the worker processes, start from scratch
+        return (StepTimer, ())
+
+    def begin(self, action: str, **fields) -> None:
+        """
+        Start timing an attempt. The fields are logged with the attempt.
+        """
+        self.local.action = action
+        self.local.fields = fields
+        self.local.laps = {}
+        self.local.step = None
+        self.local.reason = None
+        self.local.started = time.perf_counter()
+
+    def step(self, name: str) -> None:
+        """
+        Start a step of the current attempt, ending the previous one.
+        """
+        if getattr(self.local, "laps", None) is None:
+            return
+        now = time.perf_counter()
+        self._close(now)
+        self.local.step = name
+        self.local.started = now
+
+    def fail(self, reason: str) -> None:
+        """
+        Record why the current attempt failed, e.g. "date_unavailable".
+        """
+        if getattr(self.local, "laps", None) is not None:
+            self.local.reason = reason
+
+    def last(self) -> Optional[dict]:
+        """
+        Record of the last attempt ended by the current thread.
+        """
+        return getattr(self.local, "last", None)
+
+    def end(self, outcome: str) -> Optional[dict]:
+        """
+        End the current attempt with the given outcome, e.g. "success" or
+        "failure", and log it.
+        """
+        if getattr(self.local, "laps", None) is None:
+            return None
+        self._close(time.perf_counter())
+
+        laps = self.local.laps
+        record = {
+            "action": self.local.action,
+            "outcome": outcome,
+            "total_ms": round(sum(laps.values()) * 1000, 1),
+            **{f"{step}_ms": round(d * 1000, 1) for step, d in laps.items()},
+            **self.local.fields,
+        }
+        if outcome != "success":
+            record["failed_step"] = self.local.step
+            if self.local.reason is not None:
+                record["reason"] = self.local.reason
+
+        with self.lock:
+            for step, duration in laps.items():
+                self.durations[step].append(duration)
+            self.durations["total"].append(sum(laps.values()))
+            self.outcomes[(self.local.action, outcome)] += 1
+
+        self.local.laps = None
+        self.local.last = record
+        logging.info("Attempt timings", record)
+        return record
+
+    def _close(self, now: float) -> None:
+        if self.local.step is not None:
+            duration = now - self.local.started
+            laps = self.local.laps
+            laps[self.local.step] = laps.get(self.local.step, 0) + duration
+
+    def summary(self) -> dict:
+        """
+        Percentiles of the duration of each step, in milliseconds, and number
+        of attempts per action and outcome.
+        """
+        with self.lock:
+            steps = {
+                step: {
+                    "count": len(durations),
+                    "p50": round(percentile(durations, 50) * 1000, 1),
+                    "p95": round(percentile(durations, 95) * 1000, 1),
+                    "p99": round(percentile(durations, 99) * 1000, 1),
+                    "max": round(max(durations) * 1000, 1),
+                }
+                for step, durations in self.durations.items()
+                if durations
+            }
+            outcomes = {
+                f"{action}_{outcome}": count
+                for (action, outcome), count in self.outcomes.items()
+            }
+        return {"steps": steps, "outcomes": outcomes}
+
+    def log_summary(self) -> None:
+        logging.info("Step timings summary", self.summary())
+
+
+def process_usage(pid: int, children: bool = True) -> dict:
+    """
+    CPU time and resident memory of a process, read from /proc. With
+    children, the usage of all its descendants (e.g. the Chrome processes of a
+    worker) is included.
+
+    Returns
+    -------
+    dict
+        cpu_seconds, rss_mb and number of processes.
+    """
+    pids = [pid]
+    if children:
+        parents = {}
+        for entry in os.listdir("/proc"):
+            if entry.isdigit():
+                stat = _read_stat(int(entry))
+                if stat is not None:
+                    parents.setdefault(int(stat[1]), []).append(int(entry))
+        i = 0
+        while i < len(pids):
+            pids.extend(parents.get(pids[i], []))
+            i += 1
+
+    ticks = os.sysconf("SC_CLK_TCK")
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    cpu, rss, count = 0.0, 0, 0
+    for p in pids:
+        stat = _read_stat(p)
+        if stat is None:
+            continue
+        # Fields after the command name, utime and stime are fields 14 and 15
+        cpu += (int(stat[11]) + int(stat[12])) / ticks
+        rss += int(stat[21]) * page_size
+        count += 1
+
+    return {
+        "cpu_seconds": round(cpu, 2),
+        "rss_mb": round(rss / 2 ** 20, 1),
+        "processes": count,
+    }
+
+
+def process_started_at(pid: int) -> Optional[float]:
+    """
+    Time at which a process was started, read from /proc with the resolution
+    of the clock ticks, or None if the process does not exist.
+    """
+    stat = _read_stat(pid)
+    if stat is None:
+        return None
+    with open("/proc/uptime", "r") as f:
+        uptime = float(f.read().split()[0])
+    # Field 22, in clock ticks since the boot
+    return time.time() - uptime + int(stat[19]) / os.sysconf("SC_CLK_TCK")
+
+
+def _read_stat(pid: int) -> Optional[List[str]]:
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # The command name is between parentheses and may contain spaces
+    return stat[stat.rindex(")") + 2 :].split()
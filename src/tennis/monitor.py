@@ -0,0 +1,116 @@
+import itertools
+import logging
+import time
+
+from .tennis import Availability
+from .auth import User
+from .client import HttpBooker
+
+from typing import Callable, Dict, List, Set, Tuple
+
+# (court ID, date time) of a free slot, as in the attributes of its button
+Slot = Tuple[str, str]
+
+
+class Monitor:
+    def __init__(self, booker: HttpBooker, interval: float = 2.0):
+        """
+        Monitor object. This object keeps searching the pages of a window of
+        dates and times, keeps a snapshot of the slots that are free on each
+        page and books a wanted court as soon as it shows up, which is how
+        courts freed by cancellations are caught.
+
+        Parameters
+        ----------
+        booker : HttpBooker
+            Booker used to search for and reserve courts.
+
+        interval : float, optional
+            Number of seconds between two searches, by default 2.0
+        """
+        self.booker = booker
+        self.interval = interval
+        # Free slots of each page, by (facility name, date)
+        self.snapshot: Dict[Tuple[str, str], Set[Slot]] = {}
+
+    def run(
+        self,
+        users: List[User],
+        groups: List[List[Availability]],
+        stop: Callable[[], bool],
+    ) -> bool:
+        """
+        Search the groups of availabilities, as returned by Preferences.group,
+        one after the other until one of them is booked or until stop returns
+        True. It will return True if a court was booked, and False otherwise.
+        """
+        groups = [group for group in groups if group]
+        if not users or not groups:
+            return False
+
+        logging.info(
+            f"Monitoring {len(groups)} searches every {self.interval} seconds."
+        )
+
+        users = itertools.cycle(users)
+        next_at = time.time()
+        for group in itertools.cycle(groups):
+            if stop():
+                return False
+
+            time.sleep(max(0, next_at - time.time()))
+            next_at = max(next_at + self.interval, time.time())
+
+            user = next(users)
+            buttons = self.booker.search(user, group)
+            if buttons is None:
+                continue
+
+            self.update(group, buttons)
+
+            match = self.booker.match(group, buttons)
+            if match is None:
+                continue
+
+            availability, button = match
+            logging.info(f"{availability} is available.")
+            if self.booker.reserve(user, button):
+                return True
+
+        return False
+
+    def update(
+        self, group: List[Availability], buttons: List[Dict[str, str]]
+    ) -> Tuple[Set[Slot], Set[Slot]]:
+        """
+        Replace the snapshot of the page of a group with the slots of its
+        reserve buttons, and log the slots that were released and taken since
+        the previous search. The first search of a page releases all of its
+        slots.
+
+        Returns
+        -------
+        Tuple[Set[Slot], Set[Slot]]
+            Released and taken slots.
+        """
+        facility_name = group[0].court.facility_name
+        date = group[0].date_time.date
+        page = (facility_name, date)
+
+        slots = {(b.get("courtid"), b.get("datedeb")) for b in buttons}
+        previous = self.snapshot.get(page, set())
+        released, taken = slots - previous, previous - slots
+        self.snapshot[page] = slots
+
+        for name, changed in (("released", released), ("taken", taken)):
+            if changed:
+                logging.info(
+                    f"{len(changed)} slots {name} at {facility_name} on {date}.",
+                    {
+                        "slots": sorted(
+                            f"{court_id} {start}" for court_id, start in changed
+                        )
+                    },
+                )
+
+        return released, taken
@@ -0,0 +1,139 @@
+import asyncio
+import itertools
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .tennis import Availability
+from .auth import User
+from .client import HttpBooker
+from .rate import RateController
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class Poller:
+    def __init__(
+        self,
+        booker: HttpBooker,
+        concurrency: int = 8,
+        rate: Optional[RateController] = None,
+    ):
+        """
+        Poller object. This object runs many availability searches at once
+        in a single process and books a court as soon as one of the searches
+        finds it.
+
+        Parameters
+        ----------
+        booker : HttpBooker
+            Booker used to search for and reserve courts.
+
+        concurrency : int, optional
+            Maximum number of requests in flight, by default 8
+
+        rate : RateController, optional
+            Rate controller shared with the other workers. If not specified,
+            searches are only limited by the concurrency.
+        """
+        self.booker = booker
+        self.concurrency = concurrency
+        self.rate = rate
+
+    def run(
+        self,
+        users: List[User],
+        groups: List[List[Availability]],
+        stop: Callable[[], bool],
+        offset: int = 0,
+    ) -> bool:
+        """
+        Poll the groups of availabilities, as returned by Preferences.group,
+        until one of them is booked or until stop returns True. It will return
+        True if a court was booked, and False otherwise. Workers polling the
+        same groups should use different offsets so that they do not all start
+        with the same search.
+        """
+        return asyncio.run(self._run(users, groups, stop, offset))
+
+    async def _run(
+        self,
+        users: List[User],
+        groups: List[List[Availability]],
+        stop: Callable[[], bool],
+        offset: int,
+    ) -> bool:
+        # One search returns every court of a facility on a date
+        groups = [group for group in groups if group]
+        if not users or not groups:
+            return False
+
+        probes = [(user, group) for group in groups for user in users]
+        offset %= len(probes)
+        probes = itertools.cycle(probes[offset:] + probes[:offset])
+
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=self.concurrency + 1)
+        found = asyncio.Queue(maxsize=self.concurrency)
+        booked = asyncio.Event()
+
+        async def probe() -> None:
+            while not booked.is_set() and not stop():
+                user, group = next(probes)
+                facility_name = group[0].court.facility_name
+                if self.rate is not None:
+                    delay = self.rate.acquire(user.username, facility_name)
+                    if delay > 0:
+                        await asyncio.sleep(min(delay, 0.05))
+                        continue
+
+                buttons, record = await loop.run_in_executor(
+                    executor, self._search, user, group
+                )
+                if self.rate is not None:
+                    self.rate.report(user.username, facility_name, record)
+
+                match = self.booker.match(group, buttons or [])
+                if match is not None:
+                    logging.info(f"{match[0]} is available.")
+                    try:
+                        found.put_nowait((user, match[1]))
+                    except asyncio.QueueFull:
+                        pass
+
+        async def book() -> None:
+            while not booked.is_set():
+                user, button = await found.get()
+                # A reservation that blew up must not stop the next ones
+                try:
+                    success = await loop.run_in_executor(
+                        executor, self.booker.reserve, user, button
+                    )
+                except Exception as e:
+                    logging.error(
+                        "Failed to reserve a court.",
+                        {"exception": repr(e), "court_id": button.get("courtid")},
+                    )
+                    continue
+                if success:
+                    booked.set()
+
+        logging.info(
+            f"Polling {len(groups)} searches with {self.concurrency} concurrent requests."
+        )
+
+        booking = asyncio.ensure_future(book())
+        try:
+            await asyncio.gather(*[probe() for _ in range(self.concurrency)])
+        finally:
+            booking.cancel()
+            executor.shutdown(wait=False)
+
+        return booked.is_set()
+
+    def _search(
+        self, user: User, group: List[Availability]
+    ) -> Tuple[Optional[List[Dict[str, str]]], Optional[dict]]:
+        # Timings are kept per thread, read them from the executor thread
+        buttons = self.booker.search(user, group)
+        return buttons, self.booker.timings.last()
@@ -0,0 +1,194 @@
+import logging
+import multiprocessing
+import time
+
+from enum import Enum
+
+from typing import Dict, List, Optional, Tuple
+
+
+class Failure(Enum):
+    """
+    Reasons for which a booking attempt failed, as logged in the "reason"
+    field of its timings.
+    """
+
+    DATE_UNAVAILABLE = "date_unavailable"
+    NO_SLOT = "no_slot"
+    ACCOUNT_BUSY = "account_busy"
+    CARNET_EMPTY = "carnet_empty"
+    ERROR = "error"
+
+
+# Backoff applied after a failure: whether it applies to the user or to the
+# facility, the initial delay and the maximum delay in seconds. The delay
+# doubles with every consecutive failure of the same key. Finding no free
+# court is what polling is about, it is only paced by the rates.
+BACKOFF: Dict[Failure, Tuple[str, float, float]] = {
+    Failure.DATE_UNAVAILABLE: ("facility", 0.25, 2),
+    Failure.ACCOUNT_BUSY: ("user", 60, 600),
+    Failure.CARNET_EMPTY: ("user", 600, 3600),
+    Failure.ERROR: ("facility", 0.5, 10),
+}
+
+# Failures that are expected until courts are released, and that are not
+# backed off from during the burst window
+RELEASE_FAILURES = (Failure.DATE_UNAVAILABLE,)
+
+
+class RateController:
+    def __init__(
+        self,
+        usernames: List[str],
+        facility_names: List[str],
+        user_rate: float = 2,
+        facility_rate: float = 10,
+        burst_factor: float = 5,
+    ):
+        """
+        Rate controller shared by all the worker processes. Every attempt
+        takes a token from the bucket of its user and from the bucket of its
+        facility, and failures put the user or the facility on hold for a
+        while depending on their reason. During the burst window, around the
+        release of the courts, the rates are multiplied and the failures that
+        are expected before the release are not backed off from.
+
+        Parameters
+        ----------
+        usernames : List[str]
+            Users to control.
+
+        facility_names : List[str]
+            Facilities to control.
+
+        user_rate : float, optional
+            Attempts per second per user, by default 2. 0 disables the limit.
+
+        facility_rate : float, optional
+            Attempts per second per facility, by default 10. 0 disables the
+            limit.
+
+        burst_factor : float, optional
+            Factor applied to the rates during the burst window, by default 5
+        """
+        keys = [f"user:{u}" for u in usernames]
+        keys += [f"facility:{f}" for f in facility_names]
+        self.index = {key: i for i, key in enumerate(keys)}
+        self.rates = [user_rate] * len(usernames)
+        self.rates += [facility_rate] * len(facility_names)
+        self.burst_factor = burst_factor
+
+        self.lock = multiprocessing.Lock()
+        self.tokens = multiprocessing.Array("d", [1.0] * len(keys), lock=False)
+        self.updated_at = multiprocessing.Array("d", [0.0] * len(keys), lock=False)
+        self.blocked_until = multiprocessing.Array("d", [0.0] * len(keys), lock=False)
+        self.failures = multiprocessing.Array("i", [0] * len(keys), lock=False)
+        # Start and end of the burst window, 0 if there is none
+        self.burst = multiprocessing.Array("d", [0.0, 0.0], lock=False)
+
+    def set_burst_window(self, start: float, end: float) -> None:
+        self.burst[0], self.burst[1] = start, end
+
+    def in_burst(self, now: Optional[float] = None) -> bool:
+        now = time.time() if now is None else now
+        return self.burst[0] <= now < self.burst[1]
+
+    def acquire(self, username: str, facility_name: str) -> float:
+        """
+        Take a token for an attempt of a user at a facility. It will return 0
+        if the attempt can be made right away, and otherwise the number of
+        seconds to wait before trying again, in which case no token is taken.
+        """
+        keys = [self.index.get(f"user:{username}")]
+        keys += [self.index.get(f"facility:{facility_name}")]
+        keys = [key for key in keys if key is not None]
+
+        now = time.time()
+        factor = self.burst_factor if self.in_burst(now) else 1
+
+        with self.lock:
+            delay = 0.0
+            for key in keys:
+                delay = max(delay, self.blocked_until[key] - now)
+                rate = self.rates[key] * factor
+                if rate <= 0:
+                    continue
+                # Buckets hold at most one token so that attempts are spread
+                elapsed = now - self.updated_at[key]
+                self.tokens[key] = min(1.0, self.tokens[key] + elapsed * rate)
+                self.updated_at[key] = now
+                delay = max(delay, (1.0 - self.tokens[key]) / rate)
+
+            if delay > 0:
+                return delay
+
+            for key in keys:
+                if self.rates[key] > 0:
+                    self.tokens[key] -= 1.0
+            return 0.0
+
+    def pause(self, username: str, until: float, failure: Failure) -> None:
+        """
+        Put a user on hold until a given time, for a failure known ahead of
+        its attempts.
+        """
+        user = self.index.get(f"user:{username}")
+        if user is None:
+            return
+
+        with self.lock:
+            self.blocked_until[user] = max(self.blocked_until[user], until)
+
+        logging.warning(
+            f"Pausing user {username} for {until - time.time():.0f} seconds.",
+            {"reason": failure.value},
+        )
+
+    def report(self, username: str, facility_name: str, record: Optional[dict]) -> None:
+        """
+        Report the outcome of an attempt from the record logged by its timer.
+        A failure with a known reason puts its user or its facility on hold,
+        for longer after every consecutive failure, and a success clears the
+        failures of both.
+        """
+        if record is None:
+            return
+
+        failure = None
+        if record.get("reason") is not None:
+            failure = Failure(record["reason"])
+        elif record["outcome"] == "error":
+            failure = Failure.ERROR
+        elif record["outcome"] != "success":
+            return
+
+        user = self.index.get(f"user:{username}")
+        facility = self.index.get(f"facility:{facility_name}")
+
+        with self.lock:
+            if failure is None:
+                for key in (user, facility):
+                    if key is not None:
+                        self.failures[key] = 0
+                return
+
+            if failure not in BACKOFF:
+                return
+            if failure in RELEASE_FAILURES and self.in_burst():
+                return
+
+            scope, base, maximum = BACKOFF[failure]
+            key = user if scope == "user" else facility
+            if key is None:
+                return
+
+            delay = min(maximum, base * 2 ** min(self.failures[key], 16))
+            self.failures[key] += 1
+            self.blocked_until[key] = max(self.blocked_until[key], time.time() + delay)
+
+        if delay >= 10:
+            logging.warning(
+                f"Pausing {scope} {username if scope == 'user' else facility_name} "
+                f"for {delay:.0f} seconds.",
+                {"reason": failure.value},
+            )
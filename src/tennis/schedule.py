@@ -0,0 +1,220 @@
+import logging
+import multiprocessing
+import os
+import queue
+
+from contextlib import contextmanager
+
+from .tennis import Availability
+from .auth import User
+
+from typing import Iterator, List, Optional, Tuple
+
+
+class AccountLocks:
+    def __init__(self, users: List[User]):
+        """
+        One lock per user, shared by all the worker processes. A worker holds
+        the lock of a user while it makes a reservation with that user, so
+        that two workers never race the same account into the "already has a
+        reservation" failure.
+        """
+        self.locks = {user.username: multiprocessing.Lock() for user in users}
+
+    @contextmanager
+    def hold(self, username: str) -> Iterator[bool]:
+        """
+        Try to take the lock of a user without waiting. Yields True if the
+        lock was taken, and False if another worker holds it.
+        """
+        lock = self.locks.get(username)
+        if lock is None:
+            yield True
+            return
+
+        if not lock.acquire(block=False):
+            logging.warning(f"Account {username} is being used by another worker.")
+            yield False
+            return
+
+        try:
+            yield True
+        finally:
+            lock.release()
+
+
+class BookingClaim:
+    def __init__(self, timeout: float = 30):
+        """
+        Claim on the one court the fleet books, shared by all the worker
+        processes. A worker holds the claim from the reservation of a court to
+        its payment and marks it booked once paid, so that workers that find
+        a court at the same time, even with different users, never pay for
+        more than one.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Number of seconds to wait for the reservation of another worker
+            to end, by default 30
+        """
+        self.timeout = timeout
+        self.lock = multiprocessing.Lock()
+        self.booked = multiprocessing.Value("b", 0, lock=False)
+        # Process ID of the worker holding the claim, 0 if none
+        self.holder = multiprocessing.Value("i", 0, lock=False)
+
+    def mark_booked(self) -> None:
+        """
+        Record that the holder of the claim booked a court. Other workers are
+        refused the claim from then on.
+        """
+        self.booked.value = 1
+
+    @contextmanager
+    def hold(self) -> Iterator[bool]:
+        """
+        Take the claim, waiting for the reservation of another worker to end.
+        Yields True if the claim was taken, and False if a court was booked
+        or the claim was not released in time.
+        """
+        if self.booked.value:
+            logging.warning("A court was already booked by another worker.")
+            yield False
+            return
+
+        if not self.lock.acquire(timeout=self.timeout):
+            logging.warning("Another worker held the booking claim for too long.")
+            yield False
+            return
+
+        try:
+            if self.booked.value:
+                logging.warning("A court was already booked by another worker.")
+                yield False
+                return
+            self.holder.value = os.getpid()
+            yield True
+        finally:
+            self.holder.value = 0
+            self.lock.release()
+
+    def abandon(self, pid: int) -> None:
+        """
+        Release the claim held by a worker that died, so that the other
+        workers do not wait for it.
+        """
+        if pid and self.holder.value == pid:
+            self.holder.value = 0
+            self.lock.release()
+            logging.warning(f"Released the booking claim of dead worker {pid}.")
+
+
+def diagonal_jobs(
+    users: List[User], groups: List[List[Availability]]
+) -> List[Tuple[User, List[Availability]]]:
+    """
+    Pair every user with every group, walking the diagonals of the users x
+    groups grid so that consecutive jobs differ in both the user and the
+    group.
+    """
+    jobs = []
+    for d in range(len(groups)):
+        for u, user in enumerate(users):
+            jobs.append((user, groups[(u + d) % len(groups)]))
+    return jobs
+
+
+class Scheduler:
+    def __init__(
+        self, users: List[User], groups: List[List[Availability]], workers: int
+    ):
+        """
+        Scheduler object. This object spreads the (user, group) pairs over the
+        workers through a shared queue, so that each worker checks a different
+        pair at any given time instead of all of them checking the same one. A
+        worker takes a pair, makes one attempt and puts it back at the end of
+        the queue.
+
+        Parameters
+        ----------
+        users : List[User]
+            Users to book with.
+
+        groups : List[List[Availability]]
+            Groups of availabilities to book, as returned by
+            Preferences.group. The availabilities of a group are all checked
+            by a single attempt.
+
+        workers : int
+            Number of worker processes.
+        """
+        self.jobs = diagonal_jobs(users, groups)
+
+        self.queue = multiprocessing.Queue()
+        for index in range(len(self.jobs)):
+            self.queue.put(index)
+
+        # Job held by each worker, -1 if none
+        self.leases = multiprocessing.Array("i", [-1] * workers)
+        # Number of attempts made on each job
+        self.attempts = multiprocessing.Array("i", [0] * len(self.jobs))
+
+    def take(
+        self, slot: int, timeout: float = 1.0
+    ) -> Optional[Tuple[int, User, List[Availability]]]:
+        """
+        Take the next job for the worker in the given slot. It will return
+        None if no job became available before the timeout.
+        """
+        try:
+            index = self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+        self.leases[slot] = index
+        user, group = self.jobs[index]
+        return index, user, group
+
+    def put_back(self, slot: int, index: int, attempted: bool = True) -> None:
+        """
+        Record an attempt on a job and put it back in the queue. A job that
+        was skipped without an attempt is put back without being recorded.
+        """
+        if attempted:
+            with self.attempts.get_lock():
+                self.attempts[index] += 1
+        self.leases[slot] = -1
+        self.queue.put(index)
+
+    def release(self, slot: int) -> None:
+        """
+        Put back the job of a worker that died, so that the other workers keep
+        checking it.
+        """
+        index = self.leases[slot]
+        if index >= 0:
+            self.leases[slot] = -1
+            self.queue.put(index)
+            logging.warning(f"Requeued job {index} of dead worker {slot}.")
+
+    def log_coverage(self, elapsed: float) -> None:
+        """
+        Log how often each (user, group) pair was checked.
+        """
+        attempts = list(self.attempts)
+        if not attempts or elapsed <= 0:
+            return
+
+        logging.info(
+            "Coverage",
+            {
+                "elapsed": round(elapsed, 3),
+                "attempts": sum(attempts),
+                "attempts_per_second": round(sum(attempts) / elapsed, 3),
+                "jobs": len(attempts),
+                "jobs_checked": sum(1 for a in attempts if a > 0),
+                "min_checks_per_second": round(min(attempts) / elapsed, 3),
+                "max_checks_per_second": round(max(attempts) / elapsed, 3),
+            },
+        )
@@ -0,0 +1,42 @@
+import multiprocessing
+import time
+
+
+class Cancelled(Exception):
+    pass
+
+
+class StopFlag:
+    def __init__(self):
+        """
+        Flag shared by all the worker processes to stop them once a court is
+        booked. Checking the flag reads a double in shared memory, which is
+        cheap enough to be done between every step of an attempt.
+        """
+        self.event = multiprocessing.Event()
+        # Time at which the flag was set, 0 if not set
+        self.set_at = multiprocessing.Value("d", 0.0, lock=False)
+
+    def set(self) -> None:
+        if self.set_at.value == 0.0:
+            self.set_at.value = time.time()
+        self.event.set()
+
+    def is_set(self) -> bool:
+        return self.set_at.value != 0.0
+
+    def wait(self, timeout: float = None) -> bool:
+        return self.event.wait(timeout)
+
+    def check(self) -> None:
+        """
+        Raise Cancelled if the flag is set.
+        """
+        if self.set_at.value != 0.0:
+            raise Cancelled()
+
+    def latency(self) -> float:
+        """
+        Number of seconds elapsed since the flag was set.
+        """
+        return time.time() - self.set_at.value
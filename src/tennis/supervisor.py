@@ -0,0 +1,228 @@
+import logging
+import multiprocessing
+import os
+import signal
+import time
+
+from dataclasses import dataclass, field
+
+from typing import Callable, List, Optional
+
+
+def kill_group(pid: int, sig: int = signal.SIGKILL) -> None:
+    """
+    Send a signal to the process group led by a process, which includes the
+    browsers it started even once it has died.
+    """
+    try:
+        os.killpg(pid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+@dataclass
+class WorkerState:
+    slot: int
+    process: Optional[multiprocessing.Process] = None
+    started_at: float = 0.0
+    restarts: int = 0
+    # Number of deaths in a row of workers that did not live long
+    failures: int = 0
+    restart_at: Optional[float] = None
+    # Whether the slot will not be restarted anymore
+    done: bool = False
+    restarted_at: List[float] = field(default_factory=list)
+
+
+class Supervisor:
+    def __init__(
+        self,
+        target: Callable,
+        args: Callable[[int], tuple],
+        workers: int,
+        on_death: Optional[Callable[[int], None]] = None,
+        cleanup: Optional[Callable[[int], None]] = None,
+        backoff: float = 1,
+        max_backoff: float = 60,
+        max_restarts: int = 100,
+        healthy_after: float = 60,
+    ):
+        """
+        Supervisor of the worker processes. Every worker leads its own process
+        group, so that its browsers can be killed with it. A worker that dies
+        is restarted after a delay that doubles with every death in a row,
+        and workers that lived long enough start over from the initial delay.
+
+        Parameters
+        ----------
+        target : Callable
+            Function run by the workers. It must call os.setsid() first.
+
+        args : Callable[[int], tuple]
+            Function returning the arguments of the worker of a slot.
+
+        workers : int
+            Number of workers.
+
+        on_death : Callable[[int], None], optional
+            Function called with the slot of a worker that died.
+
+        cleanup : Callable[[int], None], optional
+            Function called with the process ID of a worker that died, once
+            its browsers are killed, to remove the files they left behind.
+
+        backoff : float, optional
+            Number of seconds before restarting a worker, by default 1
+
+        max_backoff : float, optional
+            Maximum number of seconds before restarting a worker, by default 60
+
+        max_restarts : int, optional
+            Number of restarts after which a slot is given up, by default 100
+
+        healthy_after : float, optional
+            Number of seconds after which a worker that dies is restarted
+            with the initial delay again, by default 60
+        """
+        self.target = target
+        self.args = args
+        self.on_death = on_death
+        self.cleanup = cleanup
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_restarts = max_restarts
+        self.healthy_after = healthy_after
+        self.states = [WorkerState(slot) for slot in range(workers)]
+        self.started_at = time.time()
+
+    @property
+    def processes(self) -> List[Optional[multiprocessing.Process]]:
+        return [state.process for state in self.states]
+
+    @property
+    def alive(self) -> int:
+        return sum(1 for p in self.processes if p is not None and p.is_alive())
+
+    @property
+    def done(self) -> bool:
+        """
+        Whether no worker is running nor will be restarted.
+        """
+        return all(state.done for state in self.states)
+
+    def start(self) -> None:
+        self.started_at = time.time()
+        for state in self.states:
+            self._spawn(state)
+
+    def _spawn(self, state: WorkerState) -> None:
+        state.process = multiprocessing.Process(
+            target=self.target, args=self.args(state.slot)
+        )
+        state.process.start()
+        state.started_at = time.time()
+        state.restart_at = None
+
+    def poll(self) -> None:
+        """
+        Clean up after the workers that died and restart the ones that are
+        due.
+        """
+        now = time.time()
+        for state in self.states:
+            process = state.process
+            if process is not None and not process.is_alive():
+                self._reap(state, now)
+            elif process is None and not state.done and state.restart_at <= now:
+                state.restarts += 1
+                state.restarted_at.append(now)
+                logging.info(
+                    f"Restarting worker {state.slot}.", {"restarts": state.restarts}
+                )
+                self._spawn(state)
+
+    def _reap(self, state: WorkerState, now: float) -> None:
+        process = state.process
+        state.process = None
+        # Browsers of the worker outlive it, kill them with its group
+        kill_group(process.pid)
+        if self.cleanup is not None:
+            self.cleanup(process.pid)
+        if self.on_death is not None:
+            self.on_death(state.slot)
+
+        uptime = now - state.started_at
+        if process.exitcode == 0:
+            logging.info(f"Worker {state.slot} exited.", {"uptime": round(uptime, 3)})
+            state.done = True
+            return
+
+        if uptime >= self.healthy_after:
+            state.failures = 0
+        state.failures += 1
+
+        if state.restarts >= self.max_restarts:
+            logging.error(
+                f"Worker {state.slot} died, giving up after {state.restarts} restarts.",
+                {"exitcode": process.exitcode, "uptime": round(uptime, 3)},
+            )
+            state.done = True
+            return
+
+        delay = min(self.max_backoff, self.backoff * 2 ** min(state.failures - 1, 16))
+        state.restart_at = now + delay
+        logging.error(
+            f"Worker {state.slot} died, restarting it in {delay:.1f} seconds.",
+            {"exitcode": process.exitcode, "uptime": round(uptime, 3)},
+        )
+
+    def stats(self) -> dict:
+        """
+        Number of workers alive and restart counts, overall and over the last
+        hour.
+        """
+        now = time.time()
+        restarts = sum(state.restarts for state in self.states)
+        last_hour = sum(
+            1 for state in self.states for t in state.restarted_at if now - t < 3600
+        )
+        return {
+            "workers": len(self.states),
+            "workers_alive": self.alive,
+            "workers_done": sum(1 for s in self.states if s.done),
+            "restarts": restarts,
+            "restarts_last_hour": last_hour,
+            "restarts_per_hour": round(
+                restarts / max(now - self.started_at, 1) * 3600, 3
+            ),
+            "uptime": round(now - self.started_at, 3),
+        }
+
+    def log_stats(self) -> None:
+        logging.info("Supervisor", self.stats())
+
+    def stop(self, timeout: float) -> None:
+        """
+        Wait for the workers to exit on their own, then terminate the ones
+        still running after the timeout, kill whatever is left of their
+        process groups and clean up after them.
+        """
+        deadline = time.time() + timeout
+        processes = [p for p in self.processes if p is not None]
+        for process in processes:
+            process.join(timeout=max(0, deadline - time.time()))
+
+        stragglers = [p for p in processes if p.is_alive()]
+        for process in stragglers:
+            logging.warning(f"Worker {process.pid} did not stop in time.")
+            kill_group(process.pid, signal.SIGTERM)
+
+        deadline = time.time() + 1
+        for process in stragglers:
+            process.join(timeout=max(0, deadline - time.time()))
+
+        for process in processes:
+            kill_group(process.pid)
+            process.join()
+            if self.cleanup is not None:
+                self.cleanup(process.pid)
@@ -1,10 +1,21 @@
 from dataclasses import dataclass
-from typing import List
+from typing import List, Optional, Tuple
 from enum import Enum
 
 
+# Records are slotted: a catalog holds hundreds of courts and a search
+# thousands of availabilities, which are also pickled to every worker
 @dataclass
 class Court:
+    __slots__ = (
+        "id",
+        "name",
+        "facility_name",
+        "location",
+        "surface_type",
+        "leaflet_index",
+    )
+
     class Location(Enum):
         OUTDOOR = "outdoor"
         INDOOR = "indoor"
@@ -18,6 +29,8 @@ class Court:
     facility_name: str
     location: Location
     surface_type: SurfaceType
+    # Position of the marker of the facility on the map of the search results
+    leaflet_index: Optional[int]
 
     def __str__(self) -> str:
         return f"{self.facility_name} {self.name} ({self.id})"
@@ -25,6 +38,8 @@ class Court:
 
 @dataclass
 class DateTime:
+    __slots__ = ("date", "time")
+
     date: str
     time: str
 
@@ -37,6 +52,8 @@ class DateTime:
 
 @dataclass
 class Facility:
+    __slots__ = ("name", "leaflet_index", "courts")
+
     name: str
     leaflet_index: int
     courts: List[Court]
@@ -55,6 +72,7 @@ class Facility:
                     facility_name=data["name"],
                     location=Court.Location(court["location"]),
                     surface_type=Court.SurfaceType(court["surface_type"]),
+                    leaflet_index=data.get("leaflet_index"),
                 )
             )
 
@@ -65,8 +83,18 @@ class Facility:
 
 @dataclass
 class Availability:
+    __slots__ = ("date_time", "court")
+
     date_time: DateTime
     court: Court
 
     def __str__(self) -> str:
         return f"{self.court} {self.date_time}"
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        """
+        Court ID and date time as written in the courtid and datedeb
+        attributes of the reserve buttons of the website.
+        """
+        return self.court.id, str(self.date_time)
@@ -1,5 +1,9 @@
 import sys
+import logging
 import logging.config
+import multiprocessing
+
+from zlog.handlers import QueueHandler, QueueListener
 
 
 LOGGING_CONFIG = {
@@ -17,11 +21,74 @@ LOGGING_CONFIG = {
 }
 
 
-def configure(loggers=None, hacks=None, pretty=False):
+# Listener of the queue-based mode, started by configure
+listener = None
+# Loggers whose handlers were replaced by the one of the queue, with them
+replaced = []
+
+
+def configure(
+    loggers=None,
+    hacks=None,
+    pretty=False,
+    fast=False,
+    queue_size=0,
+    batch_size=256,
+    debug_sample=1,
+    queue=None,
+):
+    """
+    Configure the logging of the process. With a queue_size, the handlers
+    only put records in a queue of that size, shared with the processes
+    forked afterwards, and the records are formatted and written in batches
+    by a listener thread of this process. Records that do not fit in the
+    queue are dropped rather than waited for, and only one out of
+    debug_sample debug records is kept. The records queued by the time the
+    process exits are written, or by the time stop is called.
+
+    Processes that are not forked, e.g. by a forkserver, do not inherit the
+    handlers: they pass the queue of the process that started the listener,
+    whose listener writes their records too.
+    """
+    global listener
+    stop()
     if loggers is not None:
         LOGGING_CONFIG["loggers"] = loggers
     if hacks is not None:
         LOGGING_CONFIG["formatters"]["formatter"]["hacks"] = hacks
     if pretty:
         LOGGING_CONFIG["formatters"]["formatter"]["pretty"] = True
+    if fast:
+        LOGGING_CONFIG["formatters"]["formatter"]["fast"] = True
     logging.config.dictConfig(LOGGING_CONFIG)
+
+    if queue_size > 0 or queue is not None:
+        listen = queue is None
+        if listen:
+            queue = multiprocessing.Queue(queue_size)
+        handler = QueueHandler(queue, debug_sample=debug_sample)
+        handlers = []
+        for name in [None] + list(LOGGING_CONFIG.get("loggers", {})):
+            logger = logging.getLogger(name)
+            if not logger.handlers:
+                continue
+            replaced.append((logger, logger.handlers[:]))
+            handlers += [h for h in logger.handlers if h not in handlers]
+            logger.handlers = [handler]
+        if listen:
+            listener = QueueListener(queue, handlers, batch_size=batch_size)
+            listener.start()
+
+
+def stop():
+    """
+    Write the records queued so far, stop the listener of the queue-based
+    mode if it was started and give the loggers their handlers back.
+    """
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+    while replaced:
+        logger, handlers = replaced.pop()
+        logger.handlers = handlers
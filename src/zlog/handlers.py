@@ -0,0 +1,166 @@
+import atexit
+import copy
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+
+from zlog.formatter import LOGRECORD_RESERVED_ATTRS, exception_fields
+
+
+def _picklable(value):
+    """
+    Copy of a value that can be sent to another process, with the objects
+    the JSON encoder would have turned into strings already turned into
+    strings.
+    """
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    if isinstance(value, tuple):
+        # Tuples of args are formatted differently from lists
+        return tuple(_picklable(v) for v in value)
+    if isinstance(value, list):
+        return [_picklable(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _picklable(v) for k, v in value.items()}
+    return str(value)
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """
+    Handler putting records in a bounded multiprocessing queue, formatted
+    later by a QueueListener. It never waits: records that do not fit in the
+    queue are dropped and counted, and the count is logged as soon as there
+    is room again. Only one out of debug_sample debug records is kept.
+    """
+
+    def __init__(self, queue, debug_sample=1):
+        super().__init__(queue)
+        self.debug_sample = max(1, debug_sample)
+        self.debug_seen = 0
+        self.dropped = 0
+
+    def prepare(self, record):
+        # The message and its fields are left to the formatter of the
+        # listener, only what cannot be pickled is turned into strings
+        record = copy.copy(record)
+        if not isinstance(record.msg, str):
+            record.msg = str(record.msg)
+        if record.args is not None:
+            record.args = _picklable(record.args)
+        if record.exc_info is not None:
+            record.exc_fields = _picklable(exception_fields(record.exc_info))
+            record.exc_info = None
+            record.exc_text = None
+        for k, v in list(record.__dict__.items()):
+            if k not in LOGRECORD_RESERVED_ATTRS and not k.startswith("_"):
+                setattr(record, k, _picklable(v))
+        return record
+
+    def emit(self, record):
+        if record.levelno < logging.INFO:
+            self.debug_seen += 1
+            if (self.debug_seen - 1) % self.debug_sample:
+                return
+
+        try:
+            if self.dropped:
+                self.queue.put_nowait(
+                    logging.makeLogRecord(
+                        {
+                            "name": "zlog",
+                            "levelno": logging.WARNING,
+                            "levelname": "WARNING",
+                            "msg": "Dropped log records, the queue was full.",
+                            "args": {"dropped": self.dropped},
+                        }
+                    )
+                )
+                self.dropped = 0
+            self.queue.put_nowait(self.prepare(record))
+        except queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+
+class QueueListener:
+    def __init__(self, queue, handlers, batch_size=256):
+        """
+        Listener formatting the records of a QueueHandler in a thread of the
+        process that started it. It takes all the records waiting in the
+        queue at once, up to batch_size, and writes each batch to the stream
+        of a handler with a single write and a single flush.
+
+        Parameters
+        ----------
+        queue : multiprocessing.Queue
+            Queue of the records.
+
+        handlers : List[logging.Handler]
+            Handlers of the records.
+
+        batch_size : int, optional
+            Maximum number of records written at once, by default 256
+        """
+        self.queue = queue
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.pid = os.getpid()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        atexit.register(self.stop)
+
+    def stop(self, timeout=5):
+        """
+        Wait for the records queued so far to be written, including the ones
+        of the processes that exited, and stop the thread.
+        """
+        # Forked processes inherit the listener but not its thread
+        if self.thread is None or os.getpid() != self.pid:
+            return
+        self.queue.put(None)
+        self.thread.join(timeout)
+        self.thread = None
+        atexit.unregister(self.stop)
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                stop = True
+                batch = batch[: batch.index(None)]
+            self.handle(batch)
+
+    def handle(self, batch):
+        for handler in self.handlers:
+            records = [r for r in batch if r.levelno >= handler.level]
+            if not records:
+                continue
+            if not isinstance(handler, logging.StreamHandler):
+                for record in records:
+                    handler.handle(record)
+                continue
+
+            lines = []
+            for record in records:
+                try:
+                    lines.append(handler.format(record) + handler.terminator)
+                except Exception:
+                    handler.handleError(record)
+            with handler.lock:
+                try:
+                    handler.stream.write("".join(lines))
+                    handler.flush()
+                except Exception:
+                    handler.handleError(records[-1])